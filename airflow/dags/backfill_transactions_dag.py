@@ -21,3 +21,11 @@ with DAG(
         env=ENV,
     )
 
+    # Back-dated rows have no feature rows yet, so the incremental run picks them up
+    features = BashOperator(
+        task_id="build_features",
+        bash_command=f"cd {PROJECT_DIR} && python -m src.cli features --incremental",
+        env=ENV,
+    )
+
+    backfill >> features
@@ -36,7 +36,7 @@ with DAG(
 
     features = BashOperator(
         task_id="build_features",
-        bash_command=f"cd {PROJECT_DIR} && python -m src.cli features",
+        bash_command=f"cd {PROJECT_DIR} && python -m src.cli features --incremental",
         env=ENV,
     )
 
@@ -0,0 +1,91 @@
+"""Alert materialization and write throughput: per-row loop vs columnar + COPY.
+
+Usage:
+    python -m benchmarks.alerts_throughput --rows 500000
+    python -m benchmarks.alerts_throughput --rows 200000 --db   # also time DB writes
+"""
+from __future__ import annotations
+
+import argparse
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from src.rules.engine import evaluate_rules
+
+
+RULES = [
+    {"name": "high_value", "params": {"amount_threshold": 1000.0}},
+    {"name": "high_risk_mcc", "params": {"high_risk_mcc": [4829, 5967, 7995, 6051]}},
+    {"name": "night_owl_cnp", "params": {"cnp_channels": ["ECOM"], "start_hour": 0, "end_hour": 5}},
+]
+
+
+def _frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "tx_id": [str(uuid.UUID(int=int(x))) for x in rng.integers(0, 2**63, size=rows)],
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 86400 * 2, size=rows), unit="s"),
+        "amount": rng.lognormal(3.5, 1.5, size=rows),
+        "channel": rng.choice(["POS", "ECOM", "ATM"], size=rows, p=[0.6, 0.35, 0.05]),
+        # Noisy day: half the traffic lands on high-risk MCCs
+        "mcc": rng.choice([5411, 7995, 5967], size=rows, p=[0.5, 0.25, 0.25]),
+    })
+
+
+def _alerts_iterrows(df: pd.DataFrame, rules: list[dict]) -> pd.DataFrame:
+    """The pre-vectorization path: a Python dict per flagged row."""
+    from src.rules.engine import _get_predicate
+    out = []
+    for rule in rules:
+        mask = _get_predicate(rule["name"])(df, **rule["params"])
+        for _, row in df[mask].iterrows():
+            out.append({"tx_id": row["tx_id"], "rule_name": rule["name"], "score": 1.0})
+    return pd.DataFrame(out)
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+
+def _db_writes(alerts: pd.DataFrame) -> None:
+    from src.utils import copy_df, get_engine
+    eng = get_engine()
+    with eng.begin() as con:
+        con.exec_driver_sql("CREATE TEMP TABLE bench_alerts (tx_id TEXT, rule_name TEXT, score NUMERIC)")
+        t0 = time.perf_counter()
+        alerts.to_sql("bench_alerts", con, if_exists="append", index=False, chunksize=5000, method="multi")
+        t_multi = time.perf_counter() - t0
+        con.exec_driver_sql("TRUNCATE bench_alerts")
+        t0 = time.perf_counter()
+        copy_df(alerts, "bench_alerts", con=con)
+        t_copy = time.perf_counter() - t0
+    print(f"write to_sql(multi): {len(alerts) / t_multi:12,.0f} alerts/s ({t_multi:.2f}s)")
+    print(f"write COPY:          {len(alerts) / t_copy:12,.0f} alerts/s ({t_copy:.2f}s)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", type=int, default=500_000)
+    p.add_argument("--db", action="store_true", help="Also time DB writes (needs a reachable database)")
+    args = p.parse_args(argv)
+
+    df = _frame(args.rows)
+    before, t_before = _timed(_alerts_iterrows, df, RULES)
+    after, t_after = _timed(evaluate_rules, df, RULES)
+    assert len(before) == len(after), "vectorized path must emit the same alerts"
+    n = len(after)
+    print(f"{args.rows:,} rows -> {n:,} alerts")
+    print(f"build iterrows:      {n / t_before:12,.0f} alerts/s ({t_before:.2f}s)")
+    print(f"build vectorized:    {n / t_after:12,.0f} alerts/s ({t_after:.2f}s)")
+    if args.db:
+        _db_writes(after)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
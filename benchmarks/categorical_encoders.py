@@ -0,0 +1,125 @@
+"""High-cardinality ``device_id`` encoders: one-hot vs hashing vs frequency vs target.
+
+Generates time-ordered synthetic ``model_features`` rows whose ``device_id``
+is drawn (skewed) from 150k values, like the transaction generator, with a
+small set of risky devices carrying extra fraud. For each encoder of the
+device column (the other categoricals stay one-hot) it fits the pipeline on
+the first 80% of rows and reports, on the last 20%: preprocessing rows/sec,
+design-matrix width, fit seconds, joblib artifact size, single-row scoring
+p50 (pipeline, and the compiled evaluator for tree models), batch scoring
+rows/sec and PR-AUC.
+
+Usage:
+    python -m benchmarks.categorical_encoders --rows 200k --algo rf
+    python -m benchmarks.categorical_encoders --encoders hashing:256 hashing:4096 target
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import average_precision_score
+
+from benchmarks.predict_throughput import CATEGORICAL, NUMERIC, feature_frame
+from benchmarks.rules_scale import parse_count
+from src.ml.compiled import compile_pipeline
+from src.ml.train import build_pipeline
+
+
+DEVICES = 150_000
+
+
+def device_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = feature_frame(rows, seed).sort_values("ts", kind="stable").reset_index(drop=True)
+    # Skewed like real device reuse: a few devices are busy, most appear once or twice
+    device = (DEVICES * rng.random(rows) ** 3).astype(np.int64)
+    risky = np.isin(device, rng.choice(2_000, size=100, replace=False))
+    df["device_id"] = np.char.add("dev_", device.astype(str))
+    df["label_fraud"] = df["label_fraud"] | (risky & (rng.random(rows) < 0.4))
+    return df
+
+
+def parse_encoder(choice: str) -> dict:
+    kind, _, width = choice.partition(":")
+    return {"type": kind, "n_features": int(width)} if kind == "hashing" and width else {"type": kind}
+
+
+def _latencies(fn, rows: list[dict]) -> list[float]:
+    lat = []
+    for row in rows:
+        t0 = time.perf_counter()
+        fn(row)
+        lat.append(time.perf_counter() - t0)
+    return lat
+
+
+def run(choice: str, algo: str, train: pd.DataFrame, test: pd.DataFrame, single: int) -> dict:
+    X_train, y_train = train.drop(columns=["label_fraud", "tx_id", "ts"]), train["label_fraud"].astype(int)
+    X_test, y_test = test.drop(columns=["label_fraud", "tx_id", "ts"]), test["label_fraud"].astype(int)
+    pipe = build_pipeline(NUMERIC, CATEGORICAL, algo, {"device_id": parse_encoder(choice)})
+    t0 = time.perf_counter()
+    pipe.fit(X_train, y_train)
+    fit_secs = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    width = pipe.named_steps["pre"].transform(X_test).shape[1]
+    pre_rate = len(X_test) / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    proba = pipe.predict_proba(X_test)[:, 1]
+    score_rate = len(X_test) / (time.perf_counter() - t0)
+    rows = X_test.iloc[:single].to_dict("records")
+    lat = _latencies(lambda row: pipe.predict_proba(pd.DataFrame([row])), rows)
+    compiled_p50 = None
+    if algo != "lr":
+        try:
+            compiled_p50 = float(np.percentile(_latencies(compile_pipeline(pipe).predict_one, rows), 50) * 1000)
+        except ValueError:
+            pass  # hashing has no compiled form
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.joblib")
+        joblib.dump({"pipeline": pipe}, path)
+        size_mb = os.path.getsize(path) / 2**20
+    return {
+        "encoder": choice,
+        "width": width,
+        "pre_rows_per_sec": pre_rate,
+        "fit_secs": fit_secs,
+        "artifact_mb": size_mb,
+        "single_p50_ms": float(np.percentile(lat, 50) * 1000),
+        "compiled_p50_ms": compiled_p50,
+        "score_rows_per_sec": score_rate,
+        "pr_auc": average_precision_score(y_test, proba),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", default="100k")
+    p.add_argument("--algo", choices=["lr", "rf", "xgb"], default="rf")
+    p.add_argument("--encoders", nargs="+", default=["onehot", "hashing:1024", "frequency", "target"],
+                   help="onehot | hashing[:n_features] | frequency | target")
+    p.add_argument("--single", type=int, default=200, help="Single-row scoring calls for the latency p50")
+    args = p.parse_args(argv)
+
+    df = device_frame(parse_count(args.rows))
+    cut = int(len(df) * 0.8)
+    train, test = df.iloc[:cut], df.iloc[cut:]
+    print(f"{len(df):,} rows, {df['device_id'].nunique():,} devices, {args.algo}, fraud rate {df['label_fraud'].mean():.3f}")
+    print(f"{'encoder':>13} {'width':>8} {'pre rows/s':>11} {'fit s':>7} {'artifact MB':>12} {'1-row p50 ms':>13} {'compiled ms':>12} {'score rows/s':>13} {'PR-AUC':>7}")
+    for choice in args.encoders:
+        r = run(choice, args.algo, train, test, args.single)
+        compiled = "-" if r["compiled_p50_ms"] is None else f"{r['compiled_p50_ms']:.2f}"
+        print(f"{r['encoder']:>13} {r['width']:>8,} {r['pre_rows_per_sec']:>11,.0f} {r['fit_secs']:>7.1f} "
+              f"{r['artifact_mb']:>12.1f} {r['single_p50_ms']:>13.2f} {compiled:>12} {r['score_rows_per_sec']:>13,.0f} {r['pr_auc']:>7.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,69 @@
+"""Feature build: pandas engine (stream + vectorized kernel) vs in-database SQL engine.
+
+Runs a full ``build_features`` with each engine against the configured database
+and compares the resulting ``model_features`` tables. Both runs overwrite
+``model_features``, so point it at a dev database.
+
+Usage:
+    python -m benchmarks.features_engines
+    python -m benchmarks.features_engines --engines sql --repeat 3
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from src.features.build_features import FEATURE_COLUMNS, build_features
+from src.utils import read_sql
+
+
+def _snapshot():
+    return read_sql("SELECT * FROM model_features ORDER BY tx_id")
+
+
+def _max_rel_diff(a, b) -> dict[str, float]:
+    out = {}
+    for col in FEATURE_COLUMNS:
+        x, y = a[col], b[col]
+        if x.dtype.kind == "f" or y.dtype.kind == "f":
+            x, y = x.to_numpy(dtype=float), y.to_numpy(dtype=float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel = np.abs(x - y) / np.maximum(np.abs(y), np.finfo(float).tiny)
+            out[col] = float(np.nanmax(rel)) if len(rel) else 0.0
+        else:
+            out[col] = 0.0 if x.equals(y) else float("inf")
+    return out
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--engines", nargs="+", default=["pandas", "sql"], choices=["pandas", "sql"])
+    p.add_argument("--repeat", type=int, default=1)
+    args = p.parse_args(argv)
+
+    tables = {}
+    print(f"{'engine':<8} {'rows':>10} {'best s':>9} {'rows/s':>12}")
+    for engine in args.engines:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            rows = build_features(engine=engine)
+            best = min(best, time.perf_counter() - t0)
+        tables[engine] = _snapshot()
+        print(f"{engine:<8} {rows:>10,} {best:>9.2f} {rows / best:>12,.0f}")
+
+    if len(tables) == 2:
+        a, b = tables["pandas"], tables["sql"]
+        if len(a) != len(b) or not a["tx_id"].equals(b["tx_id"]):
+            print("Engines wrote different transaction sets")
+            return 1
+        print("max relative difference (sql vs pandas):")
+        for col, diff in _max_rel_diff(b, a).items():
+            print(f"  {col:<24} {diff:.3g}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
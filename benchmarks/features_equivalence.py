@@ -0,0 +1,206 @@
+"""Feature engine equivalence and throughput on seeded synthetic transactions.
+
+Runs every feature implementation on the same frame at each scale, compares
+their output column by column against the reference (the per-card groupby when
+it runs, else the first engine) and reports rows/sec and peak RSS. Each engine
+runs in a fresh process so its peak RSS is its own. The frame includes the
+edge cases the kernels treat specially: cards with a single transaction,
+identical timestamps within a card, rows exactly one window apart and missing
+coordinates.
+
+The ``sql`` engine loads the frame into temporary tables that shadow
+``transactions``-shaped input and ``model_features`` and rolls back, so no
+stored data is touched; it needs a configured database.
+
+Usage:
+    python -m benchmarks.features_equivalence --rows 10k 100k
+    python -m benchmarks.features_equivalence --rows 1M --engines vectorized online sql
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.rules_scale import parse_count
+from src.features.build_features import FEATURE_COLUMNS, compute_features
+
+
+ENGINES = ["groupby", "vectorized", "online", "sql"]
+
+# Floats may differ in the last bits between numpy, libm and Postgres trig
+RTOL = 1e-9
+
+
+def synthetic_transactions(rows: int, tx_per_card: int = 6, days: int = 2, seed: int = 7) -> pd.DataFrame:
+    """Transactions with the columns ``compute_features`` reads, plus edge cases."""
+    rng = np.random.default_rng(seed)
+    cards = max(rows // tx_per_card, 1)
+    card = rng.integers(0, cards, size=rows)
+    ts = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, days * 86_400, size=rows), unit="s")
+    home_lat = rng.uniform(25, 49, size=cards)
+    home_lon = rng.uniform(-124, -67, size=cards)
+    df = pd.DataFrame({
+        "tx_id": [f"{u:032x}" for u in rng.integers(0, 2**63, size=rows, dtype=np.int64)],
+        "card_id": card,
+        "ts": ts,
+        "amount": np.round(rng.lognormal(3.5, 0.9, size=rows), 2),
+        "lat": home_lat[card] + rng.normal(0, 0.5, size=rows),
+        "lon": home_lon[card] + rng.normal(0, 0.5, size=rows),
+        "label_fraud": rng.random(rows) < 0.01,
+        "channel": rng.choice(["POS", "ECOM", "ATM"], size=rows),
+        "device_id": rng.choice([f"dev_{i}" for i in range(50)], size=rows),
+        "merchant_risk_tier": rng.integers(1, 4, size=rows),
+        "brand": rng.choice(["VISA", "MC", "AMEX"], size=rows),
+    })
+    # uuid text layout so Postgres orders tx_id the same way pandas does
+    df["tx_id"] = df["tx_id"].str.replace(r"^(.{8})(.{4})(.{4})(.{4})(.{12})$", r"\1-\2-\3-\4-\5", regex=True)
+    edge = rng.permutation(rows)
+    n = max(rows // 50, 1)
+    # Identical timestamps, and exactly one window apart, relative to another row of the card
+    other = df.groupby("card_id")["ts"].shift()
+    for i, offset in enumerate([pd.Timedelta(0), pd.Timedelta(hours=1), pd.Timedelta(hours=24)]):
+        rows_i = edge[i * n:(i + 1) * n]
+        df.loc[rows_i, "ts"] = (other[rows_i] + offset).fillna(df.loc[rows_i, "ts"])
+    # Missing coordinates
+    df.loc[edge[3 * n:4 * n], ["lat", "lon"]] = np.nan
+    # Cards seen exactly once
+    df.loc[edge[4 * n:5 * n], "card_id"] = cards + np.arange(n)
+    df["card_id"] = df["card_id"].map("card{}".format)
+    return df
+
+
+def _online(df: pd.DataFrame) -> pd.DataFrame:
+    from src.features.online import OnlineFeatureStore
+    return OnlineFeatureStore().replay(df)
+
+
+def _sql(df: pd.DataFrame) -> pd.DataFrame:
+    from sqlalchemy import text
+    from src.features.sql import features_sql
+    from src.utils import copy_df, get_engine
+    eng = get_engine()
+    with eng.connect() as con, con.begin() as tx:
+        con.exec_driver_sql("""
+            CREATE TEMP TABLE _bench_tx (
+                tx_id UUID, card_id TEXT, ts TIMESTAMP, amount DOUBLE PRECISION,
+                lat DOUBLE PRECISION, lon DOUBLE PRECISION, label_fraud BOOLEAN,
+                channel TEXT, device_id TEXT, merchant_risk_tier INT, brand TEXT
+            ) ON COMMIT DROP
+        """)
+        # pg_temp is searched first, so the engine's INSERT lands here
+        con.exec_driver_sql("CREATE TEMP TABLE model_features (LIKE public.model_features INCLUDING ALL) ON COMMIT DROP")
+        copy_df(df, "_bench_tx", con=con)
+        con.execute(text(features_sql("SELECT * FROM _bench_tx")))
+        out = pd.read_sql(text("SELECT * FROM pg_temp.model_features"), con)
+        tx.rollback()
+    out["tx_id"] = out["tx_id"].astype(str)
+    return out
+
+
+_RUNNERS: dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = {
+    "groupby": lambda df: compute_features(df, engine="groupby"),
+    "vectorized": lambda df: compute_features(df, engine="vectorized"),
+    "online": _online,
+    "sql": _sql,
+}
+
+
+def _peak_rss() -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _run_engine(engine: str, df: pd.DataFrame) -> tuple[float, int, pd.DataFrame]:
+    """Seconds, peak process RSS and the engine's output."""
+    t0 = time.perf_counter()
+    out = _RUNNERS[engine](df)
+    secs = time.perf_counter() - t0
+    return secs, _peak_rss(), out
+
+
+def compare(out: pd.DataFrame, ref: pd.DataFrame, rtol: float = RTOL) -> dict[str, int]:
+    """Mismatching rows per shared feature column, joined on ``tx_id``."""
+    out = out.set_index("tx_id")
+    ref = ref.set_index("tx_id")
+    mismatches = {"tx_id": len(out.index.symmetric_difference(ref.index))}
+    common = out.index.intersection(ref.index)
+    for col in FEATURE_COLUMNS[1:]:
+        if col not in out.columns or col not in ref.columns:
+            continue
+        a, b = out.loc[common, col], ref.loc[common, col]
+        if a.dtype.kind in "fiu" and b.dtype.kind in "fiu":
+            a, b = a.to_numpy(dtype=float), b.to_numpy(dtype=float)
+            bad = ~np.isclose(a, b, rtol=rtol, atol=0.0, equal_nan=True)
+        elif col == "ts":
+            bad = (pd.to_datetime(a) != pd.to_datetime(b)).to_numpy()
+        else:
+            bad = ~((a.astype(object) == b.astype(object)) | (a.isna() & b.isna())).to_numpy()
+        mismatches[col] = int(bad.sum())
+    return mismatches
+
+
+def run_case(rows: int, engines: list[str], tx_per_card: int = 6, groupby_max_rows: int = 20_000,
+             isolate: bool = True) -> list[dict]:
+    """Run ``engines`` on one synthetic frame; one result per engine that ran."""
+    df = synthetic_transactions(rows, tx_per_card)
+    results = []
+    ref = None
+    for engine in engines:
+        if engine == "groupby" and rows > groupby_max_rows:
+            continue
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                secs, peak, out = pool.submit(_run_engine, engine, df).result()
+        else:
+            secs, peak, out = _run_engine(engine, df)
+        if ref is None:
+            ref = out
+        mismatches = compare(out, ref)
+        results.append({
+            "rows": rows, "engine": engine, "seconds": secs,
+            "rows_per_sec": rows / secs if secs else float("inf"),
+            "peak_rss_mb": peak / 2**20,
+            "mismatches": {c: n for c, n in mismatches.items() if n},
+        })
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", nargs="+", default=["10k", "100k"], help="Frame sizes, e.g. 10k 100k 1M")
+    p.add_argument("--engines", nargs="+", default=["groupby", "vectorized", "online"], choices=ENGINES)
+    p.add_argument("--tx-per-card", type=int, default=6)
+    p.add_argument("--groupby-max-rows", default="20k", help="Skip the slow groupby reference above this size")
+    p.add_argument("--json", default=None, help="Also write results to this path")
+    args = p.parse_args(argv)
+
+    results = []
+    for rows in (parse_count(x) for x in args.rows):
+        results.extend(run_case(rows, args.engines, args.tx_per_card, parse_count(args.groupby_max_rows)))
+
+    print(f"{'rows':>11} {'engine':<11} {'seconds':>9} {'rows/s':>14} {'peak RSS MB':>12}  mismatches")
+    for r in results:
+        bad = ", ".join(f"{c}={n}" for c, n in r["mismatches"].items()) or "-"
+        print(f"{r['rows']:>11,} {r['engine']:<11} {r['seconds']:>9.3f} {r['rows_per_sec']:>14,.0f} "
+              f"{r['peak_rss_mb']:>12.1f}  {bad}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    failed = [r for r in results if r["mismatches"]]
+    for r in failed:
+        print(f"MISMATCH {r['rows']}:{r['engine']}: {r['mismatches']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
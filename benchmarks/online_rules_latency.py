@@ -0,0 +1,50 @@
+"""Per-transaction latency of the online rule scorer.
+
+Usage:
+    python -m benchmarks.online_rules_latency --tx 200000 --cards 5000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.rules.engine import load_rules
+from src.rules.online import OnlineRuleScorer
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--tx", type=int, default=200_000)
+    p.add_argument("--cards", type=int, default=5_000)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(42)
+    ts = pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 86400 * 2, size=args.tx)), unit="s")
+    txs = pd.DataFrame({
+        "card_id": rng.integers(0, args.cards, size=args.tx),
+        "ts": ts.to_pydatetime(),
+        "amount": rng.lognormal(3.5, 0.7, size=args.tx),
+        "lat": rng.uniform(25, 49, size=args.tx),
+        "lon": rng.uniform(-124, -67, size=args.tx),
+        "channel": rng.choice(["POS", "ECOM", "ATM"], size=args.tx),
+        "mcc": rng.choice([5411, 5732, 7995], size=args.tx),
+    }).to_dict("records")
+
+    scorer = OnlineRuleScorer([r for r in load_rules() if r.get("active", True)])
+    lat_ns = np.empty(len(txs), dtype=np.int64)
+    for i, tx in enumerate(txs):
+        t0 = time.perf_counter_ns()
+        scorer.score(tx)
+        lat_ns[i] = time.perf_counter_ns() - t0
+    us = lat_ns / 1e3
+    print(f"{len(txs):,} tx over {args.cards:,} cards")
+    print(f"p50 {np.percentile(us, 50):.1f}us  p99 {np.percentile(us, 99):.1f}us  max {us.max():.1f}us")
+    print(f"throughput {len(txs) / (lat_ns.sum() / 1e9):,.0f} tx/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
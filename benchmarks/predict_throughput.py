@@ -0,0 +1,120 @@
+"""Batch prediction throughput: one-shot predict + per-row dicts vs chunked column-wise scoring.
+
+Trains the configured feature pipeline on synthetic ``model_features`` rows,
+then scores ``--rows`` rows both ways, reporting scores/sec and peak traced
+memory. ``--db`` also times the writes (``to_sql`` vs ``COPY``) into a temp
+table.
+
+Usage:
+    python -m benchmarks.predict_throughput --rows 2M --algo lr
+    python -m benchmarks.predict_throughput --rows 500k --chunksize 50k --db
+"""
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.rules_scale import parse_count
+from src.ml.predict import score_frame
+from src.ml.train import build_pipeline
+
+
+NUMERIC = ["amount", "last_tx_delta_minutes", "tx_count_1h", "tx_count_24h", "amount_mean_24h", "geo_velocity_kmph_prev"]
+CATEGORICAL = ["channel", "device_id", "merchant_risk_tier", "brand"]
+
+
+def feature_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    amount = rng.lognormal(3.5, 1.0, size=rows)
+    return pd.DataFrame({
+        "tx_id": [str(uuid.UUID(int=int(x))) for x in rng.integers(0, 2**63, size=rows)],
+        "label_fraud": rng.random(rows) < 0.02 + 0.2 * (amount > 300),
+        "amount": amount,
+        "last_tx_delta_minutes": rng.exponential(300, size=rows),
+        "tx_count_1h": rng.poisson(0.5, size=rows),
+        "tx_count_24h": rng.poisson(4, size=rows),
+        "amount_mean_24h": amount * rng.uniform(0.5, 1.5, size=rows),
+        "geo_velocity_kmph_prev": rng.exponential(20, size=rows),
+        "channel": rng.choice(["POS", "ECOM", "ATM"], size=rows),
+        "device_id": rng.choice([f"dev_{i}" for i in range(2_000)], size=rows),
+        "merchant_risk_tier": rng.integers(1, 4, size=rows),
+        "brand": rng.choice(["VISA", "MC", "AMEX"], size=rows),
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 86_400, size=rows), unit="s"),
+    })
+
+
+def _scores_loop(pipe, df: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    """The pre-chunking path: one predict over everything, then a dict per row."""
+    X = df.drop(columns=["label_fraud", "tx_id", "ts"])
+    proba = pipe.predict_proba(X)[:, 1]
+    rows = []
+    for tx_id, p, pred in zip(df["tx_id"].values, proba, proba >= threshold):
+        rows.append({"tx_id": tx_id, "model_name": "bench", "proba": float(p), "predicted_label": bool(pred)})
+    return pd.DataFrame(rows)
+
+
+def _scores_chunked(pipe, df: pd.DataFrame, threshold: float, chunksize: int) -> int:
+    n = 0
+    for start in range(0, len(df), chunksize):
+        n += len(score_frame(pipe, df.iloc[start:start + chunksize], "bench", threshold))
+    return n
+
+
+def _measure(fn, *args) -> tuple[object, float, float]:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn(*args)
+    secs = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, secs, peak / 2**20
+
+
+def _db_writes(scores: pd.DataFrame) -> None:
+    from src.utils import copy_df, get_engine
+    with get_engine().begin() as con:
+        con.exec_driver_sql("CREATE TEMP TABLE bench_scores (LIKE model_scores INCLUDING DEFAULTS)")
+        t0 = time.perf_counter()
+        scores.to_sql("bench_scores", con, if_exists="append", index=False, chunksize=5000, method="multi")
+        t_multi = time.perf_counter() - t0
+        con.exec_driver_sql("TRUNCATE bench_scores")
+        t0 = time.perf_counter()
+        copy_df(scores, "bench_scores", con=con)
+        t_copy = time.perf_counter() - t0
+    print(f"write to_sql(multi): {len(scores) / t_multi:12,.0f} scores/s ({t_multi:.2f}s)")
+    print(f"write COPY:          {len(scores) / t_copy:12,.0f} scores/s ({t_copy:.2f}s)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", default="1M")
+    p.add_argument("--chunksize", default="100k")
+    p.add_argument("--algo", choices=["lr", "rf"], default="lr")
+    p.add_argument("--threshold", type=float, default=0.9)
+    p.add_argument("--db", action="store_true", help="Also time DB writes (needs a reachable database)")
+    args = p.parse_args(argv)
+
+    rows, chunksize = parse_count(args.rows), parse_count(args.chunksize)
+    train = feature_frame(50_000, seed=1)
+    pipe = build_pipeline(NUMERIC, CATEGORICAL, args.algo)
+    pipe.fit(train.drop(columns=["label_fraud", "tx_id", "ts"]), train["label_fraud"].astype(int))
+    df = feature_frame(rows)
+
+    before, t_before, m_before = _measure(_scores_loop, pipe, df, args.threshold)
+    n, t_after, m_after = _measure(_scores_chunked, pipe, df, args.threshold, chunksize)
+    assert n == len(before)
+    print(f"{rows:,} rows, {args.algo}, chunks of {chunksize:,}")
+    print(f"score one-shot + dicts: {rows / t_before:12,.0f} scores/s ({t_before:.2f}s, peak {m_before:,.0f} MB)")
+    print(f"score chunked columns:  {rows / t_after:12,.0f} scores/s ({t_after:.2f}s, peak {m_after:,.0f} MB)")
+    if args.db:
+        _db_writes(before)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
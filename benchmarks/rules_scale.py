@@ -0,0 +1,179 @@
+"""Rule predicate scale benchmark on synthetic frames (no database needed).
+
+Times each active predicate (sharing one CardContext, as the engine does), the
+context build itself and the full ``evaluate_rules`` path, reporting rows/sec and
+peak traced memory. Baselines are stored per (rows, cards, skew, stage); with
+``--check`` the run fails when a stage is slower than baseline beyond tolerance.
+
+Usage:
+    python -m benchmarks.rules_scale --rows 100k 1M --cards 50k --skew 1.1
+    python -m benchmarks.rules_scale --rows 1M --save-baseline
+    python -m benchmarks.rules_scale --rows 1M --check --tolerance 0.25
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from src.utils.cards import CardContext
+from src.rules.engine import _get_predicate, evaluate_rules, load_rules
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "rules_scale.json")
+
+# Stages faster than this are timer noise; they are reported but never fail --check
+MIN_CHECK_SECONDS = 0.005
+
+
+def parse_count(text: str) -> int:
+    """Parse counts like ``100k``, ``1M`` or ``50000``."""
+    mult = {"k": 1_000, "m": 1_000_000}
+    t = text.strip().lower()
+    if t and t[-1] in mult:
+        return int(float(t[:-1]) * mult[t[-1]])
+    return int(t)
+
+
+def synthetic_frame(rows: int, cards: int, skew: float = 0.0, days: int = 2, seed: int = 42) -> pd.DataFrame:
+    """Transactions frame shaped like the engine's read.
+
+    ``skew`` > 0 draws cards from a Zipf-like distribution with that exponent, so a
+    few hot cards carry most of the traffic; 0 spreads rows uniformly.
+    """
+    rng = np.random.default_rng(seed)
+    if skew > 0:
+        weights = 1.0 / np.arange(1, cards + 1) ** skew
+        card = rng.choice(cards, size=rows, p=weights / weights.sum())
+    else:
+        card = rng.integers(0, cards, size=rows)
+    home_lat = rng.uniform(25, 49, size=cards)
+    home_lon = rng.uniform(-124, -67, size=cards)
+    ts = np.datetime64("2024-01-01", "ns") + rng.integers(0, days * 86_400, size=rows).astype("timedelta64[s]")
+    return pd.DataFrame({
+        "tx_id": np.arange(rows, dtype=np.int64),
+        "card_id": card.astype(np.int64),
+        "ts": ts,
+        "amount": rng.lognormal(3.5, 0.9, size=rows),
+        "lat": home_lat[card] + rng.normal(0, 0.05, size=rows),
+        "lon": home_lon[card] + rng.normal(0, 0.05, size=rows),
+        "channel": pd.Categorical.from_codes(rng.choice(3, size=rows, p=[0.6, 0.35, 0.05]), ["POS", "ECOM", "ATM"]),
+        "mcc": rng.choice(np.array([5411, 5732, 5812, 5967, 7995], dtype=np.int32), size=rows),
+    })
+
+
+def _measure(fn: Callable[[], object], repeat: int) -> tuple[float, int]:
+    """Best wall time over ``repeat`` runs and the peak traced allocation of one run."""
+    best = float("inf")
+    peak = 0
+    for i in range(repeat):
+        if i == 0:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+        if i == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return best, peak
+
+
+def run_case(rows: int, cards: int, skew: float, rules: list[dict], repeat: int) -> list[dict]:
+    df = synthetic_frame(rows, cards, skew)
+    results = []
+
+    def record(stage: str, fn: Callable[[], object]) -> None:
+        secs, peak = _measure(fn, repeat)
+        results.append({
+            "rows": rows, "cards": cards, "skew": skew, "stage": stage,
+            "seconds": secs, "rows_per_sec": rows / secs if secs else float("inf"), "peak_mb": peak / 2**20,
+        })
+
+    record("context", lambda: CardContext.build(df))
+    ctx = CardContext.build(df)
+    for rule in rules:
+        pred = _get_predicate(rule["name"])
+        params = dict(rule.get("params", {}))
+        if getattr(pred, "per_card", False):
+            # Fresh copy so cached windows from earlier repeats don't flatter the timing
+            record(rule["name"], lambda p=pred, kw=params: p(df, ctx=dataclasses.replace(ctx, _cache={}), **kw))
+        else:
+            record(rule["name"], lambda p=pred, kw=params: p(df, **kw))
+    record("evaluate_rules", lambda: evaluate_rules(df, rules))
+    return results
+
+
+def _key(r: dict) -> str:
+    return f"{r['rows']}:{r['cards']}:{r['skew']}:{r['stage']}"
+
+
+def check_against_baseline(results: list[dict], baseline: dict[str, float], tolerance: float) -> list[str]:
+    """Stages whose rows/sec fell more than ``tolerance`` below their baseline, or that have none.
+
+    A stage without a baseline fails too, so a missing or stale baseline file
+    can't turn the gate into a no-op.
+    """
+    failures = []
+    for r in results:
+        base = baseline.get(_key(r))
+        if r["seconds"] < MIN_CHECK_SECONDS:
+            continue
+        if base is None:
+            failures.append(f"{_key(r)}: no baseline; record one with --save-baseline")
+        elif r["rows_per_sec"] < base * (1 - tolerance):
+            failures.append(f"{_key(r)}: {r['rows_per_sec']:,.0f} rows/s < baseline {base:,.0f} (-{tolerance:.0%})")
+    return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", nargs="+", default=["100k"], help="Frame sizes, e.g. 100k 1M 10M 50M")
+    p.add_argument("--cards", default="20k", help="Distinct cards")
+    p.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for card popularity (0 = uniform)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--baseline", default=BASELINE_PATH)
+    p.add_argument("--save-baseline", action="store_true")
+    p.add_argument("--check", action="store_true", help="Exit 1 if any stage regresses beyond --tolerance")
+    p.add_argument("--tolerance", type=float, default=0.2)
+    args = p.parse_args(argv)
+
+    rules = [r for r in load_rules() if r.get("active", True)]
+    cards = parse_count(args.cards)
+    results = []
+    for rows in (parse_count(x) for x in args.rows):
+        results.extend(run_case(rows, cards, args.skew, rules, args.repeat))
+
+    print(f"{'rows':>11} {'cards':>8} {'skew':>5} {'stage':<15} {'seconds':>9} {'rows/s':>14} {'peak MB':>9}")
+    for r in results:
+        print(f"{r['rows']:>11,} {r['cards']:>8,} {r['skew']:>5} {r['stage']:<15} {r['seconds']:>9.3f} {r['rows_per_sec']:>14,.0f} {r['peak_mb']:>9.1f}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif args.check and not args.save_baseline:
+        print(f"No baseline at {args.baseline}; every stage fails --check", file=sys.stderr)
+    if args.save_baseline:
+        baseline.update({_key(r): r["rows_per_sec"] for r in results})
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    if args.check:
+        failures = check_against_baseline(results, baseline, args.tolerance)
+        for msg in failures:
+            print(f"REGRESSION {msg}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+"""Scoring service latency and throughput: per-request scoring vs micro-batching.
+
+Trains the feature pipeline on synthetic rows, starts the HTTP service
+in-process on a free port and drives it with concurrent keep-alive clients
+sending one transaction per request. Reports client-side p50/p99 latency and
+requests/sec for each ``--max-wait-ms`` (0 scores every request on its own),
+plus the cold-start cost the service avoids.
+
+Usage:
+    python -m benchmarks.serve_latency --clients 16 --requests 2000 --algo rf
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+
+import joblib
+import numpy as np
+
+from benchmarks.predict_throughput import CATEGORICAL, NUMERIC, feature_frame
+from src.ml.serve import MicroBatcher, ModelHolder, make_server
+from src.ml.train import build_pipeline
+
+
+def _client(port: int, rows: list[dict], latencies: list[float]) -> None:
+    con = http.client.HTTPConnection("127.0.0.1", port)
+    for row in rows:
+        body = json.dumps(row)
+        t0 = time.perf_counter()
+        con.request("POST", "/score", body, {"Content-Type": "application/json"})
+        resp = con.getresponse()
+        resp.read()
+        latencies.append(time.perf_counter() - t0)
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status}")
+    con.close()
+
+
+def run(model_dir: str, max_wait_ms: float, max_batch: int, clients: int, requests: int) -> dict:
+    rows = feature_frame(requests, seed=7).drop(columns=["tx_id", "label_fraud", "ts"]).to_dict("records")
+    batcher = MicroBatcher(ModelHolder(model_dir), max_batch=max_batch, max_wait_ms=max_wait_ms)
+    server = make_server(batcher, "127.0.0.1", 0, threshold=0.9)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    per_client = [rows[i::clients] for i in range(clients)]
+    latencies: list[list[float]] = [[] for _ in range(clients)]
+    threads = [threading.Thread(target=_client, args=(server.server_port, per_client[i], latencies[i])) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - t0
+    stats = batcher.stats()
+    server.shutdown()
+    server.server_close()
+    batcher.close()
+    lat = np.concatenate([np.array(x) for x in latencies]) * 1000
+    return {
+        "max_wait_ms": max_wait_ms,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "requests_per_sec": len(lat) / secs,
+        "mean_batch_rows": stats["mean_batch_rows"],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--requests", type=int, default=2_000)
+    p.add_argument("--algo", choices=["lr", "rf"], default="rf")
+    p.add_argument("--max-batch", type=int, default=256)
+    p.add_argument("--max-wait-ms", type=float, nargs="+", default=[0.0, 2.0, 5.0])
+    args = p.parse_args(argv)
+
+    train = feature_frame(50_000, seed=1)
+    pipe = build_pipeline(NUMERIC, CATEGORICAL, args.algo)
+    pipe.fit(train.drop(columns=["label_fraud", "tx_id", "ts"]), train["label_fraud"].astype(int))
+    with tempfile.TemporaryDirectory() as model_dir:
+        path = os.path.join(model_dir, f"{args.algo}_bench.joblib")
+        joblib.dump({"pipeline": pipe}, path)
+        t0 = time.perf_counter()
+        joblib.load(path)
+        print(f"cold start avoided per call: model load {time.perf_counter() - t0:.2f}s (plus interpreter and sklearn imports)")
+        print(f"{'max wait ms':>11} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>9} {'rows/batch':>11}")
+        for wait in args.max_wait_ms:
+            r = run(model_dir, wait, args.max_batch, args.clients, args.requests)
+            print(f"{r['max_wait_ms']:>11.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['requests_per_sec']:>9,.0f} {r['mean_batch_rows']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+"""Tree model inference: sklearn Pipeline vs the compiled flat-array evaluator.
+
+Trains the feature pipeline on synthetic rows, compiles it with
+``compile_pipeline``, checks both give the same probabilities (within
+``--rtol``) and reports single-row latency (p50/p99 over ``--single`` calls,
+a DataFrame through the pipeline vs ``predict_one`` on a dict) and batch
+throughput at each ``--batch`` size. Exits 1 when the outputs differ.
+
+Usage:
+    python -m benchmarks.tree_latency --algo rf --batch 100 10k 100k
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.predict_throughput import CATEGORICAL, NUMERIC, feature_frame
+from benchmarks.rules_scale import parse_count
+from src.ml.compiled import compile_pipeline
+from src.ml.train import build_pipeline
+
+
+def _percentiles(fn, rows: list) -> tuple[float, float]:
+    lat = np.empty(len(rows))
+    for i, row in enumerate(rows):
+        t0 = time.perf_counter()
+        fn(row)
+        lat[i] = time.perf_counter() - t0
+    p50, p99 = np.percentile(lat * 1000, [50, 99])
+    return float(p50), float(p99)
+
+
+def _rate(fn, X: pd.DataFrame) -> float:
+    t0 = time.perf_counter()
+    fn(X)
+    return len(X) / (time.perf_counter() - t0)
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--algo", choices=["rf", "xgb"], default="rf")
+    p.add_argument("--single", type=int, default=500)
+    p.add_argument("--batch", nargs="+", default=["100", "10k", "100k"])
+    p.add_argument("--rtol", type=float, default=1e-9)
+    args = p.parse_args(argv)
+
+    train = feature_frame(50_000, seed=1)
+    pipe = build_pipeline(NUMERIC, CATEGORICAL, args.algo)
+    pipe.fit(train.drop(columns=["label_fraud", "tx_id", "ts"]), train["label_fraud"].astype(int))
+    model = compile_pipeline(pipe)
+
+    sizes = [parse_count(b) for b in args.batch]
+    X = feature_frame(max(sizes + [args.single]), seed=7).drop(columns=["label_fraud", "tx_id", "ts"])
+    # A few unseen categories, which the one-hot encoder ignores
+    X.loc[X.index[::97], "device_id"] = "dev_unseen"
+    expected = pipe.predict_proba(X)[:, 1]
+    got = model.predict_proba(X)[:, 1]
+    ok = np.allclose(got, expected, rtol=args.rtol, atol=1e-12)
+    print(f"{args.algo}: {model.n_trees} trees, {len(model.feature):,} nodes; "
+          f"max |diff| {np.abs(got - expected).max():.2e} over {len(X):,} rows {'ok' if ok else 'MISMATCH'}")
+
+    rows = X.iloc[:args.single].to_dict("records")
+    sk50, sk99 = _percentiles(lambda r: pipe.predict_proba(pd.DataFrame([r])), rows)
+    c50, c99 = _percentiles(model.predict_one, rows)
+    print(f"single row  sklearn  p50 {sk50:7.3f} ms  p99 {sk99:7.3f} ms")
+    print(f"single row  compiled p50 {c50:7.3f} ms  p99 {c99:7.3f} ms")
+    for n in sizes:
+        batch = X.iloc[:n]
+        print(f"batch {n:>9,}  sklearn {_rate(pipe.predict_proba, batch):12,.0f} rows/s  "
+              f"compiled {_rate(model.predict_proba, batch):12,.0f} rows/s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
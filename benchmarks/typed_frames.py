@@ -0,0 +1,91 @@
+"""Memory of a transaction window: plain ``read_sql`` frame vs ``read_sql_typed``.
+
+Synthetic chunks mimic what ``read_sql`` returns (UUIDs and labels as Python
+strings); the plain frame's size is the sum of its chunks, so 10M rows can be
+measured without holding them all as objects.
+
+Usage:
+    python -m benchmarks.typed_frames --rows 10M
+    python -m benchmarks.typed_frames --db --days 7   # real window from Postgres
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.utils.frames import TX_SCHEMA, decode_uuid, encode_frames
+from .rules_scale import parse_count
+
+
+def _uuids(rng: np.random.Generator, n: int) -> np.ndarray:
+    return decode_uuid(rng.integers(0, 256, size=(n, 16), dtype=np.uint8).view("S16").ravel())
+
+
+def synthetic_chunks(rows: int, chunksize: int, cards: int = 100_000, merchants: int = 1_500, seed: int = 42):
+    """Yield frames shaped like ``read_sql`` over the transactions table."""
+    rng = np.random.default_rng(seed)
+    card_ids, merchant_ids = _uuids(rng, cards), _uuids(rng, merchants)
+    devices = np.array([f"dev_{i}" for i in range(150_000)], dtype=object)
+    for start in range(0, rows, chunksize):
+        n = min(chunksize, rows - start)
+        yield pd.DataFrame({
+            "tx_id": _uuids(rng, n),
+            "card_id": card_ids[rng.integers(0, cards, size=n)],
+            "merchant_id": merchant_ids[rng.integers(0, merchants, size=n)],
+            "ts": np.datetime64("2024-01-01", "ns") + rng.integers(0, 7 * 86_400, size=n).astype("timedelta64[s]"),
+            "amount": np.round(rng.lognormal(3.5, 0.9, size=n), 2),
+            "currency": np.full(n, "USD", dtype=object),
+            "lat": rng.uniform(25, 49, size=n),
+            "lon": rng.uniform(-124, -67, size=n),
+            "channel": rng.choice(np.array(["POS", "ECOM", "ATM"], dtype=object), size=n, p=[0.6, 0.35, 0.05]),
+            "device_id": devices[rng.integers(0, len(devices), size=n)],
+        })
+
+
+def _measured(chunks, sizes: list[int]):
+    for chunk in chunks:
+        sizes.append(int(chunk.memory_usage(index=False, deep=True).sum()))
+        yield chunk
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", default="10M")
+    p.add_argument("--chunksize", type=int, default=500_000)
+    p.add_argument("--db", action="store_true", help="Read a real window instead of synthetic rows")
+    p.add_argument("--days", type=int, default=7)
+    args = p.parse_args(argv)
+
+    sizes: list[int] = []
+    t0 = time.perf_counter()
+    if args.db:
+        from sqlalchemy import text
+        from src.utils import get_engine
+        q = """
+            SELECT tx_id, card_id, merchant_id, ts, amount::float AS amount, currency, lat, lon, channel, device_id
+            FROM transactions WHERE ts >= NOW() - make_interval(days => :days)
+        """
+        with get_engine().connect() as con:
+            con = con.execution_options(stream_results=True)
+            chunks = pd.read_sql(text(q), con, params={"days": args.days}, chunksize=args.chunksize)
+            typed = encode_frames(_measured(chunks, sizes), TX_SCHEMA)
+    else:
+        typed = encode_frames(_measured(synthetic_chunks(parse_count(args.rows), args.chunksize), sizes), TX_SCHEMA)
+    secs = time.perf_counter() - t0
+
+    rows = len(typed)
+    plain, compact = sum(sizes), typed.memory_bytes()
+    print(f"rows           {rows:>14,}")
+    print(f"read_sql       {plain / 2**20:>11,.1f} MB  {plain / max(rows, 1):>7.1f} B/row")
+    print(f"read_sql_typed {compact / 2**20:>11,.1f} MB  {compact / max(rows, 1):>7.1f} B/row")
+    print(f"reduction      {plain / max(compact, 1):>13.1f}x")
+    label = "read+encode" if args.db else "gen+encode"
+    print(f"{label:<14} {secs:>11.2f} s   {rows / secs:>12,.0f} rows/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
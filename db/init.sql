@@ -38,7 +38,8 @@ CREATE TABLE IF NOT EXISTS transactions (
   channel TEXT NOT NULL,
   device_id TEXT,
   is_international BOOLEAN,
-  label_fraud BOOLEAN DEFAULT NULL
+  label_fraud BOOLEAN DEFAULT NULL,
+  ingested_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
 CREATE TABLE IF NOT EXISTS alerts (
@@ -72,10 +73,54 @@ CREATE TABLE IF NOT EXISTS model_scores (
   created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
+-- High-water marks for incremental jobs (e.g. rule scoring)
+CREATE TABLE IF NOT EXISTS job_watermarks (
+  job_name TEXT PRIMARY KEY,
+  watermark TIMESTAMP NOT NULL,
+  updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Ledger of rule scoring runs and the transaction windows they covered:
+-- ts bounds for 'window' runs, ingested_at bounds for 'incremental' ones
+CREATE TABLE IF NOT EXISTS rule_score_runs (
+  run_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  mode TEXT NOT NULL CHECK (mode in ('window','incremental')),
+  window_start TIMESTAMP,
+  window_end TIMESTAMP,
+  alerts_generated INT,
+  alerts_inserted INT,
+  status TEXT NOT NULL DEFAULT 'RUNNING' CHECK (status in ('RUNNING','SUCCEEDED','FAILED')),
+  error TEXT,
+  started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  finished_at TIMESTAMP
+);
+
+-- Per-rule cost of each scoring run. Rows and times are summed over worker
+-- shards; pushed-down (engine = 'sql') rules share one scan, so each carries
+-- that scan's wall time and no CPU time.
+CREATE TABLE IF NOT EXISTS rule_runs (
+  run_id UUID NOT NULL REFERENCES rule_score_runs(run_id) ON DELETE CASCADE,
+  rule_name TEXT NOT NULL,
+  engine TEXT NOT NULL CHECK (engine in ('pandas','sql')),
+  params JSONB,
+  rows_in BIGINT,
+  rows_flagged BIGINT,
+  wall_ms DOUBLE PRECISION,
+  cpu_ms DOUBLE PRECISION,
+  peak_mem_bytes BIGINT,
+  workers INT NOT NULL DEFAULT 1,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (run_id, rule_name)
+);
+
 -- Indexes
 CREATE INDEX IF NOT EXISTS idx_transactions_ts ON transactions(ts);
+CREATE INDEX IF NOT EXISTS idx_transactions_ingested_at ON transactions(ingested_at);
 CREATE INDEX IF NOT EXISTS idx_transactions_card_ts ON transactions(card_id, ts);
 CREATE INDEX IF NOT EXISTS idx_transactions_merchant_ts ON transactions(merchant_id, ts);
+-- One alert per (transaction, rule): makes re-scoring idempotent.
+-- Existing databases with duplicates: run db/migrations/001_dedup_alerts.sql instead.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_alerts_tx_rule ON alerts(tx_id, rule_name);
 
 -- Helper table for features
 CREATE TABLE IF NOT EXISTS model_features (
@@ -91,5 +136,10 @@ CREATE TABLE IF NOT EXISTS model_features (
   device_id TEXT,
   merchant_risk_tier INT,
   brand TEXT,
-  ts TIMESTAMP
+  ts TIMESTAMP,
+  device_distinct_cards_24h DOUBLE PRECISION,
+  merchant_tx_count_1h INT
 );
+
+-- Date-partitioned snapshot exports and streaming training read model_features by ts range
+CREATE INDEX IF NOT EXISTS idx_model_features_ts ON model_features(ts);
@@ -0,0 +1,24 @@
+-- One-off: remove duplicate alerts per (tx_id, rule_name) and enforce uniqueness.
+-- Keeps the alert an analyst has progressed furthest (CONFIRMED > DISMISSED > ACK > OPEN),
+-- then the earliest one. Safe to re-run.
+BEGIN;
+
+LOCK TABLE alerts IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM alerts a
+USING (
+  SELECT alert_id,
+         ROW_NUMBER() OVER (
+           PARTITION BY tx_id, rule_name
+           ORDER BY CASE status WHEN 'CONFIRMED' THEN 0 WHEN 'DISMISSED' THEN 1 WHEN 'ACK' THEN 2 ELSE 3 END,
+                    created_at, alert_id
+         ) AS rn
+  FROM alerts
+) d
+WHERE a.alert_id = d.alert_id AND d.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_alerts_tx_rule ON alerts(tx_id, rule_name);
+
+COMMIT;
+
+ANALYZE alerts;
@@ -0,0 +1,4 @@
+-- Adds the merchant/device aggregate columns to model_features created before them.
+-- Safe to re-run; rows built earlier stay NULL until the next full `features` run.
+ALTER TABLE model_features ADD COLUMN IF NOT EXISTS device_distinct_cards_24h DOUBLE PRECISION;
+ALTER TABLE model_features ADD COLUMN IF NOT EXISTS merchant_tx_count_1h INT;
@@ -0,0 +1,15 @@
+-- Adds the load time incremental rule scoring tracks, so back-dated rows are still alerted on.
+-- Existing rows take their event time, which keeps the current rulescore watermark meaningful.
+-- Safe to re-run.
+BEGIN;
+
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP;
+UPDATE transactions SET ingested_at = ts WHERE ingested_at IS NULL;
+ALTER TABLE transactions ALTER COLUMN ingested_at SET DEFAULT NOW();
+ALTER TABLE transactions ALTER COLUMN ingested_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_transactions_ingested_at ON transactions(ingested_at);
+
+COMMIT;
+
+ANALYZE transactions;
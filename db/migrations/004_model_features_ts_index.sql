@@ -0,0 +1,5 @@
+-- Adds the ts index that snapshot exports use to read model_features one date at a time.
+-- Safe to re-run.
+CREATE INDEX IF NOT EXISTS idx_model_features_ts ON model_features(ts);
+
+ANALYZE model_features;
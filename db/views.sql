@@ -31,3 +31,22 @@ LEFT JOIN LATERAL (
   SELECT * FROM model_scores ms2 WHERE ms2.tx_id = t.tx_id ORDER BY created_at DESC LIMIT 1
 ) ms ON true
 ORDER BY t.ts DESC;
+
+-- One row per rule scoring run with its per-rule cost rolled up
+CREATE OR REPLACE VIEW vw_rule_run_summary AS
+SELECT
+  r.run_id,
+  r.mode,
+  r.status,
+  r.started_at,
+  r.finished_at - r.started_at AS elapsed,
+  COUNT(rr.rule_name) AS rules,
+  COALESCE(SUM(rr.wall_ms) FILTER (WHERE rr.engine = 'pandas'), 0)
+    + COALESCE(MAX(rr.wall_ms) FILTER (WHERE rr.engine = 'sql'), 0) AS rule_wall_ms,
+  SUM(rr.cpu_ms) AS rule_cpu_ms,
+  MAX(rr.peak_mem_bytes) AS peak_mem_bytes,
+  (ARRAY_AGG(rr.rule_name ORDER BY rr.wall_ms DESC NULLS LAST))[1] AS slowest_rule,
+  MAX(rr.wall_ms) AS slowest_rule_ms
+FROM rule_score_runs r
+LEFT JOIN rule_runs rr ON rr.run_id = r.run_id
+GROUP BY r.run_id, r.mode, r.status, r.started_at, r.finished_at;
@@ -45,30 +45,55 @@ def cmd_generate(args: argparse.Namespace) -> int:
 
 def cmd_features(args: argparse.Namespace) -> int:
     from src.features.build_features import build_features
-    cnt = build_features()
+    cnt = build_features(
+        incremental=args.incremental,
+        memory_budget_mb=args.memory_mb,
+        workers=args.workers,
+        engine=args.engine,
+    )
     logger.info("Built %d rows of features", cnt)
     return 0
 
 
+def cmd_snapshot(args: argparse.Namespace) -> int:
+    from src.features.snapshots import export_snapshots
+    written = export_snapshots(rebuild=args.rebuild)
+    logger.info("Exported %d feature partitions", len(written))
+    return 0
+
+
 def cmd_rulescore(args: argparse.Namespace) -> int:
     from src.rules.engine import score_rules
-    cnt = score_rules()
+    cnt = score_rules(incremental=args.incremental, workers=args.workers, pushdown=args.pushdown)
     logger.info("Created %d alerts", cnt)
     return 0
 
 
 def cmd_trainsklearn(args: argparse.Namespace) -> int:
-    from src.ml.train import train
-    model_path, feat_list = train(algo=args.algo)
+    if args.stream or args.warm_start:
+        if args.algo not in (None, "sgd"):
+            raise SystemExit("--stream trains the incremental SGD model; drop --algo or use --algo sgd")
+        from src.ml.incremental import train_streaming
+        model_path, feat_list = train_streaming(source=args.source, warm_start=args.warm_start)
+    else:
+        from src.ml.train import train
+        model_path, feat_list = train(algo=args.algo or "rf", source=args.source)
     logger.info("Model saved: %s", model_path)
     return 0
 
 
+def cmd_tune(args: argparse.Namespace) -> int:
+    from src.ml.tune import tune
+    path = tune(algos=args.algo, source=args.source, workers=args.workers, folds=args.folds)
+    logger.info("Leaderboard: %s", path)
+    return 0
+
+
 def cmd_evaluate(args: argparse.Namespace) -> int:
     from src.ml.evaluate import evaluate
     from src.ml.predict import _latest_model
     model = _latest_model()
-    evaluate(model)
+    evaluate(model, source=args.source)
     return 0
 
 
@@ -78,6 +103,12 @@ def cmd_predict(args: argparse.Namespace) -> int:
     return 0
 
 
+def cmd_serve(args: argparse.Namespace) -> int:
+    from src.ml.serve import serve
+    serve(host=args.host, port=args.port, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    return 0
+
+
 def cmd_report(args: argparse.Namespace) -> int:
     from src.reporting.daily_report import generate_daily_report
     path = generate_daily_report()
@@ -110,6 +141,10 @@ def cmd_label_fraud(args: argparse.Namespace) -> int:
     with eng.begin() as con:
         con.exec_driver_sql(sql)
     logger.info("Applied heuristic labels with threshold=%.2f", threshold)
+    if args.retrain:
+        from src.ml.incremental import train_streaming
+        model_path, _ = train_streaming(source="db", warm_start=True)
+        logger.info("Model saved: %s", model_path)
     return 0
 
 
@@ -124,17 +159,42 @@ def build_parser() -> argparse.ArgumentParser:
     pg.add_argument("--days", type=int, default=1)
     pg.add_argument("--tx-per-day", type=int, default=50000)
 
-    sub.add_parser("features")
-    sub.add_parser("rulescore")
+    pf = sub.add_parser("features")
+    pf.add_argument("--incremental", action="store_true", help="Only build features for transactions after the stored watermark")
+    pf.add_argument("--memory-mb", type=int, default=None, help="Peak memory budget (default: features.memory_budget_mb in settings.yaml)")
+    pf.add_argument("--workers", type=int, default=None, help="Worker processes (default: features.workers in settings.yaml)")
+    pf.add_argument("--engine", choices=["pandas", "sql"], default=None, help="Where to compute features (default: features.engine)")
+    ps = sub.add_parser("snapshot")
+    ps.add_argument("--rebuild", action="store_true", help="Rewrite every partition instead of appending new dates")
+    pr = sub.add_parser("rulescore")
+    pr.add_argument("--incremental", action="store_true", help="Only score transactions after the stored watermark")
+    pr.add_argument("--workers", type=int, default=None, help="Worker processes (default: rules.workers in settings.yaml)")
+    pr.add_argument("--pushdown", action="store_true", default=None, help="Evaluate stateless rules inside Postgres")
 
     pt = sub.add_parser("trainsklearn")
-    pt.add_argument("--algo", choices=["lr", "rf", "xgb"], default="rf")
-
-    sub.add_parser("evaluate")
+    pt.add_argument("--algo", choices=["lr", "rf", "xgb", "sgd"], default=None, help="Model to fit in memory (default: rf)")
+    pt.add_argument("--stream", action="store_true", help="Train SGD out of core, in chunks of ml.streaming.chunksize rows")
+    pt.add_argument("--warm-start", action="store_true", help="Continue the latest streaming model with new rows and labels (implies --stream)")
+    pt.add_argument("--source", choices=["db", "snapshot"], default=None, help="Where to read features (default: ml.feature_source)")
+
+    pn = sub.add_parser("tune")
+    pn.add_argument("--algo", nargs="+", choices=["lr", "rf", "xgb", "sgd"], default=None, help="Models to search (default: model.algo)")
+    pn.add_argument("--workers", type=int, default=None, help="Candidates fitted in parallel (default: tuning.workers in model.yaml)")
+    pn.add_argument("--folds", type=int, default=None, help="Rolling validation windows (default: tuning.folds)")
+    pn.add_argument("--source", choices=["db", "snapshot"], default=None, help="Where to read features (default: ml.feature_source)")
+
+    pe = sub.add_parser("evaluate")
+    pe.add_argument("--source", choices=["db", "snapshot"], default=None, help="Where to read features (default: ml.feature_source)")
     sub.add_parser("predict")
+    pv = sub.add_parser("serve")
+    pv.add_argument("--host", default=None, help="Bind address (default: ml.serve.host)")
+    pv.add_argument("--port", type=int, default=None, help="Port (default: ml.serve.port)")
+    pv.add_argument("--max-batch", type=int, default=None, help="Rows per micro-batch (default: ml.serve.max_batch)")
+    pv.add_argument("--max-wait-ms", type=float, default=None, help="Longest a request waits for its batch to fill (default: ml.serve.max_wait_ms)")
     sub.add_parser("report")
     pl = sub.add_parser("label-fraud")
     pl.add_argument("--threshold", type=float, default=0.9)
+    pl.add_argument("--retrain", action="store_true", help="Then warm-start the streaming model with the new labels")
     return p
 
 
@@ -152,14 +212,20 @@ def main(argv: list[str] | None = None) -> int:
         return cmd_generate(args)
     if cmd == "features":
         return cmd_features(args)
+    if cmd == "snapshot":
+        return cmd_snapshot(args)
     if cmd == "rulescore":
         return cmd_rulescore(args)
     if cmd == "trainsklearn":
         return cmd_trainsklearn(args)
+    if cmd == "tune":
+        return cmd_tune(args)
     if cmd == "evaluate":
         return cmd_evaluate(args)
     if cmd == "predict":
         return cmd_predict(args)
+    if cmd == "serve":
+        return cmd_serve(args)
     if cmd == "report":
         return cmd_report(args)
     if cmd == "label-fraud":
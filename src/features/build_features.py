@@ -1,22 +1,68 @@
 from __future__ import annotations
 
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
 import numpy as np
 import pandas as pd
+from sqlalchemy import text
 
-from src.utils import get_logger, read_sql, write_df
+from src.utils import get_engine, get_logger, get_settings, get_watermark, merge_df, read_sql, set_watermark
+from src.utils.cards import CardContext
 
 
 logger = get_logger(__name__)
 
+WATERMARK_JOB = "features"
+
+# Longest rolling window; an incremental run re-reads this much per-card history
+FEATURE_LOOKBACK = timedelta(hours=24)
+
+# Working memory per fetched row relative to its frame size (copies, sort, outputs)
+_WORK_FACTOR = 6
+_FIRST_FETCH = 10_000
+
+_TX_COLUMNS = """
+    t.tx_id, t.card_id, t.merchant_id, t.ts, t.amount::float AS amount, t.currency, t.lat, t.lon,
+    t.channel, t.device_id, t.label_fraud, c.brand, m.risk_tier AS merchant_risk_tier
+"""
+
+_JOINS = """
+    JOIN cards c ON c.card_id = t.card_id
+    JOIN merchants m ON m.merchant_id = t.merchant_id
+"""
+
+FEATURE_COLUMNS = [
+    "tx_id",
+    "label_fraud",
+    "amount",
+    "last_tx_delta_minutes",
+    "tx_count_1h",
+    "tx_count_24h",
+    "amount_mean_24h",
+    "geo_velocity_kmph_prev",
+    "channel",
+    "device_id",
+    "merchant_risk_tier",
+    "brand",
+    "ts",
+]
+
 
 def _features_for_group(g: pd.DataFrame) -> pd.DataFrame:
-    g = g.sort_values("ts")
+    """Reference implementation for one card; ``_features_vectorized`` must match it."""
+    # Ties on ts are ordered by tx_id so any run over the same rows agrees
+    g = g.sort_values(["ts", "tx_id"], kind="stable")
     g["last_tx_delta_minutes"] = g["ts"].diff().dt.total_seconds().div(60).fillna(1e6)
     # Rolling counts by time windows using pandas time-based rolling
     g = g.set_index("ts")
     g["tx_count_1h"] = g["amount"].rolling("1h").count().astype(int) - 1
     g["tx_count_24h"] = g["amount"].rolling("24h").count().astype(int) - 1
-    g["amount_mean_24h"] = g["amount"].rolling("24h").mean().fillna(0.0)
+    # Sum whole cents so the mean doesn't depend on where the rolling sum started
+    cents = g["amount"].mul(100).round()
+    g["amount_mean_24h"] = (cents.rolling("24h").sum() / g["amount"].rolling("24h").count() / 100).fillna(0.0)
     # Geo velocity vs previous point approx
     lat_prev = g["lat"].shift(1)
     lon_prev = g["lon"].shift(1)
@@ -35,46 +81,284 @@ def _haversine_km(lat1, lon1, lat2, lon2):
     dlat = lat2 - lat1
     dlon = lon2 - lon1
     a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-    c = 2 * np.arcsin(np.sqrt(a))
+    c = 2 * np.arcsin(np.minimum(1.0, np.sqrt(a)))
     return 6371 * c
 
 
-def build_features() -> int:
-    q = """
-        SELECT t.tx_id, t.card_id, t.merchant_id, t.ts, t.amount::float, t.currency, t.lat, t.lon,
-               t.channel, t.device_id, t.label_fraud, c.brand, m.risk_tier AS merchant_risk_tier
-        FROM transactions t
-        JOIN cards c ON c.card_id = t.card_id
-        JOIN merchants m ON m.merchant_id = t.merchant_id
+CardRange = tuple[Optional[str], Optional[str]]
+
+
+def card_ranges(parts: int) -> list[CardRange]:
+    """Split cards into ``parts`` contiguous ``card_id`` ranges of about equal card counts.
+
+    Bounds are quantiles of the ``cards`` primary key, so each worker reads
+    its own range through ``idx_transactions_card_ts`` instead of every
+    worker scanning the whole window and discarding the other buckets.
     """
-    df = read_sql(q)
-    if df.empty:
+    if parts <= 1:
+        return [(None, None)]
+    fractions = ", ".join(str(k / parts) for k in range(1, parts))
+    bounds = read_sql(f"SELECT percentile_disc(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY card_id) AS b FROM cards")["b"].iloc[0]
+    return ranges_from_bounds([str(b) for b in bounds or []])
+
+
+def ranges_from_bounds(bounds: list[str]) -> list[CardRange]:
+    """``[lo, hi)`` ranges between sorted ``bounds``, open at both ends; duplicate bounds collapse."""
+    edges = sorted(set(bounds))
+    return list(zip([None, *edges], [*edges, None]))
+
+
+def _card_range_sql(alias: str, card_range: CardRange) -> str:
+    """Predicate keeping cards in ``[:card_lo, :card_hi)``; a ``None`` end is open."""
+    lo, hi = card_range
+    parts = []
+    if lo is not None:
+        parts.append(f"{alias}.card_id >= CAST(:card_lo AS uuid)")
+    if hi is not None:
+        parts.append(f"{alias}.card_id < CAST(:card_hi AS uuid)")
+    return " AND ".join(parts) or "TRUE"
+
+
+def _full_query(high: datetime, card_range: CardRange = (None, None)) -> tuple[str, dict]:
+    q = f"SELECT {_TX_COLUMNS} FROM transactions t {_JOINS} WHERE t.ts <= :high AND {_card_range_sql('t', card_range)}"
+    return q, {"high": high, "card_lo": card_range[0], "card_hi": card_range[1]}
+
+
+def _incremental_query(high: datetime, card_range: CardRange = (None, None)) -> tuple[str, dict]:
+    """Transactions up to ``high`` that have no feature row yet, plus the history their windows need.
+
+    Pending rows are found by their missing ``model_features`` row rather than
+    by ts, so back-dated rows loaded after the watermark (backfills) are
+    covered too. For each card with pending rows this reads everything after
+    ``pending_from - FEATURE_LOOKBACK``, ``pending_from`` being the card's
+    earliest pending ts, and the single latest row at or before that point,
+    which only serves as the previous transaction for deltas and velocity.
+    Rows from ``pending_from`` on must all be rewritten since an earlier row
+    changes their windows; the column is returned with every row.
+    """
+    q = f"""
+        WITH pending AS (
+            SELECT t.card_id, MIN(t.ts) AS pending_from
+            FROM transactions t
+            {_JOINS}
+            WHERE t.ts <= :high AND {_card_range_sql("t", card_range)}
+              AND NOT EXISTS (SELECT 1 FROM model_features f WHERE f.tx_id = t.tx_id)
+            GROUP BY t.card_id
+        )
+        SELECT {_TX_COLUMNS}, p.pending_from
+        FROM pending p
+        JOIN transactions t ON t.card_id = p.card_id
+        {_JOINS}
+        WHERE t.ts > p.pending_from - :lookback AND t.ts <= :high
+        UNION ALL
+        SELECT {_TX_COLUMNS}, p.pending_from
+        FROM pending p
+        CROSS JOIN LATERAL (
+            SELECT * FROM transactions t2
+            WHERE t2.card_id = p.card_id AND t2.ts <= p.pending_from - :lookback
+            ORDER BY t2.ts DESC, t2.tx_id DESC LIMIT 1
+        ) t
+        {_JOINS}
+    """
+    return q, {
+        "high": high,
+        "lookback": FEATURE_LOOKBACK,
+        "card_lo": card_range[0],
+        "card_hi": card_range[1],
+    }
+
+
+def _complete_cards(cards: np.ndarray) -> int:
+    """Rows before the last card's run in card-ordered ``cards`` (that card may continue)."""
+    other = np.flatnonzero(cards != cards[-1])
+    return int(other[-1]) + 1 if len(other) else 0
+
+
+def stream_card_chunks(query: str, params: dict, budget_bytes: int):
+    """Yield frames of complete cards from ``query``, each sized to ``budget_bytes``.
+
+    Rows come through a server-side cursor ordered by card, so only the
+    trailing card of each fetch can be incomplete; it is carried into the next
+    chunk. Fetch sizes adapt to the observed bytes per row. A single card's
+    history must fit in the budget.
+    """
+    q = f"SELECT * FROM ({query}) src ORDER BY card_id, ts, tx_id"
+    with get_engine().connect() as con:
+        res = con.execution_options(stream_results=True).execute(text(q), params)
+        columns = list(res.keys())
+        carry = pd.DataFrame(columns=columns)
+        fetch = _FIRST_FETCH
+        while True:
+            rows = res.fetchmany(fetch)
+            if not rows:
+                if len(carry):
+                    yield carry
+                return
+            chunk = pd.DataFrame(rows, columns=columns)
+            if len(carry):
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            cut = _complete_cards(chunk["card_id"].to_numpy())
+            if cut:
+                yield chunk.iloc[:cut]
+            carry = chunk.iloc[cut:].reset_index(drop=True)
+            row_bytes = chunk.memory_usage(index=False, deep=True).sum() / len(chunk) * _WORK_FACTOR
+            fetch = max(int(budget_bytes / row_bytes) - len(carry), 1_000)
+
+
+def _features_vectorized(df: pd.DataFrame) -> pd.DataFrame:
+    """All cards in one pass over the frame sorted by (card_id, ts, tx_id).
+
+    Window counts come from ``CardContext.window_start`` and the 24h amount sum
+    from a cumulative sum of whole cents, so every value equals the per-card
+    rolling computation bit for bit.
+    """
+    ctx = CardContext.build(df, tie_break="tx_id")
+    g = df.iloc[ctx.order].reset_index(drop=True)
+    g["last_tx_delta_minutes"] = np.nan_to_num(ctx.dt_seconds / 60, nan=1e6)
+    g["tx_count_1h"] = ctx.window_counts(pd.Timedelta("1h")) - 1
+    count_24h = ctx.window_counts(pd.Timedelta("24h"))
+    g["tx_count_24h"] = count_24h - 1
+    cents = np.cumsum(np.round(g["amount"].to_numpy(dtype=float) * 100).astype(np.int64))
+    start = ctx.window_start(pd.Timedelta("24h"))
+    window_cents = cents - np.where(start > 0, cents[start - 1], 0)
+    g["amount_mean_24h"] = window_cents / count_24h / 100
+    g["geo_velocity_kmph_prev"] = ctx.prev_speed_kmph()
+    return g
+
+
+def compute_features(df: pd.DataFrame, engine: str = "vectorized") -> pd.DataFrame:
+    """Per-card rolling features for every row of ``df`` (all columns of ``FEATURE_COLUMNS``).
+
+    ``engine="groupby"`` runs the per-card reference implementation instead.
+    Rows come back in (card_id, ts, tx_id) order either way.
+    """
+    df = df.copy()
+    df["ts"] = pd.to_datetime(df["ts"])
+    if engine == "vectorized":
+        df_feat = _features_vectorized(df[df["card_id"].notna()])
+    elif engine == "groupby":
+        df_feat = (
+            df.groupby("card_id", group_keys=False)
+            .apply(_features_for_group)
+            .reset_index(drop=True)
+        )
+    else:
+        raise ValueError(f"Unknown feature engine: {engine}")
+    return df_feat[FEATURE_COLUMNS]
+
+
+def _build_slice(
+    watermark: datetime | None,
+    high: datetime,
+    budget_bytes: int,
+    card_range: CardRange = (None, None),
+) -> tuple[int, int]:
+    """Compute and merge features for one range of cards; return (written, read)."""
+    if watermark is not None:
+        query, params = _incremental_query(high, card_range)
+    else:
+        query, params = _full_query(high, card_range)
+    written = read = 0
+    for chunk in stream_card_chunks(query, params, budget_bytes):
+        df_out = compute_features(chunk)
+        if watermark is not None:
+            pending_from = chunk.set_index("tx_id")["pending_from"].reindex(df_out["tx_id"])
+            df_out = df_out[df_out["ts"].to_numpy() >= pd.to_datetime(pending_from).to_numpy()]
+        # Chunks commit on their own; a failed run is redone by the next one since merges overwrite
+        if len(df_out):
+            merge_df(df_out, "model_features", ["tx_id"], update_cols=FEATURE_COLUMNS[1:])
+        written += len(df_out)
+        read += len(chunk)
+    return written, read
+
+
+def build_features(
+    incremental: bool = False,
+    memory_budget_mb: int | None = None,
+    workers: int | None = None,
+    engine: str | None = None,
+) -> int:
+    """Build ``model_features`` and merge them on ``tx_id``; return rows written.
+
+    A full run recomputes every transaction. With ``incremental=True`` only
+    transactions without a ``model_features`` row are computed, including
+    back-dated ones, along with the later rows of their cards whose windows
+    they change; each card is seeded with ``FEATURE_LOOKBACK`` of history so
+    values equal a full rebuild. Without a ``features`` watermark the first
+    incremental run is a full one.
+
+    Transactions stream in card-complete chunks that fit ``memory_budget_mb``
+    (default: ``features.memory_budget_mb``); each chunk is written before the
+    next is read, and the watermark advances once all of them are merged.
+    ``workers`` > 1 (default: ``features.workers``) splits cards into that many
+    ``card_id`` ranges, each read, computed and written by its own process
+    within an equal share of the budget.
+
+    ``engine="sql"`` (default: ``features.engine``) instead computes the same
+    features with window functions in one ``INSERT ... SELECT``, so no rows
+    pass through Python; memory budget and workers do not apply.
+
+    With the pandas engine a final serial, time-ordered pass then adds the
+    merchant/device aggregates in ``src/features/entity.py``; it streams every
+    transaction through Python. ``features.entity.enabled`` defaults to on for
+    the pandas engine and off for sql, where setting it is an error.
+    """
+    cfg = get_settings().get("features", {})
+    if engine is None:
+        engine = cfg.get("engine", "pandas")
+    if engine not in ("pandas", "sql"):
+        raise ValueError(f"Unknown feature engine: {engine}")
+    if memory_budget_mb is None:
+        memory_budget_mb = int(cfg.get("memory_budget_mb", 1024))
+    if workers is None:
+        workers = int(cfg.get("workers", 1))
+    entity = cfg.get("entity", {}).get("enabled")
+    if entity is None:
+        entity = engine == "pandas"
+    elif entity and engine == "sql":
+        raise ValueError("features.entity.enabled needs the pandas engine; turn it off to use the sql engine")
+    watermark = get_watermark(WATERMARK_JOB) if incremental else None
+    high = read_sql("SELECT MAX(ts) AS high FROM transactions")["high"].iloc[0]
+    if pd.isna(high):
         logger.warning("No transactions to build features from.")
         return 0
-    df["ts"] = pd.to_datetime(df["ts"])
-    # Compute per-card rolling features
-    df_feat = (
-        df.groupby("card_id", group_keys=False)
-        .apply(_features_for_group)
-        .reset_index(drop=True)
-    )
-    # Select columns for model_features table
-    cols = [
-        "tx_id",
-        "label_fraud",
-        "amount",
-        "last_tx_delta_minutes",
-        "tx_count_1h",
-        "tx_count_24h",
-        "amount_mean_24h",
-        "geo_velocity_kmph_prev",
-        "channel",
-        "device_id",
-        "merchant_risk_tier",
-        "brand",
-        "ts",
-    ]
-    df_out = df_feat[cols].copy()
-    write_df(df_out, "model_features", if_exists="append")
-    return len(df_out)
+    high = pd.Timestamp(high).to_pydatetime()
 
+    entity_from = watermark
+    if entity and watermark is not None:
+        pending_from = read_sql(
+            "SELECT MIN(ts) AS t FROM transactions t WHERE ts <= :high"
+            " AND NOT EXISTS (SELECT 1 FROM model_features f WHERE f.tx_id = t.tx_id)",
+            {"high": high},
+        )["t"].iloc[0]
+        if not pd.isna(pending_from):
+            # Back-dated rows change merchant/device windows from their ts on; the bound is exclusive
+            entity_from = min(watermark, pd.Timestamp(pending_from).to_pydatetime() - timedelta(microseconds=1))
+    if engine == "sql":
+        from .sql import build_features_sql
+        with get_engine().begin() as con:
+            written = build_features_sql(con, watermark, high)
+            set_watermark(WATERMARK_JOB, high, con=con)
+        return written
+
+    budget_bytes = memory_budget_mb * 2**20 // max(workers, 1)
+    if workers > 1:
+        # Spawned workers open their own connections instead of sharing the parent's pool
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_build_slice, watermark, high, budget_bytes, r) for r in card_ranges(workers)]
+            results = [f.result() for f in futures]
+        written, read = (sum(x) for x in zip(*results))
+        logger.info("Built features on %d workers", workers)
+    else:
+        written, read = _build_slice(watermark, high, budget_bytes)
+    if not read:
+        logger.warning("No transactions to build features from.")
+        return 0
+    if watermark is not None:
+        logger.info("Computed %d rows on cards with new or back-dated transactions (%d with history)", written, read)
+    if entity:
+        from .entity import build_entity_features
+        build_entity_features(entity_from, high)
+    set_watermark(WATERMARK_JOB, high)
+    return written
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Hashable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.utils import get_engine, get_logger, get_settings, update_df
+
+
+logger = get_logger(__name__)
+
+# Merchant/device aggregates written next to the per-card features in model_features
+ENTITY_COLUMNS = ["device_distinct_cards_24h", "merchant_tx_count_1h"]
+
+DEVICE_WINDOW = timedelta(hours=24)
+MERCHANT_WINDOW = timedelta(hours=1)
+
+_FETCH = 100_000
+
+
+def hll_hash(values: Any, precision: int) -> tuple[np.ndarray, np.ndarray]:
+    """HyperLogLog register index and rank (leading zeros + 1) of each value."""
+    h = pd.util.hash_array(np.asarray(values, dtype=object))
+    register = (h >> np.uint64(64 - precision)).astype(np.int64)
+    w = h << np.uint64(precision)
+    # Bit length of w by binary search; rank = leading zeros + 1, capped when w == 0
+    bits = np.zeros(len(w), dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        big = w >= (np.uint64(1) << np.uint64(s))
+        bits[big] += s
+        w = np.where(big, w >> np.uint64(s), w)
+    bits += (w > 0)
+    rank = np.minimum(64 - bits + 1, 64 - precision + 1)
+    return register, rank
+
+
+class SlidingHLL:
+    """HyperLogLog distinct counts over a sliding time window, one sketch per key.
+
+    Each register keeps the ranks that can still become its window maximum:
+    (time, rank) pairs with strictly decreasing rank, so a newer equal-or-higher
+    rank evicts older ones and the head is the maximum until it expires. That
+    list is at most ``65 - precision`` long, so a key never holds more than
+    ``2**precision * (65 - precision)`` pairs whatever its traffic; only
+    touched registers are stored. Estimates have the usual HyperLogLog relative
+    standard error of ``1.04 / sqrt(2**precision)`` (6.5% at the default 8), and
+    small counts use linear counting, which is near-exact while most registers
+    are empty.
+    """
+
+    def __init__(self, window: timedelta, precision: int = 8) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.window_ns = window // timedelta(microseconds=1) * 1_000
+        self.precision = precision
+        self.m = 1 << precision
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        self._keys: dict[Hashable, dict[int, deque]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Hashable, t_ns: int, register: int, rank: int) -> None:
+        regs = self._keys.setdefault(key, {})
+        lst = regs.get(register)
+        if lst is None:
+            lst = regs[register] = deque()
+        while lst and lst[-1][1] <= rank:
+            lst.pop()
+        lst.append((t_ns, rank))
+
+    def estimate(self, key: Hashable, t_ns: int) -> float:
+        """Approximate distinct values added for ``key`` in (t - window, t]."""
+        regs = self._keys.get(key)
+        if not regs:
+            return 0.0
+        cutoff = t_ns - self.window_ns
+        z = 0.0
+        for register in list(regs):
+            lst = regs[register]
+            while lst and lst[0][0] <= cutoff:
+                lst.popleft()
+            if lst:
+                z += 2.0 ** -lst[0][1]
+            else:
+                del regs[register]
+        zeros = self.m - len(regs)
+        z += zeros
+        est = self.alpha * self.m * self.m / z
+        if est <= 2.5 * self.m and zeros:
+            est = self.m * math.log(self.m / zeros)
+        return est
+
+    def prune(self, t_ns: int) -> None:
+        """Drop keys with nothing left in the window ending at ``t_ns``."""
+        cutoff = t_ns - self.window_ns
+        stale = [k for k, regs in self._keys.items() if all(lst[-1][0] <= cutoff for lst in regs.values())]
+        for k in stale:
+            del self._keys[k]
+
+
+class WindowedCounter:
+    """Event counts over a sliding time window in ``slots`` fixed slots per key.
+
+    The window is split into ``slots`` slots of ``window / slots``; a count sums
+    the slots from the current one back, so it covers at least the last
+    ``window - window / slots`` and misses at most the part of the oldest slot
+    still inside the window (never over-counts). Each key holds ``2 * slots``
+    integers.
+    """
+
+    def __init__(self, window: timedelta, slots: int = 12) -> None:
+        if slots < 1:
+            raise ValueError("slots must be positive")
+        self.slots = slots
+        self.slot_ns = window // timedelta(microseconds=1) * 1_000 // slots
+        self._keys: dict[Hashable, tuple[list[int], list[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Hashable, t_ns: int) -> None:
+        slot = t_ns // self.slot_ns
+        ids, counts = self._keys.setdefault(key, ([-1] * self.slots, [0] * self.slots))
+        i = slot % self.slots
+        if ids[i] != slot:
+            ids[i], counts[i] = slot, 0
+        counts[i] += 1
+
+    def count(self, key: Hashable, t_ns: int) -> int:
+        state = self._keys.get(key)
+        if state is None:
+            return 0
+        oldest = t_ns // self.slot_ns - self.slots
+        return sum(c for s, c in zip(*state) if s > oldest)
+
+    def prune(self, t_ns: int) -> None:
+        oldest = t_ns // self.slot_ns - self.slots
+        stale = [k for k, (ids, _) in self._keys.items() if max(ids) <= oldest]
+        for k in stale:
+            del self._keys[k]
+
+
+class EntityFeatures:
+    """Merchant/device aggregates for a time-ordered transaction stream.
+
+    ``device_distinct_cards_24h`` is the approximate number of distinct cards
+    used on the device in the last 24h, this one included (0 without a
+    device). ``merchant_tx_count_1h`` counts the merchant's earlier
+    transactions in the last hour. State is bounded per active key and keys
+    are dropped once their window empties.
+    """
+
+    def __init__(self, precision: int = 8, slots: int = 12) -> None:
+        self.devices = SlidingHLL(DEVICE_WINDOW, precision)
+        self.merchants = WindowedCounter(MERCHANT_WINDOW, slots)
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Features for ``df`` (ordered by ts, tx_id and following earlier calls)."""
+        register, rank = hll_hash(df["card_id"].astype(str).to_numpy(), self.devices.precision)
+        t_ns = pd.to_datetime(df["ts"]).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        devices, merchants = self.devices, self.merchants
+        distinct = np.zeros(len(df))
+        burst = np.zeros(len(df), dtype=np.int64)
+        for i, (dev, mer, t) in enumerate(zip(df["device_id"].tolist(), df["merchant_id"].tolist(), t_ns.tolist())):
+            burst[i] = merchants.count(mer, t)
+            merchants.add(mer, t)
+            if dev is not None and dev == dev:
+                devices.add(dev, t, int(register[i]), int(rank[i]))
+                distinct[i] = devices.estimate(dev, t)
+        if len(df):
+            devices.prune(int(t_ns[-1]))
+            merchants.prune(int(t_ns[-1]))
+        return pd.DataFrame({
+            "tx_id": df["tx_id"].to_numpy(),
+            "device_distinct_cards_24h": distinct,
+            "merchant_tx_count_1h": burst,
+        })
+
+
+def build_entity_features(watermark: datetime | None, high: datetime, con=None) -> int:
+    """Write ``ENTITY_COLUMNS`` of model_features for (watermark, high]; return rows updated.
+
+    Cross-card aggregates need one pass in time order, so transactions stream
+    ordered by (ts, tx_id) starting one device window before ``watermark``;
+    that history only warms the sketches. Only rows already in model_features
+    are updated; transactions without per-card features are skipped. Pass
+    ``con`` to write inside an open transaction.
+    """
+    cfg = get_settings().get("features", {}).get("entity", {})
+    state = EntityFeatures(int(cfg.get("hll_precision", 8)), int(cfg.get("counter_slots", 12)))
+    q = "SELECT tx_id, card_id, merchant_id, device_id, ts FROM transactions WHERE ts <= :high"
+    params: dict[str, Any] = {"high": high}
+    if watermark is not None:
+        q += " AND ts > :lo"
+        params["lo"] = watermark - DEVICE_WINDOW
+    written = 0
+    with get_engine().connect() as read_con:
+        res = read_con.execution_options(stream_results=True).execute(text(q + " ORDER BY ts, tx_id"), params)
+        columns = list(res.keys())
+        while rows := res.fetchmany(_FETCH):
+            chunk = pd.DataFrame(rows, columns=columns)
+            out = state.update(chunk)
+            if watermark is not None:
+                out = out[(chunk["ts"] > watermark).to_numpy()]
+            if len(out):
+                written += update_df(out, "model_features", ["tx_id"], ENTITY_COLUMNS, con=con)
+    logger.info("Built %d merchant/device feature rows (%d devices, %d merchants active)",
+                written, len(state.devices), len(state.merchants))
+    return written
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import math
+import os
+from collections import deque
+from typing import Any, Mapping
+
+import numpy as np
+import pandas as pd
+
+from src.utils import get_logger
+from src.utils.cards import EARTH_RADIUS_KM
+from .build_features import FEATURE_COLUMNS
+
+
+logger = get_logger(__name__)
+
+# Model inputs, in the column order ``predict`` feeds the pipeline
+VECTOR_COLUMNS = [c for c in FEATURE_COLUMNS if c not in ("tx_id", "label_fraud", "ts")]
+
+_HOUR_NS = 3_600 * 10**9
+_DAY_NS = 24 * _HOUR_NS
+
+
+class _CardWindow:
+    __slots__ = ("ts_24h", "cents_24h", "sum_cents", "ts_1h", "last_ns", "last_lat", "last_lon")
+
+    def __init__(self) -> None:
+        # Timestamps (epoch ns) and whole-cent amounts of the card's last 24h
+        self.ts_24h: deque[int] = deque()
+        self.cents_24h: deque[int] = deque()
+        self.sum_cents = 0
+        # The 1h window is always a suffix of the 24h one
+        self.ts_1h: deque[int] = deque()
+        self.last_ns: int | None = None
+        self.last_lat = math.nan
+        self.last_lon = math.nan
+
+
+class OnlineFeatureStore:
+    """Latest per-card rolling state for the model features.
+
+    ``features(tx)`` returns the same values ``build_features`` would write for
+    ``tx`` and folds it into its card's windows; each update is amortized O(1)
+    since every transaction enters and leaves a window once. Transactions of a
+    card must arrive in (ts, tx_id) order.
+    """
+
+    def __init__(self) -> None:
+        self._cards: dict[Any, _CardWindow] = {}
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def features(self, tx: Mapping[str, Any], update: bool = True) -> dict[str, Any]:
+        """Feature vector (``VECTOR_COLUMNS``) for ``tx``.
+
+        ``tx`` needs ``card_id``, ``ts``, ``amount``, ``lat``, ``lon`` and the
+        categorical columns; ``update=False`` leaves the store unchanged.
+        """
+        st = self._cards.get(tx["card_id"])
+        if st is None:
+            st = _CardWindow()
+            if update:
+                self._cards[tx["card_id"]] = st
+        t_ns = pd.Timestamp(tx["ts"]).value
+        cents = round(float(tx["amount"]) * 100)
+        lat = math.radians(float(tx["lat"])) if tx["lat"] is not None else math.nan
+        lon = math.radians(float(tx["lon"])) if tx["lon"] is not None else math.nan
+
+        while st.ts_24h and st.ts_24h[0] <= t_ns - _DAY_NS:
+            st.ts_24h.popleft()
+            st.sum_cents -= st.cents_24h.popleft()
+        while st.ts_1h and st.ts_1h[0] <= t_ns - _HOUR_NS:
+            st.ts_1h.popleft()
+
+        delta = 1e6
+        speed = 0.0
+        if st.last_ns is not None:
+            dt_seconds = (t_ns - st.last_ns) / 1e9
+            delta = dt_seconds / 60
+            a = (math.sin((lat - st.last_lat) / 2) ** 2
+                 + math.cos(st.last_lat) * math.cos(lat) * math.sin((lon - st.last_lon) / 2) ** 2)
+            # Clamp rounding past 1 for antipodal points; NaN goes first since min(1.0, nan) is 1.0
+            dist = 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1.0))
+            hours = dt_seconds / 3600
+            if hours > 0 and not math.isnan(dist):
+                speed = dist / hours
+
+        out = {
+            "amount": float(tx["amount"]),
+            "last_tx_delta_minutes": delta,
+            "tx_count_1h": len(st.ts_1h),
+            "tx_count_24h": len(st.ts_24h),
+            "amount_mean_24h": (st.sum_cents + cents) / (len(st.ts_24h) + 1) / 100,
+            "geo_velocity_kmph_prev": speed,
+        }
+        for col in VECTOR_COLUMNS:
+            if col not in out:
+                out[col] = tx.get(col)
+
+        if update:
+            st.ts_24h.append(t_ns)
+            st.cents_24h.append(cents)
+            st.sum_cents += cents
+            st.ts_1h.append(t_ns)
+            st.last_ns, st.last_lat, st.last_lon = t_ns, lat, lon
+        return {c: out[c] for c in VECTOR_COLUMNS}
+
+    def replay(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Feed ``df`` in (ts, tx_id) order; return ``tx_id``, ``ts`` and the feature vectors."""
+        rows = []
+        for tx in df.sort_values(["ts", "tx_id"], kind="stable").to_dict("records"):
+            rows.append({"tx_id": tx["tx_id"], "ts": tx["ts"], **self.features(tx)})
+        logger.info("Replayed %d transactions over %d cards", len(df), len(self._cards))
+        return pd.DataFrame(rows, columns=["tx_id", "ts", *VECTOR_COLUMNS])
+
+    def snapshot(self, path: str) -> None:
+        """Write all card state to ``path`` as flat arrays (``.npz``); card ids are kept as strings."""
+        cards = list(self._cards)
+        states = [self._cards[c] for c in cards]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                # Fixed-width unicode, so restore never has to unpickle
+                cards=np.array([str(c) for c in cards], dtype=str),
+                n_24h=np.array([len(s.ts_24h) for s in states], dtype=np.int64),
+                n_1h=np.array([len(s.ts_1h) for s in states], dtype=np.int64),
+                ts=np.fromiter((t for s in states for t in s.ts_24h), dtype=np.int64),
+                cents=np.fromiter((c for s in states for c in s.cents_24h), dtype=np.int64),
+                last_ns=np.array([-1 if s.last_ns is None else s.last_ns for s in states], dtype=np.int64),
+                last_lat=np.array([s.last_lat for s in states], dtype=float),
+                last_lon=np.array([s.last_lon for s in states], dtype=float),
+            )
+        logger.info("Snapshotted %d cards to %s", len(cards), path)
+
+    @classmethod
+    def restore(cls, path: str) -> "OnlineFeatureStore":
+        """Load a store written by ``snapshot``."""
+        store = cls()
+        with np.load(path, allow_pickle=False) as z:
+            ends = np.cumsum(z["n_24h"])
+            ts, cents = z["ts"].tolist(), z["cents"].tolist()
+            for i, card in enumerate(z["cards"].tolist()):
+                st = _CardWindow()
+                lo, hi = int(ends[i] - z["n_24h"][i]), int(ends[i])
+                st.ts_24h.extend(ts[lo:hi])
+                st.cents_24h.extend(cents[lo:hi])
+                st.sum_cents = sum(cents[lo:hi])
+                st.ts_1h.extend(ts[hi - int(z["n_1h"][i]):hi])
+                last = int(z["last_ns"][i])
+                st.last_ns = None if last < 0 else last
+                st.last_lat, st.last_lon = float(z["last_lat"][i]), float(z["last_lon"][i])
+                store._cards[card] = st
+        logger.info("Restored %d cards from %s", len(store), path)
+        return store
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from src.utils import get_logger, get_settings, read_sql
+
+
+logger = get_logger(__name__)
+
+# Hive-style partition key: <snapshot_dir>/ds=YYYY-MM-DD/part-0.<ext>
+PARTITION_KEY = "ds"
+_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.dataset as pds  # type: ignore
+        import pyarrow.fs as pfs  # type: ignore
+    except Exception:
+        raise RuntimeError("pyarrow not installed. Install pyarrow to use feature snapshots.")
+    return pa, pds, pfs
+
+
+def _config(snapshot_dir: Optional[str], fmt: Optional[str]) -> tuple[str, str]:
+    ml = get_settings().get("ml", {})
+    snapshot_dir = snapshot_dir or ml.get("snapshot_dir", "artifacts/features")
+    fmt = fmt or ml.get("snapshot_format", "parquet")
+    if fmt not in _EXTENSIONS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    return snapshot_dir, fmt
+
+
+def snapshot_partitions(snapshot_dir: Optional[str] = None) -> list[date]:
+    """Dates already exported, oldest first."""
+    snapshot_dir, _ = _config(snapshot_dir, None)
+    if not os.path.isdir(snapshot_dir):
+        return []
+    prefix = f"{PARTITION_KEY}="
+    return sorted(date.fromisoformat(d[len(prefix):]) for d in os.listdir(snapshot_dir) if d.startswith(prefix))
+
+
+def _write_partition(pa, pds, df: pd.DataFrame, path: str, fmt: str) -> None:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    # Arrow IPC is left uncompressed so readers can memory-map it without copies
+    pds.write_dataset(table, tmp, format="ipc" if fmt == "arrow" else "parquet",
+                      basename_template=f"part-{{i}}.{_EXTENSIONS[fmt]}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def export_snapshots(snapshot_dir: Optional[str] = None, fmt: Optional[str] = None, rebuild: bool = False) -> list[date]:
+    """Export ``model_features`` to one partition per ``ts`` date; return the dates written.
+
+    Only dates newer than the last exported one are written, plus that last
+    date itself since it may have been exported while still filling up.
+    ``rebuild=True`` rewrites every partition.
+    """
+    pa, pds, _ = _pyarrow()
+    snapshot_dir, fmt = _config(snapshot_dir, fmt)
+    existing = [] if rebuild else snapshot_partitions(snapshot_dir)
+    since = existing[-1] if existing else None
+    q = "SELECT DISTINCT ts::date AS ds FROM model_features"
+    dates = read_sql(q + (" WHERE ts >= :since" if since else ""), {"since": since} if since else None)["ds"]
+    written = []
+    for ds in sorted(pd.to_datetime(dates).dt.date):
+        df = read_sql(
+            "SELECT * FROM model_features WHERE ts >= :lo AND ts < :hi",
+            {"lo": datetime.combine(ds, datetime.min.time()), "hi": datetime.combine(ds + timedelta(days=1), datetime.min.time())},
+        )
+        _write_partition(pa, pds, df, os.path.join(snapshot_dir, f"{PARTITION_KEY}={ds.isoformat()}"), fmt)
+        written.append(ds)
+    logger.info("Exported %d feature partitions to %s", len(written), snapshot_dir)
+    return written
+
+
+def _scan(columns: Optional[list[str]], start: Optional[datetime], end: Optional[datetime],
+          snapshot_dir: Optional[str], fmt: Optional[str]):
+    """Dataset over the exported partitions, the requested columns it has, and the date/ts filter."""
+    pa, pds, pfs = _pyarrow()
+    snapshot_dir, fmt = _config(snapshot_dir, fmt)
+    if not snapshot_partitions(snapshot_dir):
+        raise RuntimeError(f"No feature snapshots in {snapshot_dir}. Run `python -m src.cli snapshot` first.")
+    kwargs = dict(
+        format="ipc" if fmt == "arrow" else "parquet",
+        partitioning=pds.partitioning(pa.schema([(PARTITION_KEY, pa.date32())]), flavor="hive"),
+        filesystem=pfs.LocalFileSystem(use_mmap=True),
+    )
+    dataset = pds.dataset(snapshot_dir, **kwargs)
+    # Partitions exported before a column was added read it as nulls
+    schema = pa.unify_schemas([f.physical_schema for f in dataset.get_fragments()] + [dataset.schema])
+    dataset = pds.dataset(snapshot_dir, schema=schema, **kwargs)
+    if columns is not None:
+        columns = [c for c in columns if c in schema.names]
+    expr = None
+    for cond in (
+        (pds.field(PARTITION_KEY) >= start.date()) & (pds.field("ts") >= pa.scalar(start, pa.timestamp("us"))) if start else None,
+        (pds.field(PARTITION_KEY) <= end.date()) & (pds.field("ts") < pa.scalar(end, pa.timestamp("us"))) if end else None,
+    ):
+        if cond is not None:
+            expr = cond if expr is None else expr & cond
+    return dataset, columns, expr
+
+
+def _without_partition_key(df: pd.DataFrame, columns: Optional[list[str]]) -> pd.DataFrame:
+    if PARTITION_KEY in df.columns and (columns is None or PARTITION_KEY not in columns):
+        df = df.drop(columns=PARTITION_KEY)
+    return df
+
+
+def read_snapshots(
+    columns: Optional[list[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    snapshot_dir: Optional[str] = None,
+    fmt: Optional[str] = None,
+) -> pd.DataFrame:
+    """Read exported features with ``start <= ts < end``.
+
+    Partitions outside the date range are never opened, only ``columns`` are
+    read, and files are memory-mapped.
+    """
+    dataset, columns, expr = _scan(columns, start, end, snapshot_dir, fmt)
+    df = _without_partition_key(dataset.to_table(columns=columns, filter=expr).to_pandas(), columns)
+    logger.info("Read %d feature rows from snapshots", len(df))
+    return df
+
+
+def iter_snapshots(
+    columns: Optional[list[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 100_000,
+    snapshot_dir: Optional[str] = None,
+    fmt: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """Like ``read_snapshots`` but yields frames of at most ``batch_size`` rows."""
+    dataset, columns, expr = _scan(columns, start, end, snapshot_dir, fmt)
+    for batch in dataset.to_batches(columns=columns, filter=expr, batch_size=batch_size):
+        if batch.num_rows:
+            yield _without_partition_key(batch.to_pandas(), columns)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from src.utils import get_logger
+from src.utils.cards import EARTH_RADIUS_KM
+from .build_features import FEATURE_COLUMNS, _full_query, _incremental_query
+
+
+logger = get_logger(__name__)
+
+
+def _preceding(window: timedelta) -> str:
+    """Frame offset for the half-open window (t - window, t]; ts has microsecond resolution."""
+    us = window // timedelta(microseconds=1) - 1
+    return f"INTERVAL '{us} microseconds' PRECEDING"
+
+
+def _haversine_sql() -> str:
+    dlat = "(radians(lat) - radians(prev_lat)) / 2"
+    dlon = "(radians(lon) - radians(prev_lon)) / 2"
+    a = f"power(sin({dlat}), 2) + cos(radians(prev_lat)) * cos(radians(lat)) * power(sin({dlon}), 2)"
+    # Rounding can push sqrt(a) just past 1 for (near-)antipodal points; asin would raise
+    return f"{2 * EARTH_RADIUS_KM!r}::float8 * asin(LEAST(1.0, sqrt({a})))"
+
+
+def features_sql(source: str, incremental: bool = False) -> str:
+    """``INSERT ... SELECT`` computing model features for ``source`` rows inside Postgres.
+
+    With ``incremental`` only rows at or after their ``pending_from`` column
+    (see ``_incremental_query``) are written; the rest is history.
+
+    Windows follow the pandas kernel: per card, ordered by (ts, tx_id), over
+    (t - w, t]. A RANGE frame can only order by ts and always includes every
+    row tied with the current one, so tied rows later in tx_id order are
+    subtracted through the ``later_ties`` window.
+    """
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in FEATURE_COLUMNS[1:])
+    return f"""
+        WITH src AS (
+            SELECT s.*, round(s.amount * 100)::bigint AS cents FROM ({source}) s
+        ),
+        win AS (
+            SELECT src.*,
+                EXTRACT(EPOCH FROM ts - lag(ts) OVER by_tx)::float8 AS dt_seconds,
+                lag(lat) OVER by_tx AS prev_lat,
+                lag(lon) OVER by_tx AS prev_lon,
+                count(*) OVER last_1h AS n_1h,
+                count(*) OVER last_24h AS n_24h,
+                sum(cents) OVER last_24h AS cents_24h,
+                count(*) OVER later_ties AS n_ties,
+                COALESCE(sum(cents) OVER later_ties, 0) AS cents_ties
+            FROM src
+            WINDOW
+                by_tx AS (PARTITION BY card_id ORDER BY ts, tx_id),
+                last_1h AS (PARTITION BY card_id ORDER BY ts RANGE BETWEEN {_preceding(timedelta(hours=1))} AND CURRENT ROW),
+                last_24h AS (PARTITION BY card_id ORDER BY ts RANGE BETWEEN {_preceding(timedelta(hours=24))} AND CURRENT ROW),
+                later_ties AS (PARTITION BY card_id, ts ORDER BY tx_id ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING)
+        )
+        INSERT INTO model_features ({", ".join(FEATURE_COLUMNS)})
+        SELECT
+            tx_id,
+            label_fraud,
+            amount,
+            COALESCE(dt_seconds / 60, 1e6),
+            n_1h - n_ties - 1,
+            n_24h - n_ties - 1,
+            (cents_24h - cents_ties)::float8 / (n_24h - n_ties) / 100,
+            CASE WHEN dt_seconds > 0 THEN COALESCE({_haversine_sql()} / (dt_seconds / 3600), 0) ELSE 0 END,
+            channel,
+            device_id,
+            merchant_risk_tier,
+            brand,
+            ts
+        FROM win
+        WHERE {"ts >= pending_from" if incremental else "TRUE"}
+        ON CONFLICT (tx_id) DO UPDATE SET {updates}
+    """
+
+
+def build_features_sql(con, watermark: datetime | None, high: datetime) -> int:
+    """Compute and upsert features for the run's window on ``con``; return rows written."""
+    if watermark is not None:
+        source, params = _incremental_query(high)
+    else:
+        source, params = _full_query(high)
+    n = con.execute(text(features_sql(source, watermark is not None)), params).rowcount
+    logger.info("Built %d feature rows in Postgres", n)
+    return n
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Mapping
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler, TargetEncoder
+
+from src.utils import get_logger
+from .encoders import FrequencyEncoder, is_missing, lookup
+
+
+logger = get_logger(__name__)
+
+# Batches up to this size walk all trees at once; larger ones go tree by tree
+_LOCKSTEP_ROWS = 512
+
+_ARRAYS = ("roots", "feature", "threshold", "left", "right", "missing_left", "cat_code", "value", "scale")
+
+
+class CompiledEnsemble:
+    """A fitted ``build_pipeline`` tree model as flat NumPy arrays.
+
+    Inputs are one float32 vector per row: the scaled numeric columns, one
+    category code per one-hot column (-1 when unseen), then the value of each
+    frequency/target-encoded column from its ``lookups`` table. Nodes of all
+    trees share the arrays; a node on a one-hot column tests its code for
+    equality (``cat_code`` >= 0) and every node then compares its input with
+    ``threshold``, going left when ``<=``. NaN inputs follow ``missing_left``;
+    with ``zero_missing`` (xgboost fed sparse matrices) zeros count as missing
+    too. Leaves have ``left == -1`` and carry ``value``: class-1 probability
+    averaged over trees (``kind="rf"``) or a margin summed onto ``base`` and
+    passed through the logistic (``kind="xgb"``).
+    """
+
+    def __init__(self, kind: str, numeric: list[str], categorical: list[str], categories: list[list],
+                 base: float = 0.0, zero_missing: bool = False, lookups: list[dict] | None = None,
+                 **arrays: np.ndarray) -> None:
+        self.kind = kind
+        self.numeric = numeric
+        self.categorical = categorical
+        self.categories = categories
+        self.lookups = lookups or []
+        self.base = base
+        self.zero_missing = zero_missing
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        # The one-hot encoder sorts a learned None/NaN category last; missing inputs take its code
+        self._known = [[c for c in cats if not is_missing(c)] for cats in categories]
+        self._missing_code = [len(known) if len(known) < len(cats) else -1 for known, cats in zip(self._known, categories)]
+        self._codes = [{v: i for i, v in enumerate(known)} for known in self._known]
+        self._index = [pd.Index(known, dtype=object) for known in self._known]
+        self._lookup_maps = [dict(zip(lk["categories"], lk["values"])) for lk in self.lookups]
+        self._lookup_index = [pd.Index(lk["categories"], dtype=object) for lk in self.lookups]
+        # A node sends its input right when lo < x <= hi: x > threshold, or x == the
+        # node's category code (one-hot indicator 1 goes right of its split)
+        self._is_cat = self.cat_code >= 0
+        self._lo = np.where(self._is_cat, self.cat_code - 0.5, self.threshold)
+        self._hi = np.where(self._is_cat, self.cat_code + 0.5, np.inf)
+        # Leaves point to themselves so every row can take the same number of steps
+        leaf = self.left < 0
+        idx = np.arange(len(self.left))
+        self._children = np.column_stack([np.where(leaf, idx, self.left), np.where(leaf, idx, self.right)]).astype(np.int32).ravel()
+        self._feature = self.feature.astype(np.int32)
+        self._depth = self._max_depth()
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    # -- inputs ------------------------------------------------------------
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """Rows of ``df`` as evaluator inputs (n_rows x n_columns float32)."""
+        n_num, n_cat = len(self.numeric), len(self.categorical)
+        out = np.empty((len(df), n_num + n_cat + len(self.lookups)), dtype=np.float32)
+        if self.numeric:
+            # Same float64 division then float32 cast as the scaler feeding sklearn's trees
+            out[:, :n_num] = df[self.numeric].to_numpy(dtype=np.float64) / self.scale
+        for j, (col, index) in enumerate(zip(self.categorical, self._index)):
+            values = df[col].to_numpy(dtype=object)
+            out[:, n_num + j] = np.where(pd.isna(values), self._missing_code[j], index.get_indexer(values))
+        for k, (lk, index) in enumerate(zip(self.lookups, self._lookup_index)):
+            out[:, n_num + n_cat + k] = lookup(df[lk["column"]], index, lk["values"], lk["unseen"], lk["missing"])
+        return out
+
+    def _row(self, row: Mapping[str, Any]) -> np.ndarray:
+        x = [float(row[c]) for c in self.numeric]
+        n_cat = len(self.categorical)
+        vec = np.empty(len(x) + n_cat + len(self.lookups), dtype=np.float32)
+        vec[:len(x)] = np.asarray(x) / self.scale
+        for j, col in enumerate(self.categorical):
+            v = row[col]
+            vec[len(x) + j] = self._missing_code[j] if is_missing(v) else self._codes[j].get(v, -1)
+        for k, (lk, values) in enumerate(zip(self.lookups, self._lookup_maps)):
+            v = row[lk["column"]]
+            vec[len(x) + n_cat + k] = lk["missing"] if is_missing(v) else values.get(v, lk["unseen"])
+        return vec
+
+    # -- evaluation --------------------------------------------------------
+
+    def _max_depth(self) -> int:
+        depth, frontier = 0, self.roots
+        while len(frontier):
+            frontier = frontier[self.left[frontier] >= 0]
+            frontier = np.concatenate([self.left[frontier], self.right[frontier]])
+            depth += 1
+        return max(depth - 1, 0)
+
+    def _go_right(self, v: np.ndarray, node: Any, check_missing: bool) -> np.ndarray:
+        right = (v > self._lo[node]) & (v <= self._hi[node])
+        if check_missing:
+            missing = np.isnan(v)
+            if self.zero_missing:
+                missing |= np.where(self._is_cat[node], ~right, v == 0)
+            right = np.where(missing, ~self.missing_left[node], right)
+        return right
+
+    def _leaf_sum_lockstep(self, X: np.ndarray) -> np.ndarray:
+        """Walk every (row, tree) pair one level per step; cheap for a handful of rows."""
+        flat = X.ravel()
+        offset = (np.arange(len(X), dtype=np.int32) * X.shape[1])[:, None]
+        check_missing = self.zero_missing or bool(np.isnan(X).any())
+        node = np.broadcast_to(self.roots.astype(np.int32), (len(X), self.n_trees))
+        for _ in range(self._depth):
+            right = self._go_right(flat[offset + self._feature[node]], node, check_missing)
+            node = self._children[2 * node + right]
+        return self.value[node].sum(axis=1)
+
+    def _leaf_sum_partition(self, X: np.ndarray) -> np.ndarray:
+        """Route row indices down each tree node by node; each step is a contiguous column pass."""
+        cols = [np.ascontiguousarray(X[:, j]) for j in range(X.shape[1])]
+        check_missing = self.zero_missing or bool(np.isnan(X).any())
+        total = np.zeros(len(X))
+        everyone = np.arange(len(X))
+        for root in self.roots.tolist():
+            stack = [(root, everyone)]
+            while stack:
+                node, idx = stack.pop()
+                if self.left[node] < 0:
+                    total[idx] += self.value[node]
+                    continue
+                right = self._go_right(cols[self.feature[node]][idx], node, check_missing)
+                for child, rows in ((self.left[node], idx[~right]), (self.right[node], idx[right])):
+                    if len(rows):
+                        stack.append((child, rows))
+        return total
+
+    def _proba(self, X: np.ndarray) -> np.ndarray:
+        leaf_sum = self._leaf_sum_lockstep(X) if len(X) <= _LOCKSTEP_ROWS else self._leaf_sum_partition(X)
+        if self.kind == "rf":
+            return leaf_sum / self.n_trees
+        return 1.0 / (1.0 + np.exp(-(self.base + leaf_sum)))
+
+    def predict_proba(self, df: pd.DataFrame) -> np.ndarray:
+        """Class probabilities like ``Pipeline.predict_proba`` (n_rows x 2)."""
+        p = self._proba(self.transform(df))
+        return np.column_stack([1.0 - p, p])
+
+    def predict_one(self, row: Mapping[str, Any]) -> float:
+        """Class-1 probability of one feature row (a mapping), skipping pandas."""
+        return float(self._proba(self._row(row)[None, :])[0])
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        meta = {
+            "kind": self.kind, "numeric": self.numeric, "categorical": self.categorical,
+            "categories": self.categories, "base": self.base, "zero_missing": self.zero_missing,
+            "lookups": self.lookups,
+        }
+        with open(path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **{n: getattr(self, n) for n in _ARRAYS})
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledEnsemble":
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"]))
+            return cls(**meta, **{n: z[n] for n in _ARRAYS})
+
+
+def _lookup_table(column: str, categories: Any, encodings: np.ndarray, unseen: float, missing: float | None) -> dict:
+    cats = [c.item() if isinstance(c, np.generic) else c for c in categories]
+    seen = [i for i, c in enumerate(cats) if not is_missing(c)]
+    if missing is None:
+        # An encoder that learned a None/NaN category keeps its encoding for missing values
+        learned = [i for i in range(len(cats)) if i not in seen]
+        missing = float(encodings[learned[0]]) if learned else unseen
+    return {
+        "column": column,
+        "categories": [cats[i] for i in seen],
+        "values": np.asarray(encodings, dtype=np.float64)[seen].tolist(),
+        "unseen": float(unseen),
+        "missing": float(missing),
+    }
+
+
+def _preprocessing(pipe: Pipeline) -> tuple[list[str], np.ndarray, list[str], list[list], list[dict], list[tuple[int, int]]]:
+    """Numeric columns and scales, one-hot columns and categories, lookup tables
+    for frequency/target-encoded columns, and the (input slot, category code)
+    behind every transformed feature."""
+    numeric, scale, categorical, categories, lookups = [], np.ones(0), [], [], []
+    # Transformed features in transformer order, as (block, index in block, category code)
+    layout: list[tuple[str, int, int]] = []
+    for name, trans, cols in pipe.named_steps["pre"].transformers_:
+        if name == "num":
+            if not isinstance(trans, StandardScaler) or trans.with_mean:
+                raise ValueError("Only StandardScaler(with_mean=False) numeric steps can be compiled")
+            numeric = list(cols)
+            scale = np.asarray(trans.scale_ if trans.scale_ is not None else np.ones(len(cols)), dtype=np.float64)
+            layout += [("num", j, -1) for j in range(len(cols))]
+        elif isinstance(trans, OneHotEncoder):
+            if trans.drop_idx_ is not None:
+                raise ValueError("Only OneHotEncoder without drop can be compiled")
+            for col, cats in zip(cols, trans.categories_):
+                layout += [("cat", len(categorical), k) for k in range(len(cats))]
+                categorical.append(col)
+                categories.append(cats.tolist())
+        elif isinstance(trans, FrequencyEncoder):
+            for col, cats, enc, missing in zip(cols, trans.categories_, trans.encodings_, trans.missing_):
+                layout.append(("lookup", len(lookups), -1))
+                lookups.append(_lookup_table(col, cats, enc, 0.0, missing))
+        elif isinstance(trans, TargetEncoder):
+            if trans.target_type_ != "binary":
+                raise ValueError("Only binary TargetEncoder steps can be compiled")
+            for col, cats, enc in zip(cols, trans.categories_, trans.encodings_):
+                layout.append(("lookup", len(lookups), -1))
+                lookups.append(_lookup_table(col, cats, enc, trans.target_mean_, None))
+        elif trans != "drop":
+            raise ValueError(f"Cannot compile transformer {name!r} ({type(trans).__name__})")
+    start = {"num": 0, "cat": len(numeric), "lookup": len(numeric) + len(categorical)}
+    columns = [(start[block] + j, code) for block, j, code in layout]
+    return numeric, scale, categorical, categories, lookups, columns
+
+
+def _compile_rf(clf: RandomForestClassifier, columns: list[tuple[int, int]]) -> dict[str, np.ndarray]:
+    pos = list(clf.classes_).index(clf.classes_[-1])
+    parts = {n: [] for n in ("feature", "threshold", "left", "right", "missing_left", "cat_code", "value")}
+    roots, offset = [], 0
+    for est in clf.estimators_:
+        t = est.tree_
+        leaf = t.children_left < 0
+        f = np.where(leaf, 0, t.feature)
+        col = np.array([columns[i] for i in f], dtype=np.int64).reshape(-1, 2)
+        counts = t.value[:, 0, :]
+        roots.append(offset)
+        parts["feature"].append(col[:, 0])
+        parts["cat_code"].append(np.where(leaf, -1, col[:, 1]))
+        parts["threshold"].append(t.threshold)
+        parts["left"].append(np.where(leaf, -1, t.children_left + offset))
+        parts["right"].append(np.where(leaf, -1, t.children_right + offset))
+        missing = getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8))
+        parts["missing_left"].append(missing.astype(bool))
+        parts["value"].append(counts[:, pos] / counts.sum(axis=1))
+        offset += t.node_count
+    out = {n: np.concatenate(v) for n, v in parts.items()}
+    out["roots"] = np.array(roots)
+    return out
+
+
+def _compile_xgb(clf: Any, columns: list[tuple[int, int]]) -> tuple[dict[str, np.ndarray], float]:
+    booster = clf.get_booster()
+    trees = booster.trees_to_dataframe()
+    names = booster.feature_names
+    trees = trees.sort_values(["Tree", "Node"]).reset_index(drop=True)
+    index = {i: n for n, i in enumerate(trees["ID"])}
+    leaf = (trees["Feature"] == "Leaf").to_numpy()
+    feat = trees["Feature"].where(~leaf, names[0] if names else "f0")
+    f = feat.map(names.index if names else (lambda s: int(s[1:]))).to_numpy()
+    col = np.array([columns[i] for i in f], dtype=np.int64).reshape(-1, 2)
+    split = trees["Split"].fillna(0).to_numpy(dtype=np.float32)
+    # xgboost goes "yes" when x < split in float32; for float32 x that is x <= the next float down
+    threshold = np.nextafter(split, np.float32(-np.inf)).astype(np.float64)
+    child = lambda c: np.array([-1 if l else index[i] for l, i in zip(leaf, trees[c])], dtype=np.int64)
+    left, right, missing = child("Yes"), child("No"), child("Missing")
+    config = json.loads(booster.save_config())
+    base_score = float(config["learner"]["learner_model_param"]["base_score"])
+    arrays = {
+        "roots": trees.index[trees["Node"] == 0].to_numpy(),
+        "feature": col[:, 0],
+        "cat_code": np.where(leaf, -1, col[:, 1]),
+        "threshold": threshold,
+        "left": left,
+        "right": right,
+        "missing_left": missing == left,
+        "value": trees["Gain"].where(leaf, 0.0).to_numpy(dtype=np.float64),
+    }
+    return arrays, float(np.log(base_score / (1 - base_score)))
+
+
+def compile_pipeline(pipe: Pipeline) -> CompiledEnsemble:
+    """Compile a fitted ``build_pipeline`` (rf, or xgb when installed) into a ``CompiledEnsemble``."""
+    numeric, scale, categorical, categories, lookups, columns = _preprocessing(pipe)
+    clf = pipe.named_steps["clf"]
+    if isinstance(clf, RandomForestClassifier):
+        arrays, kind, base, zero_missing = _compile_rf(clf, columns), "rf", 0.0, False
+    elif type(clf).__name__ == "XGBClassifier":
+        arrays, base = _compile_xgb(clf, columns)
+        # A sparse design matrix hands xgboost its zeros as missing values
+        kind, zero_missing = "xgb", bool(pipe.named_steps["pre"].sparse_output_)
+    else:
+        raise ValueError(f"Cannot compile {type(clf).__name__}")
+    model = CompiledEnsemble(kind, numeric, categorical, categories, base, zero_missing, lookups, scale=scale, **arrays)
+    logger.info("Compiled %d trees / %d nodes", model.n_trees, len(model.feature))
+    return model
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import Any, Mapping
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.preprocessing import OneHotEncoder, TargetEncoder
+
+
+ENCODERS = ("onehot", "hashing", "frequency", "target")
+
+
+def is_missing(value: Any) -> bool:
+    return value is None or value != value
+
+
+def lookup(values: Any, index: pd.Index, encodings: np.ndarray, unseen: float, missing: float) -> np.ndarray:
+    """Per-category encodings of ``values``; ``unseen`` for other values, ``missing`` for None/NaN.
+
+    ``index`` holds the categories; keep it between calls so its hash table is built once.
+    """
+    values = np.asarray(values, dtype=object)
+    out = np.append(np.asarray(encodings, dtype=np.float64), unseen)[index.get_indexer(values)]
+    out[pd.isna(values)] = missing
+    return out
+
+
+class FrequencyEncoder(TransformerMixin, BaseEstimator):
+    """Each category as its share of the training rows (0 when unseen); one column per input.
+
+    ``categories_`` holds a ``pd.Index`` per column, so transforms reuse its hash table.
+    """
+
+    def fit(self, X: Any, y: Any = None) -> "FrequencyEncoder":
+        for attr in ("counts_", "n_missing_", "n_rows_"):
+            self.__dict__.pop(attr, None)
+        return self.partial_fit(X)
+
+    def partial_fit(self, X: Any, y: Any = None) -> "FrequencyEncoder":
+        """Add the rows of ``X`` to the counts; memory grows with distinct values, not rows."""
+        X = np.asarray(X, dtype=object)
+        if not hasattr(self, "counts_"):
+            self.n_features_in_ = X.shape[1]
+            self.counts_ = [pd.Series(dtype=np.float64) for _ in range(X.shape[1])]
+            self.n_missing_ = np.zeros(X.shape[1])
+            self.n_rows_ = 0
+        self.n_rows_ += len(X)
+        for j in range(X.shape[1]):
+            col = pd.Series(X[:, j])
+            self.n_missing_[j] += col.isna().sum()
+            self.counts_[j] = self.counts_[j].add(col.dropna().value_counts(), fill_value=0)
+        self.categories_ = [c.index for c in self.counts_]
+        self.encodings_ = [c.to_numpy() / self.n_rows_ for c in self.counts_]
+        self.missing_ = (self.n_missing_ / self.n_rows_).tolist()
+        return self
+
+    def transform(self, X: Any) -> np.ndarray:
+        X = np.asarray(X, dtype=object)
+        return np.column_stack([
+            lookup(X[:, j], cats, enc, 0.0, missing)
+            for j, (cats, enc, missing) in enumerate(zip(self.categories_, self.encodings_, self.missing_))
+        ])
+
+    def get_feature_names_out(self, input_features: Any = None) -> np.ndarray:
+        names = input_features if input_features is not None else [f"x{j}" for j in range(self.n_features_in_)]
+        return np.asarray([f"{c}_freq" for c in names], dtype=object)
+
+
+class HashingEncoder(TransformerMixin, BaseEstimator):
+    """Categories hashed into ``n_features`` sparse indicator columns, whatever the cardinality.
+
+    Stateless: unseen values hash like any other, and colliding categories
+    share a column.
+    """
+
+    def __init__(self, n_features: int = 1024) -> None:
+        self.n_features = n_features
+
+    def fit(self, X: Any, y: Any = None) -> "HashingEncoder":
+        self.n_features_in_ = np.asarray(X, dtype=object).shape[1]
+        return self
+
+    partial_fit = fit
+
+    def transform(self, X: Any):
+        X = np.asarray(X, dtype=object)
+        hasher = FeatureHasher(self.n_features, input_type="string", alternate_sign=False)
+        prefixes = [f"{j}=" for j in range(X.shape[1])]
+        return hasher.transform([p + str(v) for p, v in zip(prefixes, row)] for row in X)
+
+    def get_feature_names_out(self, input_features: Any = None) -> np.ndarray:
+        return np.asarray([f"hash{i}" for i in range(self.n_features)], dtype=object)
+
+
+def make_encoder(spec: Mapping[str, Any] | None) -> Any:
+    """Encoder for one ``features.encoders`` entry of config/model.yaml (default one-hot)."""
+    spec = dict(spec or {})
+    kind = spec.pop("type", "onehot")
+    if kind == "onehot":
+        return OneHotEncoder(handle_unknown="ignore")
+    if kind == "hashing":
+        return HashingEncoder(int(spec.get("n_features", 1024)))
+    if kind == "frequency":
+        return FrequencyEncoder()
+    if kind == "target":
+        # fit_transform encodes each training row from the other folds only
+        return TargetEncoder(target_type="binary", cv=int(spec.get("cv", 5)), smooth=spec.get("smooth", "auto"))
+    raise ValueError(f"Unknown encoder {kind!r}; expected one of {', '.join(ENCODERS)}")
@@ -12,8 +12,8 @@ from .metrics import compute_and_plot
 logger = get_logger(__name__)
 
 
-def evaluate(model_path: str, out_dir: str = "artifacts/plots") -> None:
-    df = load_feature_table()
+def evaluate(model_path: str, out_dir: str = "artifacts/plots", source: str | None = None) -> None:
+    df = load_feature_table(source=source)
     if df.empty:
         raise RuntimeError("No features to evaluate.")
     y_col = "label_fraud"
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import glob
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.metrics import average_precision_score, classification_report
+from sklearn.pipeline import Pipeline
+
+from src.utils import get_logger, get_settings, read_sql
+from .predict import model_time
+from .preprocessing import iter_feature_table, latest_feature_ts, stream_sql
+from .train import build_pipeline, load_model_spec, save_model
+
+
+logger = get_logger(__name__)
+
+# Streaming models are saved as sgd_<timestamp>.joblib; warm starts continue the newest
+STREAM_PREFIX = "sgd"
+
+Chunks = Callable[[], Iterable[pd.DataFrame]]
+
+
+def streaming_pipeline(
+    numeric: list[str],
+    categorical: list[str],
+    encoders: dict,
+    hash_features: int = 1024,
+    params: Optional[dict] = None,
+) -> Pipeline:
+    """``build_pipeline(algo="sgd")`` with encoders that learn chunk by chunk.
+
+    One-hot columns are hashed, since their vocabulary is unknown until the
+    last chunk; target encoding needs every row at once and is refused.
+    """
+    streaming = {}
+    for col in categorical:
+        spec = encoders.get(col, {"type": "onehot"})
+        if spec["type"] == "onehot":
+            spec = {"type": "hashing", "n_features": hash_features}
+        elif spec["type"] == "target":
+            raise ValueError(f"Target encoding of {col!r} needs the full table; use hashing or frequency to train streaming")
+        streaming[col] = spec
+    return build_pipeline(numeric, categorical, "sgd", streaming, params)
+
+
+def partial_fit_preprocessing(pre: ColumnTransformer, X: pd.DataFrame) -> None:
+    """Fit ``pre`` on its first chunk, then update the scaler and encoders with each later one."""
+    if not hasattr(pre, "transformers_"):
+        pre.fit(X)
+        return
+    for _, trans, cols in pre.transformers_:
+        if hasattr(trans, "partial_fit"):
+            trans.partial_fit(X[cols])
+
+
+def _xy(chunk: pd.DataFrame, target: str) -> tuple[pd.DataFrame, np.ndarray]:
+    y = chunk[target].astype("boolean").fillna(False).astype(int).to_numpy()
+    return chunk.drop(columns=[target, "tx_id", "ts"]), y
+
+
+def fit_streaming(
+    pipe: Pipeline,
+    chunks: Chunks,
+    target: str,
+    epochs: int = 1,
+    relabeled: Optional[Chunks] = None,
+    class_counts: Optional[list[float]] = None,
+) -> tuple[np.ndarray, int]:
+    """Train ``pipe`` over ``chunks()`` without holding more than one chunk.
+
+    A first pass updates the scaler, encoders and class counts; then each of
+    ``epochs`` passes feeds every chunk (and ``relabeled()`` rows, whose
+    labels changed after they were last seen) to ``partial_fit``. Classes are
+    weighted by the running counts. Returns the counts and new rows seen.
+    """
+    pre, clf = pipe.named_steps["pre"], pipe.named_steps["clf"]
+    counts = np.zeros(2) if class_counts is None else np.asarray(class_counts, dtype=np.float64)
+    rows = 0
+    for chunk in chunks():
+        X, y = _xy(chunk, target)
+        partial_fit_preprocessing(pre, X)
+        counts += np.bincount(y, minlength=2)
+        rows += len(y)
+    if not hasattr(pre, "transformers_"):
+        raise RuntimeError("No features to train on. Run `python -m src.cli features` first.")
+    # partial_fit has no "balanced"; the same weights from counts so far
+    clf.class_weight = {c: counts.sum() / (2 * max(n, 1)) for c, n in enumerate(counts)}
+    sources = [chunks] + ([relabeled] if relabeled is not None else [])
+    for epoch in range(epochs):
+        t0, fed = time.perf_counter(), 0
+        for source in sources:
+            for chunk in source():
+                X, y = _xy(chunk, target)
+                clf.partial_fit(pre.transform(X), y, classes=np.array([0, 1]))
+                fed += len(y)
+        logger.info("Epoch %d/%d: %d rows in %.1fs", epoch + 1, epochs, fed, time.perf_counter() - t0)
+    return counts, rows
+
+
+def score_streaming(pipe: Pipeline, chunks: Iterable[pd.DataFrame], target: str) -> tuple[np.ndarray, np.ndarray]:
+    """Labels and fraud probabilities for every row of ``chunks``, one chunk in memory at a time."""
+    ys, probas = [], []
+    for chunk in chunks:
+        X, y = _xy(chunk, target)
+        ys.append(y)
+        probas.append(pipe.predict_proba(X)[:, 1])
+    if not ys:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    return np.concatenate(ys), np.concatenate(probas)
+
+
+def _complete_columns(columns: list[str], source: Optional[str], chunksize: int) -> list[str]:
+    """The ``columns`` with a value on every feature row, from a narrow streaming scan."""
+    complete = set(columns)
+    for chunk in iter_feature_table(columns=columns, source=source, chunksize=chunksize):
+        complete = {c for c in complete if c in chunk.columns and chunk[c].notna().all()}
+        if not complete:
+            break
+    return [c for c in columns if c in complete]
+
+
+def _relabeled_chunks(columns: list[str], since: Optional[datetime], until: datetime, chunksize: int) -> Iterator[pd.DataFrame]:
+    """Rows before ``until`` whose label was written by `label-fraud` after ``since``."""
+    select = ", ".join("l.label AS label_fraud" if c == "label_fraud" else f"f.{c}" for c in columns)
+    sql = f"SELECT {select} FROM model_features f JOIN labels l ON l.tx_id = f.tx_id WHERE f.ts < :until"
+    params: dict = {"until": until}
+    if since is not None:
+        sql += " AND l.created_at > :since"
+        params["since"] = since
+    return stream_sql(sql, params, chunksize)
+
+
+def _latest_stream_model(model_dir: str) -> Optional[str]:
+    paths = glob.glob(os.path.join(model_dir, f"{STREAM_PREFIX}_*.joblib"))
+    return max(paths, key=model_time) if paths else None
+
+
+def train_streaming(
+    model_dir: str = "artifacts/models",
+    source: Optional[str] = None,
+    warm_start: bool = False,
+    chunksize: Optional[int] = None,
+    epochs: Optional[int] = None,
+) -> tuple[str, str]:
+    """Out-of-core ``train``: SGD logistic regression over feature chunks.
+
+    Rows before ``max(ts) - split.val_days`` train and later ones validate,
+    as in ``time_split``, but only ``ml.streaming.chunksize`` rows are in
+    memory at once. ``warm_start`` continues the newest streaming model with
+    the rows that arrived since it was trained plus rows relabeled by
+    `label-fraud` since then, keeping its features and scaler/encoder state.
+    Labels from the ``labels`` table only reach the database source, since
+    snapshots keep the labels they were exported with, so ``warm_start``
+    needs ``source="db"``.
+    """
+    ml = get_settings().get("ml", {})
+    source = source or ml.get("feature_source", "db")
+    if warm_start and source != "db":
+        raise ValueError("Warm starts replay labels from the database; use --source db")
+    scfg = ml.get("streaming", {})
+    chunksize = int(chunksize or scfg.get("chunksize", 100_000))
+    epochs = int(epochs or scfg.get("epochs", 1))
+    os.makedirs(model_dir, exist_ok=True)
+    spec = load_model_spec()
+    target = spec.get("target", "label_fraud")
+
+    latest = latest_feature_ts(source)
+    if latest is None or pd.isna(latest):
+        raise RuntimeError("No features to train on. Run `python -m src.cli features` first.")
+    cutoff = pd.Timestamp(latest).to_pydatetime() - timedelta(days=int(spec.get("split", {}).get("val_days", 7)))
+    labels_through = read_sql("SELECT max(created_at) AS t FROM labels")["t"].iloc[0]
+    labels_through = None if pd.isna(labels_through) else pd.Timestamp(labels_through).to_pydatetime()
+
+    previous = _latest_stream_model(model_dir) if warm_start else None
+    if previous:
+        bundle = joblib.load(previous)
+        pipe, numeric, categorical, encoders = bundle["pipeline"], bundle["numeric"], bundle["categorical"], bundle["encoders"]
+        state = bundle["streaming"]
+        columns = ["tx_id", "ts", target, *numeric, *categorical]
+        since = state["cutoff"]
+        if cutoff <= since and labels_through == state["labels_through"]:
+            logger.info("No new rows or labels since %s; keeping it", os.path.basename(previous))
+            return previous, os.path.join(model_dir, "feature_list.json")
+        chunks: Chunks = lambda: iter_feature_table(columns, start=since, end=cutoff, source=source, chunksize=chunksize)
+        relabeled: Optional[Chunks] = lambda: _relabeled_chunks(columns, state["labels_through"], since, chunksize)
+        class_counts, rows_before = state["class_counts"], state["rows"]
+        logger.info("Warm start from %s: rows in [%s, %s) plus labels after %s", os.path.basename(previous), since, cutoff, state["labels_through"])
+    else:
+        if warm_start:
+            logger.info("No streaming model in %s yet; training from scratch", model_dir)
+        numeric = spec["features"].get("numeric", [])
+        categorical = spec["features"].get("categorical", [])
+        encoders = spec["features"].get("encoders") or {}
+        # Optional features only join the model when every row has them
+        used = _complete_columns(spec["features"].get("optional", []), source, chunksize)
+        if used:
+            logger.info("Using optional features: %s", ", ".join(used))
+        numeric = numeric + used
+        pipe = streaming_pipeline(numeric, categorical, encoders, int(scfg.get("hash_features", 1024)), spec.get("model", {}).get("sgd"))
+        columns = ["tx_id", "ts", target, *numeric, *categorical]
+        chunks = lambda: iter_feature_table(columns, end=cutoff, source=source, chunksize=chunksize)
+        relabeled, class_counts, rows_before = None, None, 0
+
+    t0 = time.perf_counter()
+    counts, rows = fit_streaming(pipe, chunks, target, epochs, relabeled, class_counts)
+    logger.info("Fit sgd on %d new rows in chunks of %d in %.1fs", rows, chunksize, time.perf_counter() - t0)
+
+    y_val, proba = score_streaming(pipe, iter_feature_table(columns, start=cutoff, source=source, chunksize=chunksize), target)
+    if len(y_val):
+        logger.info("Validation report:\n%s", classification_report(y_val, (proba >= 0.5).astype(int), zero_division=0))
+        if y_val.any():
+            logger.info("Validation PR-AUC: %.4f", average_precision_score(y_val, proba))
+
+    bundle = {
+        "pipeline": pipe, "numeric": numeric, "categorical": categorical, "encoders": encoders, "target": target,
+        "streaming": {
+            "cutoff": cutoff, "labels_through": labels_through,
+            "class_counts": counts.tolist(), "rows": rows_before + rows,
+        },
+    }
+    return save_model(bundle, model_dir, STREAM_PREFIX)
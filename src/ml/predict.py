@@ -2,51 +2,87 @@ from __future__ import annotations
 
 import glob
 import os
+import time
 from datetime import datetime, timedelta
 
 import joblib
 import pandas as pd
+from sqlalchemy import text
 
-from src.utils import get_logger, read_sql, write_df, get_settings
+from src.utils import copy_df, get_engine, get_logger, get_settings
 
 
 logger = get_logger(__name__)
 
 
+def model_time(path: str) -> tuple[datetime, float, str]:
+    """Sort key for model artifacts: the UTC timestamp in ``<prefix>_<timestamp>.joblib``.
+
+    Falls back to the file's mtime for names without one; ties go to the newer
+    file. Comparing names alone would rank every ``sgd_*`` above ``rf_*``.
+    """
+    mtime = os.path.getmtime(path)
+    stamp = os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[-1]
+    try:
+        trained = datetime.strptime(stamp, "%Y%m%d%H%M%S")
+    except ValueError:
+        trained = datetime.utcfromtimestamp(mtime)
+    return trained, mtime, path
+
+
 def _latest_model(model_dir: str = "artifacts/models") -> str:
     paths = glob.glob(os.path.join(model_dir, "*.joblib"))
     if not paths:
         raise FileNotFoundError("No models found in artifacts/models. Train one first.")
-    return sorted(paths)[-1]
+    return max(paths, key=model_time)
+
+
+def score_frame(pipe, df: pd.DataFrame, model_name: str, threshold: float) -> pd.DataFrame:
+    """``model_scores`` rows for a frame of features, built column-wise."""
+    X = df.drop(columns=["label_fraud", "tx_id", "ts"])  # keep align with training
+    proba = pipe.predict_proba(X)[:, 1]
+    return pd.DataFrame({
+        "tx_id": df["tx_id"].to_numpy(),
+        "model_name": model_name,
+        "proba": proba,
+        "predicted_label": proba >= threshold,
+    })
+
 
+def predict_and_store(threshold: float | None = None, chunksize: int | None = None) -> int:
+    """Score the last day of ``model_features`` into ``model_scores``; return rows written.
 
-def predict_and_store(threshold: float | None = None) -> int:
+    Features stream through a server-side cursor in ``chunksize`` rows
+    (default: ``ml.predict_chunksize``), each chunk is scored and COPYed
+    before the next is read, so memory stays flat however large the day is.
+    All chunks are written in one transaction.
+    """
     cfg = get_settings()
     if threshold is None:
         threshold = float(cfg["app"]["alert_threshold"])
+    if chunksize is None:
+        chunksize = int(cfg["ml"].get("predict_chunksize", 100_000))
     model_path = _latest_model(cfg["ml"]["model_dir"])
     bundle = joblib.load(model_path)
     pipe = bundle["pipeline"]
+    model_name = os.path.basename(model_path)
 
     # Score last 1 day features
-    df = read_sql("SELECT * FROM model_features WHERE ts >= NOW() - INTERVAL '1 day'")
-    if df.empty:
+    q = "SELECT * FROM model_features WHERE ts >= NOW() - INTERVAL '1 day'"
+    n = 0
+    t0 = time.perf_counter()
+    eng = get_engine()
+    with eng.connect() as read_con, eng.begin() as write_con:
+        read_con = read_con.execution_options(stream_results=True)
+        for chunk in pd.read_sql(text(q), read_con, chunksize=chunksize):
+            copy_df(score_frame(pipe, chunk, model_name, threshold), "model_scores", con=write_con)
+            n += len(chunk)
+    if not n:
         logger.warning("No features to score in last day.")
         return 0
-    X = df.drop(columns=["label_fraud", "tx_id", "ts"])  # keep align with training
-    proba = pipe.predict_proba(X)[:, 1]
-    preds = (proba >= threshold)
-    rows = []
-    for tx_id, p, pred in zip(df["tx_id"].values, proba, preds):
-        rows.append({
-            "tx_id": tx_id,
-            "model_name": os.path.basename(model_path),
-            "proba": float(p),
-            "predicted_label": bool(pred),
-        })
-    write_df(pd.DataFrame(rows), "model_scores")
-    logger.info("Wrote %d model scores", len(rows))
-    return len(rows)
+    secs = time.perf_counter() - t0
+    logger.info("Wrote %d model scores in %.2fs (%.0f scores/s)", n, secs, n / secs)
+    return n
 
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, Tuple
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
 
 import pandas as pd
 from sklearn.model_selection import train_test_split
+from sqlalchemy import text
 
-from src.utils import get_logger, read_sql
+from src.utils import get_engine, get_logger, get_settings, read_sql
 
 
 logger = get_logger(__name__)
@@ -21,22 +23,128 @@ class Dataset:
     feature_cols: List[str]
 
 
-def load_feature_table() -> pd.DataFrame:
-    return read_sql("SELECT * FROM model_features")
+def load_feature_table(
+    columns: Optional[list[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    source: Optional[str] = None,
+) -> pd.DataFrame:
+    """Feature rows with ``start <= ts < end``, restricted to ``columns`` when given.
 
+    ``source`` (default ``ml.feature_source``) is ``db`` to query
+    ``model_features`` or ``snapshot`` to read the exported Parquet/Arrow files.
+    """
+    source = source or get_settings().get("ml", {}).get("feature_source", "db")
+    if source == "snapshot":
+        from src.features.snapshots import read_snapshots
+        return read_snapshots(columns=columns, start=start, end=end)
+    if source != "db":
+        raise ValueError(f"Unknown feature source: {source}")
+    sql, params = _feature_query(columns, start, end)
+    return read_sql(sql, params or None)
 
-def time_split(df: pd.DataFrame, target: str, val_days: int = 7) -> Dataset:
+
+def _feature_query(
+    columns: Optional[list[str]],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    fresh_labels: bool = False,
+) -> Tuple[str, dict]:
+    where, params = [], {}
+    if start is not None:
+        where.append("ts >= :start")
+        params["start"] = start
+    if end is not None:
+        where.append("ts < :end")
+        params["end"] = end
+    if fresh_labels and columns and "label_fraud" in columns:
+        # Labels applied by `label-fraud` after the features were built win
+        select = ", ".join("COALESCE(l.label, f.label_fraud) AS label_fraud" if c == "label_fraud" else f"f.{c}" for c in columns)
+        sql = f"SELECT {select} FROM model_features f LEFT JOIN labels l ON l.tx_id = f.tx_id"
+        where = [f"f.{w}" for w in where]
+    else:
+        sql = f"SELECT {', '.join(columns) if columns else '*'} FROM model_features"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+
+def iter_feature_table(
+    columns: Optional[list[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    source: Optional[str] = None,
+    chunksize: int = 100_000,
+) -> Iterator[pd.DataFrame]:
+    """``load_feature_table`` as frames of at most ``chunksize`` rows, for tables larger than memory.
+
+    Database rows come through a server-side cursor, and ``label_fraud``
+    takes newer labels from the ``labels`` table; snapshots keep the labels
+    they were exported with.
+    """
+    source = source or get_settings().get("ml", {}).get("feature_source", "db")
+    if source == "snapshot":
+        from src.features.snapshots import iter_snapshots
+        yield from iter_snapshots(columns=columns, start=start, end=end, batch_size=chunksize)
+        return
+    if source != "db":
+        raise ValueError(f"Unknown feature source: {source}")
+    sql, params = _feature_query(columns, start, end, fresh_labels=True)
+    yield from stream_sql(sql, params, chunksize)
+
+
+def stream_sql(sql: str, params: Optional[dict] = None, chunksize: int = 100_000) -> Iterator[pd.DataFrame]:
+    """Query results in non-empty frames of at most ``chunksize`` rows through a server-side cursor."""
+    with get_engine().connect() as con:
+        con = con.execution_options(stream_results=True)
+        for chunk in pd.read_sql(text(sql), con, params=params or None, chunksize=chunksize):
+            if len(chunk):
+                yield chunk
+
+
+def latest_feature_ts(source: Optional[str] = None) -> Optional[datetime]:
+    """Newest ``ts`` in the feature table (or its snapshots), without reading the rows."""
+    source = source or get_settings().get("ml", {}).get("feature_source", "db")
+    if source == "snapshot":
+        from src.features.snapshots import read_snapshots, snapshot_partitions
+        parts = snapshot_partitions()
+        if not parts:
+            return None
+        ts = read_snapshots(columns=["ts"], start=datetime.combine(parts[-1], datetime.min.time()))["ts"]
+        return ts.max() if len(ts) else None
+    return read_sql("SELECT max(ts) AS ts FROM model_features")["ts"].iloc[0]
+
+
+def time_split(df: pd.DataFrame, target: str, val_days: float = 7) -> Dataset:
     df = df.sort_values("ts")
     cutoff = df["ts"].max() - pd.Timedelta(days=val_days)
     train = df[df["ts"] <= cutoff]
     val = df[df["ts"] > cutoff]
-    y_train = train[target].astype(int).fillna(0)
-    y_val = val[target].astype(int).fillna(0)
+    y_train = train[target].fillna(False).astype(int)
+    y_val = val[target].fillna(False).astype(int)
     X_train = train.drop(columns=[target, "tx_id", "ts"])  # drop ids
     X_val = val.drop(columns=[target, "tx_id", "ts"])  # drop ids
     return Dataset(X_train, X_val, y_train, y_val, X_train.columns.tolist())
 
 
+def rolling_time_folds(df: pd.DataFrame, target: str, folds: int = 3, val_days: float = 7) -> List[Dataset]:
+    """``folds`` back-to-back ``time_split``s, oldest first.
+
+    Fold ``k`` validates on the ``val_days`` window ending ``folds - k - 1``
+    windows before the newest row and trains on everything before it, so
+    every fold mirrors what ``train`` would have done at that point in time.
+    Folds without training or validation rows are left out.
+    """
+    df = df.sort_values("ts")
+    newest = df["ts"].max()
+    out = []
+    for k in range(folds - 1, -1, -1):
+        ds = time_split(df[df["ts"] <= newest - pd.Timedelta(days=k * val_days)], target, val_days)
+        if len(ds.X_train) and len(ds.X_val):
+            out.append(ds)
+    return out
+
+
 def mixed_dtypes_to_numeric(df: pd.DataFrame, categorical: list[str]) -> pd.DataFrame:
     df = df.copy()
     for col in df.columns:
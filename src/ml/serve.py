@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src.utils import get_logger, get_settings
+from .compiled import CompiledEnsemble
+from .predict import _latest_model, model_time
+from .train import compiled_path_for
+
+
+logger = get_logger(__name__)
+
+
+class ModelUnavailable(RuntimeError):
+    """No model is loaded, so requests cannot be scored."""
+
+
+class ModelHolder:
+    """The newest bundle in ``model_dir``, swapped in whole when a newer one appears.
+
+    ``current`` is a single (name, pipeline) tuple replaced by one assignment,
+    so readers always see a complete model; a bundle that fails to load is
+    logged and the previous one is kept. At startup, when the newest bundle
+    does not load, older ones are tried in turn and ``ModelUnavailable`` is raised
+    if none does. With ``compiled``, a bundle's ``CompiledEnsemble`` twin is
+    served in place of its sklearn pipeline.
+    """
+
+    def __init__(self, model_dir: str, compiled: bool = False) -> None:
+        self.model_dir = model_dir
+        self.compiled = compiled
+        self._key: tuple[str, float] | None = None
+        self.current: tuple[str, Any] | None = None
+        if self.check():
+            return
+        older = sorted(glob.glob(os.path.join(model_dir, "*.joblib")), key=model_time, reverse=True)[1:]
+        if not any(self._load(path) for path in older):
+            raise ModelUnavailable(f"No loadable model in {model_dir}")
+
+    def _load(self, path: str) -> bool:
+        """Swap in the bundle at ``path``; return False (logged) if it does not load."""
+        try:
+            compiled_path = compiled_path_for(path)
+            if self.compiled and os.path.exists(compiled_path):
+                pipe = CompiledEnsemble.load(compiled_path)
+            else:
+                pipe = joblib.load(path)["pipeline"]
+        except Exception:
+            logger.exception("Could not load %s; keeping %s", path, self.current and self.current[0])
+            return False
+        self.current = (os.path.basename(path), pipe)
+        logger.info("Serving model %s (%s)", self.current[0], type(pipe).__name__)
+        return True
+
+    def check(self) -> bool:
+        """Load the latest artifact if it changed; return whether a new model was swapped in."""
+        path = _latest_model(self.model_dir)
+        key = (path, os.path.getmtime(path))
+        if key == self._key:
+            return False
+        # A bundle that failed to load is not retried until it changes
+        self._key = key
+        return self._load(path)
+
+    def watch(self, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self.check()
+            except FileNotFoundError:
+                pass
+
+
+class _Pending:
+    __slots__ = ("rows", "t0", "done", "model", "proba", "error")
+
+    def __init__(self, rows: list[dict]) -> None:
+        self.rows = rows
+        self.t0 = time.perf_counter()
+        self.done = threading.Event()
+        self.model: str | None = None
+        self.proba: np.ndarray | None = None
+        self.error: Exception | None = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests into one ``predict_proba`` call.
+
+    A batch closes when it holds ``max_batch`` rows or ``max_wait_ms`` after
+    its first request arrived, whichever comes first, and is scored with the
+    model current at that moment. Latency (queue wait + scoring) is kept for
+    the last ``window`` requests.
+    """
+
+    def __init__(self, holder: ModelHolder, max_batch: int = 256, max_wait_ms: float = 5.0, window: int = 10_000) -> None:
+        self.holder = holder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue[_Pending] = queue.Queue()
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.requests = self.rows = self.batches = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def submit(self, rows: list[dict], timeout: float = 30.0) -> tuple[str, np.ndarray]:
+        """Block until ``rows`` are scored; return the model name and fraud probabilities."""
+        p = _Pending(rows)
+        self._queue.put(p)
+        if not p.done.wait(timeout):
+            raise TimeoutError("scoring timed out")
+        if p.error is not None:
+            raise p.error
+        return p.model, p.proba
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch = [first]
+            try:
+                n = len(first.rows)
+                deadline = time.perf_counter() + self.max_wait
+                while n < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        p = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    batch.append(p)
+                    n += len(p.rows)
+                self._score(batch, n)
+            except Exception as e:
+                # Fail this batch's requests, never the thread every later request waits on
+                logger.exception("Scoring batch of %d requests failed", len(batch))
+                for p in batch:
+                    if not p.done.is_set():
+                        p.error = e
+                        p.done.set()
+
+    def _score(self, batch: list[_Pending], n: int) -> None:
+        current = self.holder.current
+        if current is None:
+            raise ModelUnavailable("no model loaded")
+        name, pipe = current
+        try:
+            X = pd.DataFrame.from_records([r for p in batch for r in p.rows])
+            proba = pipe.predict_proba(X)[:, 1]
+        except Exception as e:
+            if len(batch) > 1:
+                # Rescore one by one so a malformed request fails alone
+                for p in batch:
+                    self._score([p], len(p.rows))
+                return
+            batch[0].error = e
+            batch[0].done.set()
+            return
+        start = 0
+        now = time.perf_counter()
+        for p in batch:
+            p.model, p.proba = name, proba[start:start + len(p.rows)]
+            start += len(p.rows)
+            p.done.set()
+        with self._lock:
+            self._latencies.extend(now - p.t0 for p in batch)
+            self.requests += len(batch)
+            self.rows += n
+            self.batches += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lat = np.array(self._latencies)
+            requests, rows, batches = self.requests, self.rows, self.batches
+        elapsed = time.perf_counter() - self._started
+        p50, p99 = (np.percentile(lat, [50, 99]) * 1000).tolist() if len(lat) else (None, None)
+        return {
+            "model": self.holder.current and self.holder.current[0],
+            "requests": requests,
+            "rows": rows,
+            "batches": batches,
+            "mean_batch_rows": rows / batches if batches else None,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "requests_per_sec": requests / elapsed,
+            "rows_per_sec": rows / elapsed,
+        }
+
+
+def make_server(batcher: MicroBatcher, host: str, port: int, threshold: float) -> ThreadingHTTPServer:
+    """HTTP front end: ``POST /score`` with a feature row or ``{"rows": [...]}``, ``GET /stats``, ``GET /health``."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients don't pay a TCP handshake per request
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            current = batcher.holder.current
+            if self.path == "/stats":
+                self._send(200 if current else 503, batcher.stats())
+            elif self.path == "/health":
+                if current is None:
+                    self._send(503, {"status": "unavailable", "model": None})
+                else:
+                    self._send(200, {"status": "ok", "model": current[0]})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if self.path != "/score":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                rows = body["rows"] if isinstance(body, dict) and "rows" in body else [body]
+                if not isinstance(rows, list) or not rows or not all(isinstance(r, dict) for r in rows):
+                    raise ValueError("expected a feature row or {\"rows\": [...]} with at least one row object")
+                model, proba = batcher.submit(rows)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except (TimeoutError, ModelUnavailable) as e:
+                self._send(503, {"error": str(e)})
+                return
+            self._send(200, {
+                "model": model,
+                "scores": [{"proba": float(p), "predicted_label": bool(p >= threshold)} for p in proba],
+            })
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(
+    host: str | None = None,
+    port: int | None = None,
+    max_batch: int | None = None,
+    max_wait_ms: float | None = None,
+) -> None:
+    """Run the scoring service until interrupted; defaults come from ``ml.serve``."""
+    cfg = get_settings()
+    scfg = cfg["ml"].get("serve", {})
+    host = host or scfg.get("host", "127.0.0.1")
+    port = int(port if port is not None else scfg.get("port", 8765))
+    holder = ModelHolder(cfg["ml"]["model_dir"], compiled=bool(scfg.get("compiled", False)))
+    batcher = MicroBatcher(
+        holder,
+        max_batch=int(max_batch or scfg.get("max_batch", 256)),
+        max_wait_ms=float(max_wait_ms if max_wait_ms is not None else scfg.get("max_wait_ms", 5)),
+    )
+    stop = threading.Event()
+    threading.Thread(target=holder.watch, args=(float(scfg.get("reload_seconds", 5)), stop), daemon=True).start()
+    server = make_server(batcher, host, port, float(cfg["app"]["alert_threshold"]))
+    logger.info("Scoring service on http://%s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        batcher.close()
+        logger.info("Scoring service stopped: %s", batcher.stats())
@@ -2,73 +2,108 @@ from __future__ import annotations
 
 import json
 import os
+import time
 from datetime import datetime
-from typing import Tuple
+from typing import Any, Mapping, Tuple
 
 import joblib
 import numpy as np
 import pandas as pd
 from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.metrics import classification_report
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.preprocessing import StandardScaler
 
 from src.utils import get_logger
+from .encoders import make_encoder
 from .preprocessing import Dataset, load_feature_table, time_split
 
 
 logger = get_logger(__name__)
 
 
-def build_pipeline(numeric: list[str], categorical: list[str], algo: str = "rf") -> Pipeline:
+def build_pipeline(
+    numeric: list[str],
+    categorical: list[str],
+    algo: str = "rf",
+    encoders: Mapping[str, Mapping[str, Any]] | None = None,
+    params: Mapping[str, Any] | None = None,
+) -> Pipeline:
+    """Preprocessing + classifier; ``encoders`` maps categorical columns to
+    non-default encoders (``features.encoders`` in config/model.yaml) and
+    ``params`` overrides the classifier's hyperparameters (``model.<algo>``)."""
+    return Pipeline([("pre", build_preprocessing(numeric, categorical, encoders)), ("clf", build_classifier(algo, params))])
+
+
+def build_preprocessing(
+    numeric: list[str],
+    categorical: list[str],
+    encoders: Mapping[str, Mapping[str, Any]] | None = None,
+) -> ColumnTransformer:
+    encoders = encoders or {}
     transformers = []
     if numeric:
         transformers.append(("num", StandardScaler(with_mean=False), numeric))
-    if categorical:
-        transformers.append(("cat", OneHotEncoder(handle_unknown="ignore"), categorical))
-    pre = ColumnTransformer(transformers)
-
-    if algo == "lr":
-        clf = LogisticRegression(max_iter=200, class_weight="balanced")
-    elif algo == "rf":
-        clf = RandomForestClassifier(n_estimators=200, max_depth=8, min_samples_leaf=5, class_weight="balanced", n_jobs=-1)
-    elif algo == "xgb":
-        try:
-            import xgboost as xgb  # type: ignore
-        except Exception:
-            raise RuntimeError("XGBoost not installed. Install xgboost to use --algo xgb.")
-        clf = xgb.XGBClassifier(n_estimators=300, max_depth=6, learning_rate=0.1, subsample=0.8, colsample_bytree=0.8, n_jobs=-1, eval_metric="logloss")
-    else:
+    onehot = [c for c in categorical if encoders.get(c, {}).get("type", "onehot") == "onehot"]
+    if onehot:
+        transformers.append(("cat", make_encoder(None), onehot))
+    for col in categorical:
+        if col not in onehot:
+            transformers.append((f"{encoders[col]['type']}_{col}", make_encoder(encoders[col]), [col]))
+    return ColumnTransformer(transformers)
+
+
+# Used when config/model.yaml doesn't set a hyperparameter under model.<algo>
+DEFAULT_PARAMS: dict[str, dict[str, Any]] = {
+    "lr": {"max_iter": 200, "class_weight": "balanced"},
+    "rf": {"n_estimators": 200, "max_depth": 8, "min_samples_leaf": 5, "class_weight": "balanced", "n_jobs": -1},
+    # Logistic regression by SGD; also the incremental learner of src/ml/incremental.py
+    "sgd": {"loss": "log_loss", "alpha": 1e-5, "class_weight": "balanced", "random_state": 0},
+    "xgb": {"n_estimators": 300, "max_depth": 6, "learning_rate": 0.1, "subsample": 0.8, "colsample_bytree": 0.8, "n_jobs": -1, "eval_metric": "logloss"},
+}
+
+
+def build_classifier(algo: str, params: Mapping[str, Any] | None = None) -> Any:
+    """Unfitted classifier for ``algo``: ``DEFAULT_PARAMS`` overridden by ``params``."""
+    if algo not in DEFAULT_PARAMS:
         raise ValueError(f"Unknown algo: {algo}")
+    kwargs = {**DEFAULT_PARAMS[algo], **(params or {})}
+    if algo == "lr":
+        return LogisticRegression(**kwargs)
+    if algo == "rf":
+        return RandomForestClassifier(**kwargs)
+    if algo == "sgd":
+        return SGDClassifier(**kwargs)
+    try:
+        import xgboost as xgb  # type: ignore
+    except Exception:
+        raise RuntimeError("XGBoost not installed. Install xgboost to use --algo xgb.")
+    return xgb.XGBClassifier(**kwargs)
 
-    pipe = Pipeline([("pre", pre), ("clf", clf)])
-    return pipe
 
+def compiled_path_for(model_path: str) -> str:
+    """Where ``train`` puts the ``CompiledEnsemble`` of a model bundle."""
+    return os.path.splitext(model_path)[0] + ".npz"
 
-def train(algo: str = "rf", model_dir: str = "artifacts/models") -> tuple[str, str]:
+
+def train(algo: str = "rf", model_dir: str = "artifacts/models", source: str | None = None) -> tuple[str, str]:
     from src.utils import get_settings
     cfg = get_settings()
     model_cfg = cfg.get("ml", {})
     os.makedirs(model_dir, exist_ok=True)
 
-    df = load_feature_table()
-    if df.empty:
-        raise RuntimeError("No features to train on. Run `python -m src.cli features` first.")
-
     # Use config/model.yaml for feature list
-    model_yaml = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config", "model.yaml")
-    with open(model_yaml, "r", encoding="utf-8") as f:
-        spec = json.loads(json.dumps(__import__("yaml").safe_load(f)))
-    target = spec.get("target", "label_fraud")
-    numeric = spec["features"].get("numeric", [])
-    categorical = spec["features"].get("categorical", [])
+    spec = load_model_spec()
+    df, numeric, categorical, encoders, target = load_training_frame(spec, source)
 
     ds: Dataset = time_split(df, target=target, val_days=int(spec.get("split", {}).get("val_days", 7)))
 
-    pipe = build_pipeline(numeric, categorical, algo)
+    pipe = build_pipeline(numeric, categorical, algo, encoders, spec.get("model", {}).get(algo))
+    t0 = time.perf_counter()
     pipe.fit(ds.X_train, ds.y_train)
+    logger.info("Fit %s on %d rows in %.1fs", algo, len(ds.X_train), time.perf_counter() - t0)
     y_pred = pipe.predict(ds.X_val)
     y_proba = None
     try:
@@ -77,14 +112,57 @@ def train(algo: str = "rf", model_dir: str = "artifacts/models") -> tuple[str, s
         pass
     logger.info("Validation report:\n%s", classification_report(ds.y_val, y_pred))
 
+    bundle = {"pipeline": pipe, "numeric": numeric, "categorical": categorical, "encoders": encoders, "target": target}
+    return save_model(bundle, model_dir, spec.get("model", {}).get("algo", algo), compile_trees=algo in ("rf", "xgb") and model_cfg.get("compile_trees", True))
+
+
+def load_training_frame(spec: dict, source: str | None = None) -> tuple[pd.DataFrame, list[str], list[str], dict, str]:
+    """The model's feature rows and its numeric/categorical columns, encoders and target per ``spec``."""
+    target = spec.get("target", "label_fraud")
+    numeric = spec["features"].get("numeric", [])
+    categorical = spec["features"].get("categorical", [])
+    optional = spec["features"].get("optional", [])
+    encoders = spec["features"].get("encoders") or {}
+
+    df = load_feature_table(columns=["tx_id", "ts", target, *numeric, *categorical, *optional], source=source)
+    if df.empty:
+        raise RuntimeError("No features to train on. Run `python -m src.cli features` first.")
+    # Optional features only join the model when every row has them
+    used = [c for c in optional if c in df.columns and df[c].notna().all()]
+    df = df.drop(columns=[c for c in optional if c not in used and c in df.columns])
+    if used:
+        logger.info("Using optional features: %s", ", ".join(used))
+    return df, numeric + used, categorical, encoders, target
+
+
+def load_model_spec() -> dict:
+    """config/model.yaml as a plain dict."""
+    model_yaml = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config", "model.yaml")
+    with open(model_yaml, "r", encoding="utf-8") as f:
+        return json.loads(json.dumps(__import__("yaml").safe_load(f)))
+
+
+def save_model(bundle: dict, model_dir: str, prefix: str, compile_trees: bool = False) -> tuple[str, str]:
+    """Write ``bundle`` as ``<prefix>_<utc timestamp>.joblib`` plus feature_list.json; return both paths."""
     ts = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    model_name = f"{spec.get('model', {}).get('algo', algo)}_{ts}.joblib"
+    model_name = f"{prefix}_{ts}.joblib"
     model_path = os.path.join(model_dir, model_name)
-    joblib.dump({"pipeline": pipe, "numeric": numeric, "categorical": categorical, "target": target}, model_path)
+    if compile_trees:
+        # Flat-array twin for low-latency scoring, written before the bundle it belongs to
+        from .compiled import compile_pipeline
+        compiled_path = compiled_path_for(model_path)
+        try:
+            compile_pipeline(bundle["pipeline"]).save(compiled_path + ".tmp")
+            os.replace(compiled_path + ".tmp", compiled_path)
+        except ValueError as e:
+            logger.warning("Not compiling %s: %s", model_name, e)
+    # Write then rename so a running scoring service never loads a partial file
+    joblib.dump(bundle, model_path + ".tmp")
+    os.replace(model_path + ".tmp", model_path)
     feat_list_path = os.path.join(model_dir, "feature_list.json")
     with open(feat_list_path, "w", encoding="utf-8") as f:
-        json.dump({"numeric": numeric, "categorical": categorical}, f, indent=2)
-    logger.info("Saved model to %s", model_path)
+        json.dump({k: bundle[k] for k in ("numeric", "categorical", "encoders")}, f, indent=2)
+    logger.info("Saved model to %s (%.1f MB)", model_path, os.path.getsize(model_path) / 2**20)
     return model_path, feat_list_path
 
 
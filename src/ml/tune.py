@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import itertools
+import math
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import clone
+from sklearn.metrics import average_precision_score, roc_auc_score
+
+from src.utils import get_logger, get_settings
+from .preprocessing import rolling_time_folds
+from .train import build_classifier, build_preprocessing, load_model_spec, load_training_frame
+
+
+logger = get_logger(__name__)
+
+METRICS = ("pr_auc", "roc_auc")
+
+
+def candidates(base: Optional[dict], grid: Optional[dict]) -> list[dict]:
+    """Every combination of ``grid`` values (a scalar is a single value) on top of ``base``."""
+    grid = grid or {}
+    keys = sorted(grid)
+    values = [v if isinstance(v, list) else [v] for v in (grid[k] for k in keys)]
+    return [{**(base or {}), **dict(zip(keys, combo))} for combo in itertools.product(*values)]
+
+
+def _flat(X: Any) -> dict:
+    """``X`` as plain ndarrays, so ``joblib.load(mmap_mode="r")`` maps every part.
+
+    joblib only memory-maps ndarrays; a scipy sparse matrix would be unpickled
+    into a private copy in each worker, so its CSR arrays are stored instead.
+    """
+    if sp.issparse(X):
+        X = sp.csr_matrix(X)
+        # Sorted up front: estimators may otherwise sort the read-only mapped indices in place
+        X.sort_indices()
+        return {"data": X.data, "indices": X.indices, "indptr": X.indptr, "shape": np.asarray(X.shape)}
+    return {"dense": np.asarray(X)}
+
+
+def _unflat(parts: dict) -> Any:
+    """Inverse of ``_flat``; the CSR matrix wraps the mapped arrays without copying."""
+    if "dense" in parts:
+        return parts["dense"]
+    return sp.csr_matrix((parts["data"], parts["indices"], parts["indptr"]), shape=tuple(parts["shape"]), copy=False)
+
+
+def _cache_fold(pre: Any, ds: Any, path: str) -> str:
+    """Fit ``pre`` on the fold's training rows and store both encoded matrices for the candidates."""
+    t0 = time.perf_counter()
+    pre = clone(pre)
+    X_train = pre.fit_transform(ds.X_train, ds.y_train)
+    X_val = pre.transform(ds.X_val)
+    joblib.dump({
+        "X_train": _flat(X_train), "y_train": ds.y_train.to_numpy(),
+        "X_val": _flat(X_val), "y_val": ds.y_val.to_numpy(),
+    }, path)
+    logger.info("Encoded fold %s: %d train / %d val rows, %d columns in %.1fs",
+                os.path.basename(path), X_train.shape[0], X_val.shape[0], X_train.shape[1], time.perf_counter() - t0)
+    return path
+
+
+def _evaluate(algo: str, params: dict, fold_path: str, n_jobs: Optional[int]) -> dict:
+    """Fit one candidate on a cached fold; runs in a worker process."""
+    data = joblib.load(fold_path, mmap_mode="r")
+    y_val = np.asarray(data["y_val"])
+    out: dict[str, Any] = {"fit_seconds": math.nan, "score_seconds": math.nan, **{m: math.nan for m in METRICS}}
+    try:
+        clf = build_classifier(algo, params)
+        if n_jobs is not None and "n_jobs" in clf.get_params():
+            clf.set_params(n_jobs=n_jobs)
+        t0 = time.perf_counter()
+        clf.fit(_unflat(data["X_train"]), np.asarray(data["y_train"]))
+        out["fit_seconds"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        proba = clf.predict_proba(_unflat(data["X_val"]))[:, 1]
+        out["score_seconds"] = time.perf_counter() - t0
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+        return out
+    if 0 < y_val.sum() < len(y_val):
+        out["pr_auc"] = float(average_precision_score(y_val, proba))
+        out["roc_auc"] = float(roc_auc_score(y_val, proba))
+    return out
+
+
+def search(
+    df: pd.DataFrame,
+    target: str,
+    numeric: list[str],
+    categorical: list[str],
+    encoders: Optional[dict],
+    cands: list[tuple[str, dict]],
+    folds: int = 3,
+    val_days: float = 7,
+    metric: str = "pr_auc",
+    workers: int = 1,
+    halving: float = 2,
+    cache_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Rank ``(algo, params)`` candidates over rolling time folds; return the leaderboard.
+
+    Preprocessing is fitted once per fold and cached on disk, memory-mapped by
+    every candidate. Folds run oldest (least data, cheapest) first; after
+    each one only the best ``1 / halving`` of candidates by mean ``metric``
+    so far go on (successive halving; ``halving <= 1`` runs every candidate
+    on every fold). Candidates run in a process pool of ``workers``.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}; expected one of {', '.join(METRICS)}")
+    datasets = rolling_time_folds(df, target, folds, val_days)
+    usable = [ds for ds in datasets if ds.y_train.nunique() == 2]
+    if len(usable) < len(datasets):
+        logger.warning("Skipping %d fold(s) without both classes in training", len(datasets) - len(usable))
+    if not usable:
+        raise RuntimeError(f"Not enough labelled history for {folds} folds of {val_days} days")
+    datasets = usable
+    pre = build_preprocessing(numeric, categorical, encoders)
+    results: list[list[dict]] = [[] for _ in cands]
+    alive = list(range(len(cands)))
+    # Several candidates per core would oversubscribe with n_jobs=-1 estimators
+    n_jobs = 1 if workers > 1 else None
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) if workers > 1 else None
+        try:
+            for f, ds in enumerate(datasets):
+                path = _cache_fold(pre, ds, os.path.join(tmp, f"fold{f}.joblib"))
+                if pool is not None:
+                    futures = {i: pool.submit(_evaluate, *cands[i], path, n_jobs) for i in alive}
+                    scores = {i: fut.result() for i, fut in futures.items()}
+                else:
+                    scores = {i: _evaluate(*cands[i], path, n_jobs) for i in alive}
+                for i, score in scores.items():
+                    results[i].append(score)
+                if f < len(datasets) - 1 and halving > 1:
+                    keep = max(1, math.ceil(len(alive) / halving))
+                    ranked = sorted(alive, key=lambda i: np.nan_to_num(_mean(results[i], metric), nan=-np.inf), reverse=True)
+                    alive = ranked[:keep]
+                logger.info("Fold %d/%d: %d candidates scored, %d continue", f + 1, len(datasets), len(scores), len(alive))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    rows = []
+    for (algo, params), res in zip(cands, results):
+        errors = [r["error"] for r in res if "error" in r]
+        rows.append({
+            "algo": algo,
+            "params": params,
+            "folds": len(res),
+            metric: _mean(res, metric),
+            **{f"{metric}_fold{k + 1}": r[metric] for k, r in enumerate(res)},
+            **{m: _mean(res, m) for m in METRICS if m != metric},
+            "fit_seconds": float(np.nansum([r["fit_seconds"] for r in res])),
+            "score_seconds": float(np.nansum([r["score_seconds"] for r in res])),
+            "error": errors[0] if errors else None,
+        })
+    board = pd.DataFrame(rows)
+    # Survivors of more folds rank first, then by the metric
+    board = board.sort_values(["folds", metric], ascending=False, na_position="last", kind="stable").reset_index(drop=True)
+    board.insert(0, "rank", np.arange(1, len(board) + 1))
+    return board
+
+
+def _mean(res: list[dict], metric: str) -> float:
+    values = [r[metric] for r in res if not math.isnan(r[metric])]
+    return float(np.mean(values)) if values else math.nan
+
+
+def tune(
+    algos: Optional[list[str]] = None,
+    source: Optional[str] = None,
+    workers: Optional[int] = None,
+    folds: Optional[int] = None,
+    out_dir: Optional[str] = None,
+) -> str:
+    """Search the ``tuning.grid`` of each algo in config/model.yaml; write and return the leaderboard CSV."""
+    spec = load_model_spec()
+    tcfg = spec.get("tuning", {})
+    algos = algos or [spec.get("model", {}).get("algo", "rf")]
+    grids = tcfg.get("grid", {})
+    cands = [(algo, params) for algo in algos for params in candidates(spec.get("model", {}).get(algo), grids.get(algo))]
+    df, numeric, categorical, encoders, target = load_training_frame(spec, source)
+    out_dir = out_dir or get_settings().get("ml", {}).get("metrics_dir", "artifacts/metrics")
+    os.makedirs(out_dir, exist_ok=True)
+    metric = tcfg.get("metric", "pr_auc")
+    logger.info("Tuning %d candidates (%s) on %d rows", len(cands), ", ".join(algos), len(df))
+    board = search(
+        df, target, numeric, categorical, encoders, cands,
+        folds=int(folds or tcfg.get("folds", 3)),
+        val_days=float(tcfg.get("val_days", spec.get("split", {}).get("val_days", 7))),
+        metric=metric,
+        workers=int(workers or tcfg.get("workers", 1)),
+        halving=float(tcfg.get("halving", 2)),
+        cache_dir=out_dir,
+    )
+    path = os.path.join(out_dir, f"tuning_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.csv")
+    board.to_csv(path, index=False)
+    top = board.head(5)[["rank", "algo", "params", "folds", metric, "fit_seconds", "score_seconds"]]
+    logger.info("Leaderboard written to %s\n%s", path, top.to_string(index=False))
+    return path
@@ -2,17 +2,34 @@ from __future__ import annotations
 
 import json
 import os
+import tracemalloc
+from datetime import datetime, timedelta
 from typing import Callable, Dict
 
+import numpy as np
 import pandas as pd
 import yaml
 
-from src.utils import get_logger, read_sql, write_df
+from sqlalchemy import text
+
+from src.utils import copy_df, get_engine, get_logger, get_settings, get_watermark, merge_df, read_sql, set_watermark
+from src.utils.cards import CardContext
 from . import predicates as P
+from .instrument import measure_rule, stats_frame
 
 
 logger = get_logger(__name__)
 
+WATERMARK_JOB = "rulescore"
+
+_TX_COLUMNS = """
+    t.tx_id, t.card_id, t.merchant_id, t.ts, t.amount::float AS amount, t.lat, t.lon, t.channel,
+    m.mcc, m.risk_tier
+"""
+
+# All that per-card (stateful) rules look at; no merchants join needed
+_CARD_COLUMNS = "t.tx_id, t.card_id, t.ts, t.lat, t.lon"
+
 
 def load_rules() -> list[dict]:
     cfg_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config", "rules.yaml")
@@ -27,54 +44,302 @@ def _get_predicate(name: str) -> Callable[..., pd.Series]:
     return getattr(P, name)
 
 
-def score_rules(limit_days: int | None = 2) -> int:
+def rule_lookback(rules: list[dict]) -> timedelta:
+    """Per-card history the active rules need before the first new transaction.
+
+    ``rapid_fire`` looks back ``window_minutes``; ``geo_velocity`` only needs the
+    previous transaction, which the incremental read always includes.
+    """
+    lookback = timedelta(0)
+    for rule in rules:
+        if rule["name"] == "rapid_fire":
+            minutes = int(rule.get("params", {}).get("window_minutes", 0))
+            lookback = max(lookback, timedelta(minutes=minutes))
+    return lookback
+
+
+def _window_sql(
+    watermark: datetime | None, high: datetime | None, limit_days: int | None, clock: str = "ts"
+) -> tuple[str, dict]:
+    """WHERE clause selecting the transactions a run alerts on.
+
+    ``watermark`` and ``high`` bound ``clock``: event time for window runs,
+    ``ingested_at`` for incremental ones. ``limit_days`` always counts in event time.
+    """
+    clauses, params = [], {}
+    if watermark is not None:
+        clauses.append(f"t.{clock} > :wm")
+        params["wm"] = watermark
+    elif limit_days is not None:
+        clauses.append("t.ts >= NOW() - make_interval(days => :days)")
+        params["days"] = int(limit_days)
+    if high is not None:
+        clauses.append(f"t.{clock} <= :high")
+        params["high"] = high
+    return " AND ".join(clauses) or "TRUE", params
+
+
+def _merchants_join(columns: str) -> str:
+    return "JOIN merchants m ON m.merchant_id = t.merchant_id" if "m." in columns else ""
+
+
+def _read_window(
+    limit_days: int | None, high: datetime | None = None, columns: str = _TX_COLUMNS, clock: str = "ts"
+) -> pd.DataFrame:
+    where, params = _window_sql(None, high, limit_days, clock)
+    return read_sql(f"SELECT {columns} FROM transactions t {_merchants_join(columns)} WHERE {where}", params)
+
+
+def _read_incremental(watermark: datetime, high: datetime, lookback: timedelta, columns: str = _TX_COLUMNS) -> pd.DataFrame:
+    """Transactions loaded in (``watermark``, ``high``] plus the per-card history stateful rules need.
+
+    Both bounds are on ``ingested_at``, so back-dated rows loaded late (e.g.
+    by a backfill) are picked up. For each card with such rows this returns
+    every transaction after ``pending_from - lookback``, ``pending_from``
+    being the earliest event time among them, and the single latest one at or
+    before that point, so consecutive-pair rules see the true previous row.
+    Rows from ``pending_from`` on are alerted on again since an earlier row
+    changes their windows; the column comes back with every row.
+    """
+    q = f"""
+        WITH pending AS (
+            SELECT card_id, MIN(ts) AS pending_from FROM transactions
+            WHERE ingested_at > :wm AND ingested_at <= :high
+            GROUP BY card_id
+        )
+        SELECT {columns}, p.pending_from
+        FROM pending p
+        JOIN transactions t ON t.card_id = p.card_id
+        {_merchants_join(columns)}
+        WHERE t.ts > p.pending_from - :lookback AND t.ingested_at <= :high
+        UNION ALL
+        SELECT {columns}, p.pending_from
+        FROM pending p
+        CROSS JOIN LATERAL (
+            SELECT * FROM transactions t2
+            WHERE t2.card_id = p.card_id AND t2.ts <= p.pending_from - :lookback AND t2.ingested_at <= :high
+            ORDER BY t2.ts DESC LIMIT 1
+        ) t
+        {_merchants_join(columns)}
+    """
+    return read_sql(q, {"wm": watermark, "high": high, "lookback": lookback})
+
+
+def _run_high(watermark: datetime | None, limit_days: int | None, clock: str = "ts") -> datetime | None:
+    """Newest ``clock`` value in this run's window; pins its upper bound and next watermark."""
+    where, params = _window_sql(watermark, None, limit_days, clock)
+    high = read_sql(f"SELECT MAX(t.{clock}) AS high FROM transactions t WHERE {where}", params)["high"].iloc[0]
+    return None if pd.isna(high) else pd.Timestamp(high).to_pydatetime()
+
+
+def rule_flags(df: pd.DataFrame, rules: list[dict], stats: list[dict] | None = None) -> np.ndarray:
+    """Evaluate ``rules`` over ``df`` into a (rules x rows) boolean matrix.
+
+    Per-card predicates share one ``CardContext`` built on first use; its cost
+    is charged to that first rule. Pass ``stats`` to collect a timing record
+    per rule (see ``measure_rule``).
+    """
+    flags = np.zeros((len(rules), len(df)), dtype=bool)
+    ctx = None
+    for i, rule in enumerate(rules):
+        name = rule["name"]
+        params = dict(rule.get("params", {}))
+        pred = _get_predicate(name)
+        with measure_rule(stats, rule, len(df)) as rec:
+            if getattr(pred, "per_card", False):
+                ctx = ctx or CardContext.build(df)
+                params["ctx"] = ctx
+            try:
+                mask = pred(df, **params)
+            except TypeError as e:
+                raise RuntimeError(f"Invalid params for rule {name}: {e}")
+            flags[i] = mask.reindex(df.index, fill_value=False).to_numpy(dtype=bool)
+            rec["rows_flagged"] = int(flags[i].sum())
+    return flags
+
+
+def alerts_frame(tx_ids: np.ndarray, rules: list[dict], rule_idx: np.ndarray, row_idx: np.ndarray) -> pd.DataFrame:
+    """Columnar alerts for flagged (rule, row) pairs, logging per-rule totals."""
+    names = np.asarray([r["name"] for r in rules], dtype=object)
+    counts = np.bincount(rule_idx, minlength=len(rules))
+    for name, cnt in zip(names, counts):
+        logger.info("Rule %s flagged %d", name, cnt)
+    return pd.DataFrame({
+        "tx_id": tx_ids[row_idx],
+        "rule_name": names[rule_idx],
+        "score": np.ones(len(row_idx)),
+    })
+
+
+def evaluate_rules(
+    df: pd.DataFrame,
+    rules: list[dict],
+    is_new: np.ndarray | None = None,
+    stats: list[dict] | None = None,
+) -> pd.DataFrame:
+    """Run ``rules`` over ``df`` and return alerts as one columnar frame.
+
+    Masks from all rules are stacked into a (rules x rows) matrix so flagged
+    pairs are extracted with a single ``nonzero`` instead of a per-row loop.
+    ``is_new`` restricts alerts to a subset of rows (e.g. after a watermark).
+    """
+    flags = rule_flags(df, rules, stats)
+    if is_new is not None:
+        flags &= is_new
+    rule_idx, row_idx = np.nonzero(flags)
+    logger.info("Scored %d rows", len(df) if is_new is None else int(is_new.sum()))
+    return alerts_frame(df["tx_id"].to_numpy(), rules, rule_idx, row_idx)
+
+
+def _start_run(incremental: bool, watermark: datetime | None, high: datetime, limit_days: int | None):
+    """Open a ledger row for this run's window; it stays RUNNING until committed."""
+    with get_engine().begin() as con:
+        return con.execute(text("""
+            INSERT INTO rule_score_runs (mode, window_start, window_end)
+            VALUES (:mode, COALESCE(CAST(:wm AS TIMESTAMP), NOW() - make_interval(days => :days)), :high)
+            RETURNING run_id
+        """), {
+            "mode": "incremental" if incremental else "window",
+            "wm": watermark,
+            "days": limit_days,
+            "high": high,
+        }).scalar_one()
+
+
+def _finish_run(con, run_id, status: str, alerts_generated: int | None = None, alerts_inserted: int | None = None, error: str | None = None) -> None:
+    con.execute(text("""
+        UPDATE rule_score_runs
+        SET status = :status, alerts_generated = :generated, alerts_inserted = :inserted,
+            error = :error, finished_at = NOW()
+        WHERE run_id = :run_id
+    """), {"status": status, "generated": alerts_generated, "inserted": alerts_inserted, "error": error, "run_id": run_id})
+
+
+def _evaluate_local(df: pd.DataFrame, rules: list[dict], is_new: np.ndarray, workers: int, stats: list[dict]) -> pd.DataFrame:
+    if workers > 1:
+        from .parallel import evaluate_rules_parallel
+        return evaluate_rules_parallel(df, rules, workers, is_new=is_new, stats=stats)
+    return evaluate_rules(df, rules, is_new=is_new, stats=stats)
+
+
+def _evaluate_pushdown(rules: list[dict], window_sql: str, window_params: dict, stats: list[dict]) -> pd.DataFrame:
+    from .sql import pushdown_flags
+    # One scan evaluates every pushed rule, so each record carries the whole query's time
+    pushed: list[dict] = []
+    with measure_rule(pushed, {"name": "pushdown"}, None, engine="sql") as scan:
+        res = pushdown_flags(rules, window_sql, window_params)
+    flags = res[[f"r{i}" for i in range(len(rules))]].to_numpy(dtype=bool).T
+    for rule, mask in zip(rules, flags):
+        stats.append({
+            **scan, "rule_name": rule["name"], "params": rule.get("params", {}),
+            "rows_flagged": int(mask.sum()), "cpu_ms": None,
+        })
+    rule_idx, row_idx = np.nonzero(flags)
+    return alerts_frame(res["tx_id"].to_numpy(), rules, rule_idx, row_idx)
+
+
+def score_rules(
+    limit_days: int | None = 2,
+    incremental: bool = False,
+    workers: int | None = None,
+    pushdown: bool | None = None,
+) -> int:
+    """Evaluate active rules and merge alerts idempotently; return alerts inserted.
+
+    Each run is recorded in ``rule_score_runs`` with the window it covered.
+    Alerts are merged on (tx_id, rule_name), so re-running a window is safe.
+    With ``incremental=True`` only transactions loaded after the persisted
+    ``ingested_at`` watermark are alerted on, whatever their event time, along
+    with later rows of the same cards; the first incremental run falls back to
+    the ``limit_days`` window to establish the watermark. ``workers`` > 1 scores
+    card-partitioned shards in a process pool (default: ``rules.workers``).
+    ``pushdown`` evaluates stateless rules as SQL inside Postgres so only the
+    stateful ones pull per-card history into pandas (default: ``rules.pushdown``).
+    Per-rule timings land in ``rule_runs`` under the same ``run_id``.
+    """
     rules = [r for r in load_rules() if r.get("active", True)]
     if not rules:
         logger.warning("No active rules found.")
         return 0
+    rules_cfg = get_settings().get("rules", {})
+    if workers is None:
+        workers = int(rules_cfg.get("workers", 1))
+    if pushdown is None:
+        pushdown = bool(rules_cfg.get("pushdown", False))
 
-    q = """
-        SELECT t.tx_id, t.card_id, t.merchant_id, t.ts, t.amount::float, t.lat, t.lon, t.channel,
-               m.mcc, m.risk_tier
-        FROM transactions t
-        JOIN merchants m ON m.merchant_id = t.merchant_id
-        WHERE t.ts >= NOW() - INTERVAL ':days days'
-    """
-    if limit_days is None:
-        df = read_sql("""
-            SELECT t.tx_id, t.card_id, t.merchant_id, t.ts, t.amount::float, t.lat, t.lon, t.channel,
-                   m.mcc, m.risk_tier
-            FROM transactions t
-            JOIN merchants m ON m.merchant_id = t.merchant_id
-        """)
-    else:
-        df = read_sql(q, {"days": int(limit_days)})
-    if df.empty:
+    watermark = get_watermark(WATERMARK_JOB) if incremental else None
+    clock = "ingested_at" if incremental else "ts"
+    high = _run_high(watermark, limit_days, clock)
+    if high is None:
         logger.warning("No transactions to score.")
         return 0
-    df["ts"] = pd.to_datetime(df["ts"])  # ensure datetime
+    run_id = _start_run(incremental, watermark, high, limit_days)
+    stats: list[dict] = []
+    trace = bool(rules_cfg.get("trace_memory", False)) and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    try:
+        alerts = _score_window(rules, watermark, high, limit_days, clock, workers, pushdown, stats)
+        # Alerts, watermark and ledger commit together, so a retried run is a no-op
+        with get_engine().begin() as con:
+            inserted = merge_df(alerts, "alerts", ["tx_id", "rule_name"], con=con) if not alerts.empty else 0
+            if incremental:
+                set_watermark(WATERMARK_JOB, high, con=con)
+            if stats:
+                copy_df(stats_frame(stats, run_id), "rule_runs", con=con)
+            _finish_run(con, run_id, "SUCCEEDED", len(alerts), inserted)
+    except Exception as e:
+        with get_engine().begin() as con:
+            _finish_run(con, run_id, "FAILED", error=repr(e))
+        raise
+    finally:
+        if trace:
+            tracemalloc.stop()
+    for rec in stats:
+        logger.info("Rule %s (%s): %.1f ms wall, %s rows flagged", rec["rule_name"], rec["engine"], rec["wall_ms"], rec["rows_flagged"])
+    if len(alerts) > inserted:
+        logger.info("Skipped %d alerts already present", len(alerts) - inserted)
+    return inserted
 
-    alerts_to_write = []
-    for rule in rules:
-        name = rule["name"]
-        params = rule.get("params", {})
-        pred = _get_predicate(name)
-        try:
-            mask = pred(df, **params)
-        except TypeError as e:
-            raise RuntimeError(f"Invalid params for rule {name}: {e}")
-        flagged = df[mask]
-        logger.info("Rule %s flagged %d / %d", name, len(flagged), len(df))
-        for _, row in flagged.iterrows():
-            alerts_to_write.append({
-                "tx_id": row["tx_id"],
-                "rule_name": name,
-                "score": 1.0,
-            })
-
-    if not alerts_to_write:
-        logger.info("No alerts generated.")
-        return 0
-    write_df(pd.DataFrame(alerts_to_write), "alerts")
-    return len(alerts_to_write)
 
+def _score_window(
+    rules: list[dict],
+    watermark: datetime | None,
+    high: datetime,
+    limit_days: int | None,
+    clock: str,
+    workers: int,
+    pushdown: bool,
+    stats: list[dict],
+) -> pd.DataFrame:
+    if pushdown:
+        from .sql import can_push_down
+        pushed = [r for r in rules if can_push_down(r)]
+    else:
+        pushed = []
+    local = [r for r in rules if r not in pushed]
+
+    parts = []
+    if local:
+        per_card_only = all(getattr(_get_predicate(r["name"]), "per_card", False) for r in local)
+        columns = _CARD_COLUMNS if per_card_only else _TX_COLUMNS
+        if watermark is not None:
+            df = _read_incremental(watermark, high, rule_lookback(local), columns)
+        else:
+            df = _read_window(limit_days, high, columns, clock)
+        if not df.empty:
+            df["ts"] = pd.to_datetime(df["ts"])  # ensure datetime
+            if watermark is not None:
+                is_new = (df["ts"] >= pd.to_datetime(df.pop("pending_from"))).to_numpy()
+                logger.info("Scoring %d transactions on cards with rows loaded since %s (%d with lookback)",
+                            int(is_new.sum()), watermark, len(df))
+            else:
+                is_new = np.ones(len(df), dtype=bool)
+            parts.append(_evaluate_local(df, local, is_new, workers, stats))
+    if pushed:
+        parts.append(_evaluate_pushdown(pushed, *_window_sql(watermark, high, limit_days, clock), stats))
+
+    alerts = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["tx_id", "rule_name", "score"])
+    # Keep alerts in rules.yaml order regardless of where each rule ran
+    rank = {r["name"]: i for i, r in enumerate(rules)}
+    return alerts.iloc[np.argsort(alerts["rule_name"].map(rank).to_numpy(), kind="stable")].reset_index(drop=True)
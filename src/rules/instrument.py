@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+
+
+# Columns of the ``rule_runs`` table filled from a run's stats records
+STATS_COLUMNS = [
+    "rule_name", "engine", "params", "rows_in", "rows_flagged",
+    "wall_ms", "cpu_ms", "peak_mem_bytes", "workers",
+]
+
+
+@contextmanager
+def measure_rule(stats: list[dict] | None, rule: dict, rows_in: int | None, engine: str = "pandas") -> Iterator[dict]:
+    """Time one rule evaluation and append its record to ``stats``.
+
+    The caller fills ``rows_flagged`` on the yielded record. Peak memory is
+    only measured while ``tracemalloc`` is tracing (see ``rules.trace_memory``)
+    and is the peak traced allocation above what was live on entry.
+    """
+    rec = {
+        "rule_name": rule["name"],
+        "engine": engine,
+        "params": rule.get("params", {}),
+        "rows_in": rows_in,
+        "rows_flagged": None,
+        "peak_mem_bytes": None,
+        "workers": 1,
+    }
+    if stats is None:
+        yield rec
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    w0, c0 = time.perf_counter(), time.process_time()
+    yield rec
+    rec["wall_ms"] = (time.perf_counter() - w0) * 1e3
+    rec["cpu_ms"] = (time.process_time() - c0) * 1e3
+    if tracing:
+        rec["peak_mem_bytes"] = max(tracemalloc.get_traced_memory()[1] - base, 0)
+    stats.append(rec)
+
+
+def merge_worker_stats(shard_stats: list[list[dict]], workers: int) -> list[dict]:
+    """Fold per-shard records into one per rule.
+
+    Rows, wall and CPU time add up across shards (wall is summed worker time,
+    not elapsed time); peak memory is the largest single shard's.
+    """
+    merged: dict[str, dict] = {}
+    for stats in shard_stats:
+        for rec in stats:
+            cur = merged.get(rec["rule_name"])
+            if cur is None:
+                merged[rec["rule_name"]] = {**rec, "workers": workers}
+                continue
+            for key in ("rows_in", "rows_flagged", "wall_ms", "cpu_ms"):
+                cur[key] += rec[key]
+            if rec["peak_mem_bytes"] is not None:
+                cur["peak_mem_bytes"] = max(cur["peak_mem_bytes"] or 0, rec["peak_mem_bytes"])
+    return list(merged.values())
+
+
+def stats_frame(stats: list[dict], run_id) -> pd.DataFrame:
+    """Records shaped for a COPY into ``rule_runs``."""
+    df = pd.DataFrame(stats, columns=STATS_COLUMNS)
+    df["params"] = df["params"].map(json.dumps)
+    for col in ("rows_in", "rows_flagged", "peak_mem_bytes"):
+        df[col] = df[col].astype("Int64")
+    df.insert(0, "run_id", str(run_id))
+    return df
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from src.utils import get_logger
+from .engine import alerts_frame, rule_flags
+from .instrument import merge_worker_stats
+
+
+logger = get_logger(__name__)
+
+# High-cardinality ids only serve as group keys, so workers get codes, not values
+_KEY_COLUMNS = ("card_id", "merchant_id")
+
+# Shards per worker; more, smaller shards even out skewed card distributions
+_SHARDS_PER_WORKER = 4
+
+# Per-process views onto the parent's shared blocks, set by _attach
+_shared: dict = {}
+
+
+def _share(arr: np.ndarray, blocks: list[SharedMemory]) -> tuple[str, tuple, str]:
+    arr = np.ascontiguousarray(arr)
+    shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+    blocks.append(shm)
+    return shm.name, arr.shape, arr.dtype.str
+
+
+def _export(df: pd.DataFrame, shard: np.ndarray, n_shards: int, blocks: list[SharedMemory]) -> dict:
+    """Copy the columns rules need into shared memory; return a picklable spec.
+
+    Rows are grouped by shard once here: ``order`` lists row positions shard
+    by shard (ascending within each) and shard ``i`` owns
+    ``order[offsets[i]:offsets[i + 1]]``, so no worker scans every row.
+    """
+    order = np.argsort(shard, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(shard, minlength=n_shards))])
+    spec = {"order": _share(order, blocks), "offsets": offsets.tolist(), "columns": {}}
+    for col in df.columns:
+        if col == "tx_id":
+            continue
+        s = df[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            spec["columns"][col] = ("datetime", _share(s.to_numpy(dtype="datetime64[ns]").view(np.int64), blocks), None)
+        elif pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+            spec["columns"][col] = ("numeric", _share(s.to_numpy(), blocks), None)
+        else:
+            codes, uniques = pd.factorize(s)
+            cats = None if col in _KEY_COLUMNS else list(uniques)
+            spec["columns"][col] = ("codes", _share(codes.astype(np.int32), blocks), cats)
+    return spec
+
+
+def _attach(spec: dict) -> None:
+    blocks = []
+
+    def view(ref):
+        name, shape, dtype = ref
+        shm = SharedMemory(name=name)
+        blocks.append(shm)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    _shared["blocks"] = blocks
+    _shared["order"] = view(spec["order"])
+    _shared["offsets"] = spec["offsets"]
+    _shared["columns"] = {col: (kind, view(ref), cats) for col, (kind, ref, cats) in spec["columns"].items()}
+
+
+def _score_shard(shard_id: int, rules: list[dict], trace_memory: bool) -> tuple[np.ndarray, np.ndarray, list[dict]]:
+    """Evaluate all rules on one shard; return (rule_idx, global row positions, stats)."""
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    offsets = _shared["offsets"]
+    rows = _shared["order"][offsets[shard_id]:offsets[shard_id + 1]]
+    data = {}
+    for col, (kind, arr, cats) in _shared["columns"].items():
+        part = arr[rows]
+        if kind == "datetime":
+            data[col] = part.view("datetime64[ns]")
+        elif kind == "codes" and cats is not None:
+            data[col] = pd.Categorical.from_codes(part, categories=cats)
+        else:
+            data[col] = part
+    stats: list[dict] = []
+    flags = rule_flags(pd.DataFrame(data), rules, stats)
+    rule_idx, local_idx = np.nonzero(flags)
+    return rule_idx, rows[local_idx], stats
+
+
+def evaluate_rules_parallel(
+    df: pd.DataFrame,
+    rules: list[dict],
+    workers: int,
+    is_new: np.ndarray | None = None,
+    stats: list[dict] | None = None,
+) -> pd.DataFrame:
+    """Same alerts as ``evaluate_rules``, computed on ``workers`` processes.
+
+    Rows are hash-partitioned by ``card_id`` so every card's history lands in
+    one shard; per-card and row-wise rules are therefore shard-local. Columns
+    travel to workers once through shared memory, and only flagged positions
+    come back. Per-shard rule timings are summed into ``stats`` when given.
+    """
+    n_shards = workers * _SHARDS_PER_WORKER
+    shard = (pd.util.hash_array(df["card_id"].to_numpy()) % np.uint64(n_shards)).astype(np.int32)
+    blocks: list[SharedMemory] = []
+    try:
+        spec = _export(df, shard, n_shards, blocks)
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_attach, initargs=(spec,)) as pool:
+            trace = [tracemalloc.is_tracing()] * n_shards
+            results = list(pool.map(_score_shard, range(n_shards), [rules] * n_shards, trace))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    rule_idx = np.concatenate([r for r, _, _ in results]) if results else np.array([], dtype=np.int64)
+    row_idx = np.concatenate([p for _, p, _ in results]) if results else np.array([], dtype=np.int64)
+    if stats is not None:
+        stats.extend(merge_worker_stats([s for _, _, s in results], workers))
+    if is_new is not None:
+        keep = is_new[row_idx]
+        rule_idx, row_idx = rule_idx[keep], row_idx[keep]
+    # Match the serial (rule-major, row-ascending) order exactly
+    order = np.lexsort((row_idx, rule_idx))
+    logger.info("Scored %d rows on %d workers", len(df) if is_new is None else int(is_new.sum()), workers)
+    return alerts_frame(df["tx_id"].to_numpy(), rules, rule_idx[order], row_idx[order])
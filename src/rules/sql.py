@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from typing import Any, Callable
+
+from src.utils import get_logger, read_sql
+
+
+logger = get_logger(__name__)
+
+# Each compiler turns a rule's YAML params into a boolean SQL expression over
+# ``transactions t JOIN merchants m``; it must agree with the pandas predicate.
+SqlFragment = tuple[str, dict[str, Any]]
+
+
+def _high_value(p: str, amount_threshold: float) -> SqlFragment:
+    return f"t.amount >= :{p}amount_threshold", {f"{p}amount_threshold": float(amount_threshold)}
+
+
+def _high_risk_mcc(p: str, high_risk_mcc: list[int]) -> SqlFragment:
+    return f"m.mcc = ANY(:{p}mccs)", {f"{p}mccs": [int(x) for x in high_risk_mcc]}
+
+
+def _night_owl_cnp(p: str, cnp_channels: list[str], start_hour: int, end_hour: int) -> SqlFragment:
+    sql = (
+        f"t.channel = ANY(:{p}channels)"
+        f" AND EXTRACT(HOUR FROM t.ts) >= :{p}start_hour AND EXTRACT(HOUR FROM t.ts) < :{p}end_hour"
+    )
+    return sql, {f"{p}channels": list(cnp_channels), f"{p}start_hour": int(start_hour), f"{p}end_hour": int(end_hour)}
+
+
+SQL_COMPILERS: dict[str, Callable[..., SqlFragment]] = {
+    "high_value": _high_value,
+    "high_risk_mcc": _high_risk_mcc,
+    "night_owl_cnp": _night_owl_cnp,
+}
+
+
+def can_push_down(rule: dict) -> bool:
+    return rule["name"] in SQL_COMPILERS
+
+
+def compile_rule(rule: dict, prefix: str = "") -> SqlFragment:
+    """Compile a stateless rule into a WHERE expression and its bind params."""
+    name = rule["name"]
+    if name not in SQL_COMPILERS:
+        raise ValueError(f"Rule {name} has no SQL pushdown")
+    try:
+        return SQL_COMPILERS[name](prefix, **rule.get("params", {}))
+    except TypeError as e:
+        raise RuntimeError(f"Invalid params for rule {name}: {e}")
+
+
+def pushdown_flags(rules: list[dict], window_sql: str, window_params: dict[str, Any]):
+    """Evaluate stateless ``rules`` inside Postgres in a single scan.
+
+    Returns one row per transaction matching at least one rule, with the
+    ``tx_id`` and a boolean column per rule (named ``r0``, ``r1``, ...).
+    """
+    exprs, params = [], dict(window_params)
+    for i, rule in enumerate(rules):
+        sql, p = compile_rule(rule, prefix=f"r{i}_")
+        exprs.append(f"({sql})")
+        params.update(p)
+    flags = ", ".join(f"{e} AS r{i}" for i, e in enumerate(exprs))
+    q = f"""
+        SELECT t.tx_id, {flags}
+        FROM transactions t
+        JOIN merchants m ON m.merchant_id = t.merchant_id
+        WHERE {window_sql} AND ({" OR ".join(exprs)})
+    """
+    df = read_sql(q, params)
+    logger.info("Pushed down %d rules, %d matching transactions", len(rules), len(df))
+    return df
@@ -1,13 +1,25 @@
 from .config import get_settings
 from .logging import get_logger
-from .db import get_engine, read_sql, write_df
+from .db import copy_df, get_engine, merge_df, read_sql, read_sql_typed, update_df, write_df
+from .frames import TX_SCHEMA, TypedFrame, decode_uuid, encode_uuid
 from .timeutils import localize_ts
+from .watermarks import get_watermark, set_watermark
 
 __all__ = [
     "get_settings",
     "get_logger",
     "get_engine",
     "read_sql",
+    "read_sql_typed",
+    "TypedFrame",
+    "TX_SCHEMA",
+    "encode_uuid",
+    "decode_uuid",
     "write_df",
+    "copy_df",
+    "merge_df",
+    "update_df",
     "localize_ts",
+    "get_watermark",
+    "set_watermark",
 ]
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+# Shared by the feature pipeline and the rule engine so both measure distance the same way
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_rad_km(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Great-circle distance in km between points given in radians."""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+@dataclass
+class CardContext:
+    """Per-card sorted view of a transaction frame, built once per scoring run.
+
+    All arrays are in (card_id, ts) order; ties keep input order unless a
+    ``tie_break`` column is given. Use ``to_frame_order`` to scatter a result
+    back onto the original rows.
+    """
+
+    order: np.ndarray
+    group_id: np.ndarray
+    group_start: np.ndarray
+    starts: np.ndarray
+    ts_ns: np.ndarray
+    dt_seconds: np.ndarray
+    lat_rad: np.ndarray
+    lon_rad: np.ndarray
+    _cache: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, tie_break: str | None = None) -> "CardContext":
+        # Sorted codes put cards in the same order as groupby("card_id")
+        codes, _ = pd.factorize(df["card_id"], sort=True)
+        ts_ns = pd.to_datetime(df["ts"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        keys = (ts_ns, codes) if tie_break is None else (pd.factorize(df[tie_break], sort=True)[0], ts_ns, codes)
+        order = np.lexsort(keys)
+        codes = codes[order]
+        ts_sorted = ts_ns[order]
+
+        group_start = np.ones(len(order), dtype=bool)
+        group_start[1:] = codes[1:] != codes[:-1]
+        starts = np.flatnonzero(group_start)
+        group_id = np.cumsum(group_start) - 1
+
+        dt_seconds = np.full(len(order), np.nan)
+        dt_seconds[1:] = (ts_sorted[1:] - ts_sorted[:-1]) / 1e9
+        dt_seconds[group_start] = np.nan
+
+        lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype=float) if "lat" in df else np.full(len(df), np.nan)
+        lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype=float) if "lon" in df else np.full(len(df), np.nan)
+        return cls(
+            order=order,
+            group_id=group_id,
+            group_start=group_start,
+            starts=starts,
+            ts_ns=ts_sorted,
+            dt_seconds=dt_seconds,
+            lat_rad=np.radians(lat[order]),
+            lon_rad=np.radians(lon[order]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def to_frame_order(self, values: np.ndarray) -> np.ndarray:
+        """Scatter sorted-order ``values`` back to the original row positions."""
+        out = np.empty_like(values)
+        out[self.order] = values
+        return out
+
+    def window_start(self, window: pd.Timedelta) -> np.ndarray:
+        """Sorted index of each row's first same-card row with ts > t - window.
+
+        Timestamps and window bounds are ranked jointly so (card, rank) packs into
+        one monotone int64 key and a single ``searchsorted`` covers every card.
+        """
+        window_ns = int(pd.Timedelta(window).value)
+        if window_ns not in self._cache:
+            n = len(self.ts_ns)
+            _, rank = np.unique(np.concatenate([self.ts_ns, self.ts_ns - window_ns]), return_inverse=True)
+            stride = np.int64(2 * n + 1)
+            base = self.group_id.astype(np.int64) * stride
+            self._cache[window_ns] = np.searchsorted(base + rank[:n], base + rank[n:], side="right")
+        return self._cache[window_ns]
+
+    def window_counts(self, window: pd.Timedelta) -> np.ndarray:
+        """Same-card transactions in (t - window, t], including the row itself."""
+        return np.arange(len(self.ts_ns)) - self.window_start(window) + 1
+
+    def prev_distance_km(self) -> np.ndarray:
+        """Distance to the card's previous transaction (NaN for its first one)."""
+        if "prev_distance_km" not in self._cache:
+            dist = np.full(len(self.ts_ns), np.nan)
+            dist[1:] = haversine_rad_km(self.lat_rad[:-1], self.lon_rad[:-1], self.lat_rad[1:], self.lon_rad[1:])
+            dist[self.group_start] = np.nan
+            self._cache["prev_distance_km"] = dist
+        return self._cache["prev_distance_km"]
+
+    def prev_speed_kmph(self) -> np.ndarray:
+        """Implied speed from the previous transaction; 0 when undefined."""
+        if "prev_speed_kmph" not in self._cache:
+            dist = np.nan_to_num(self.prev_distance_km(), nan=0.0)
+            hours = self.dt_seconds / 3600
+            with np.errstate(divide="ignore", invalid="ignore"):
+                speed = np.where(hours > 0, dist / hours, 0.0)
+            self._cache["prev_speed_kmph"] = np.nan_to_num(speed, nan=0.0)
+        return self._cache["prev_speed_kmph"]
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import uuid
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Compact encodings for typed reads, by column:
+#   "uuid"      16-byte ``S16`` values, held beside the frame (pandas would box them)
+#   "code"      int32 codes into a per-column dictionary of the original values
+#   "category"  pandas Categorical, for short label sets such as channel
+#   "float32"   only where ~7 significant digits suffice (coordinates, not money)
+# Columns not in the schema keep the dtype pandas reads them with.
+Schema = dict[str, str]
+
+TX_SCHEMA: Schema = {
+    "tx_id": "uuid",
+    "card_id": "code",
+    "merchant_id": "code",
+    "device_id": "code",
+    "channel": "category",
+    "currency": "category",
+    "lat": "float32",
+    "lon": "float32",
+}
+
+_KINDS = ("uuid", "code", "category", "float32")
+
+_HEX = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_NIBBLE = np.zeros(256, dtype=np.uint8)
+_NIBBLE[np.frombuffer(b"0123456789abcdef", dtype=np.uint8)] = np.arange(16)
+_NIBBLE[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+# Positions of the hex digits inside the canonical 36-char form
+_HEX_POS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+
+
+def encode_uuid(values) -> np.ndarray:
+    """UUID strings (or ``uuid.UUID``) to an ``S16`` array; nulls become the nil UUID."""
+    s = pd.Series(values, dtype=object, copy=False)
+    if len(s) and isinstance(s.iloc[0], uuid.UUID):
+        s = s.map(str, na_action="ignore")
+    text = s.fillna("00000000-0000-0000-0000-000000000000").to_numpy().astype("S36")
+    digits = _NIBBLE[text.view(np.uint8).reshape(-1, 36)[:, _HEX_POS]]
+    raw = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    return np.ascontiguousarray(raw).view("S16").ravel()
+
+
+def decode_uuid(values: np.ndarray) -> np.ndarray:
+    """Inverse of ``encode_uuid``: canonical lowercase UUID strings (object array)."""
+    raw = np.ascontiguousarray(values).view(np.uint8).reshape(-1, 16)
+    text = np.full((len(raw), 36), ord("-"), dtype=np.uint8)
+    text[:, _HEX_POS[0::2]] = _HEX[raw >> 4]
+    text[:, _HEX_POS[1::2]] = _HEX[raw & 0x0F]
+    return text.view("S36").ravel().astype("U36").astype(object)
+
+
+class _Codes:
+    """Accumulates int32 codes for one column across chunks with a shared dictionary."""
+
+    def __init__(self) -> None:
+        self.dictionary = pd.Index([], dtype=object)
+        self.parts: list[np.ndarray] = []
+
+    def add(self, values: pd.Series) -> None:
+        codes, uniques = pd.factorize(values)
+        pos = self.dictionary.get_indexer(uniques)
+        new = pos < 0
+        if new.any():
+            pos[new] = len(self.dictionary) + np.arange(int(new.sum()))
+            self.dictionary = self.dictionary.append(pd.Index(uniques[new], dtype=object))
+        # factorize marks nulls with -1; keep that as the null code. Index only
+        # the valid codes: an all-null chunk has no uniques to index into.
+        out = np.full(len(codes), -1, dtype=np.int32)
+        valid = codes >= 0
+        out[valid] = pos[codes[valid]]
+        self.parts.append(out)
+
+    def codes(self) -> np.ndarray:
+        return np.concatenate(self.parts) if self.parts else np.array([], dtype=np.int32)
+
+
+@dataclass
+class TypedFrame:
+    """A compactly encoded frame plus what is needed to map it back.
+
+    ``frame`` holds every non-UUID column (codes, categoricals, float32 and any
+    column outside the schema); ``uuids`` holds the ``S16`` columns aligned to
+    its rows and ``dictionaries`` the original values behind each code column.
+    """
+
+    frame: pd.DataFrame
+    uuids: dict[str, np.ndarray] = field(default_factory=dict)
+    dictionaries: dict[str, np.ndarray] = field(default_factory=dict)
+    columns: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def memory_bytes(self) -> int:
+        frame = int(self.frame.memory_usage(index=False, deep=True).sum())
+        dicts = sum(int(pd.Series(d, dtype=object).memory_usage(index=False, deep=True)) for d in self.dictionaries.values())
+        return frame + sum(a.nbytes for a in self.uuids.values()) + dicts
+
+    def decode_column(self, col: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Original values of ``col`` (optionally only at positions ``rows``)."""
+        if col in self.uuids:
+            values = self.uuids[col]
+            return decode_uuid(values if rows is None else values[rows])
+        values = self.frame[col].to_numpy()
+        if rows is not None:
+            values = values[rows]
+        if col in self.dictionaries:
+            out = np.full(len(values), None, dtype=object)
+            valid = values >= 0
+            out[valid] = np.take(self.dictionaries[col], values[valid])
+            return out
+        return values
+
+    def decode(self, columns: Optional[list[str]] = None, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Frame with original IDs restored, e.g. before writing back to Postgres."""
+        columns = columns or self.columns
+        return pd.DataFrame({c: self.decode_column(c, rows) for c in columns})
+
+
+def encode_frames(chunks: Iterable[pd.DataFrame], schema: Schema) -> TypedFrame:
+    """Encode a stream of frames (e.g. ``read_sql`` chunks) column by column."""
+    bad = {k for k in schema.values() if k not in _KINDS}
+    if bad:
+        raise ValueError(f"Unknown column encodings: {sorted(bad)}")
+    columns: list[str] = []
+    codes: dict[str, _Codes] = {}
+    uuids: dict[str, list[np.ndarray]] = {}
+    rest: list[pd.DataFrame] = []
+    for chunk in chunks:
+        if not columns:
+            columns = list(chunk.columns)
+        kinds = {c: schema.get(c) for c in chunk.columns}
+        for col, kind in kinds.items():
+            if kind == "uuid":
+                uuids.setdefault(col, []).append(encode_uuid(chunk[col]))
+            elif kind in ("code", "category"):
+                codes.setdefault(col, _Codes()).add(chunk[col])
+        rest.append(chunk[[c for c, k in kinds.items() if k not in ("uuid", "code", "category")]].astype(
+            {c: np.float32 for c, k in kinds.items() if k == "float32"}
+        ))
+
+    frame = pd.concat(rest, ignore_index=True) if rest else pd.DataFrame()
+    dictionaries = {}
+    for col, acc in codes.items():
+        if schema[col] == "category":
+            frame[col] = pd.Categorical.from_codes(acc.codes(), categories=acc.dictionary)
+        else:
+            frame[col] = acc.codes()
+            dictionaries[col] = acc.dictionary.to_numpy()
+    frame = frame[[c for c in columns if c not in uuids]]
+    return TypedFrame(
+        frame=frame,
+        uuids={c: np.concatenate(parts) for c, parts in uuids.items()},
+        dictionaries=dictionaries,
+        columns=columns,
+    )
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import get_engine
+from .logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def get_watermark(job_name: str) -> Optional[datetime]:
+    """Return the persisted high-water mark for ``job_name`` or None on first run."""
+    eng = get_engine()
+    with eng.connect() as con:
+        row = con.execute(
+            text("SELECT watermark FROM job_watermarks WHERE job_name = :job"),
+            {"job": job_name},
+        ).first()
+    return None if row is None else row[0]
+
+
+def set_watermark(job_name: str, watermark: datetime, con: Optional[Connection] = None) -> None:
+    """Upsert the high-water mark for ``job_name``.
+
+    Pass ``con`` to make the update part of a caller's transaction.
+    """
+    sql = text("""
+        INSERT INTO job_watermarks (job_name, watermark, updated_at)
+        VALUES (:job, :wm, NOW())
+        ON CONFLICT (job_name) DO UPDATE
+        SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at
+    """)
+    params = {"job": job_name, "wm": watermark}
+    if con is not None:
+        con.execute(sql, params)
+    else:
+        with get_engine().begin() as c:
+            c.execute(sql, params)
+    logger.info("Advanced watermark %s to %s", job_name, watermark)
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def pg():
+    """A connection in a transaction rolled back afterwards; skips without a reachable DATABASE_URL."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import OperationalError
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL not set")
+    try:
+        con = create_engine(url).connect()
+    except OperationalError:
+        pytest.skip("database unreachable")
+    trans = con.begin()
+    yield con
+    trans.rollback()
+    con.close()
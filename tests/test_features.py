@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features.build_features import FEATURE_LOOKBACK, compute_features
+
+
+def _tx_frame(n: int = 600, cards: int = 12, seed: int = 11) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 3 * 86400, size=n), unit="s")
+    # A few exact duplicates of timestamps to exercise tie ordering
+    ts = ts.where(rng.random(n) > 0.05, ts.floor("h"))
+    return pd.DataFrame({
+        "tx_id": [f"{i:08x}-0000-0000-0000-000000000000" for i in rng.permutation(n)],
+        "card_id": rng.choice([f"card{i}" for i in range(cards)], size=n),
+        "ts": ts,
+        "amount": np.round(rng.lognormal(3.5, 1.0, size=n), 2),
+        "lat": rng.uniform(30, 45, size=n),
+        "lon": rng.uniform(-120, -70, size=n),
+        "label_fraud": False,
+        "channel": "POS",
+        "device_id": "dev_1",
+        "merchant_risk_tier": 1,
+        "brand": "VISA",
+    })
+
+
+def test_incremental_history_matches_full_rebuild():
+    df = _tx_frame()
+    wm = pd.Timestamp("2024-01-03 06:00")
+    history_start = wm - FEATURE_LOOKBACK
+    # Same selection as the incremental SQL: recent history + one earlier row per card
+    new_cards = df.loc[df["ts"] > wm, "card_id"].unique()
+    mine = df[df["card_id"].isin(new_cards)]
+    recent = mine[mine["ts"] > history_start]
+    older = mine[mine["ts"] <= history_start].sort_values(["ts", "tx_id"]).groupby("card_id").tail(1)
+    part = pd.concat([recent, older]).sample(frac=1, random_state=0)
+
+    full = compute_features(df)
+    inc = compute_features(part)
+    full = full[full["ts"] > wm].sort_values("tx_id").reset_index(drop=True)
+    inc = inc[inc["ts"] > wm].sort_values("tx_id").reset_index(drop=True)
+    assert len(inc) == (df["ts"] > wm).sum()
+    pd.testing.assert_frame_equal(inc, full, check_exact=True)
+
+
+def test_vectorized_features_match_reference():
+    df = _tx_frame(n=800, cards=40, seed=3)
+    df.loc[df.index[::17], "lat"] = np.nan
+    ref = compute_features(df, engine="groupby")
+    fast = compute_features(df)
+    pd.testing.assert_frame_equal(fast, ref, check_exact=True)
+
+
+def test_complete_cards_holds_back_trailing_card():
+    from src.features.build_features import _complete_cards
+    assert _complete_cards(np.array(["a", "a", "b", "c", "c"])) == 3
+    assert _complete_cards(np.array(["a", "a"])) == 0
+
+
+def test_online_feature_store_matches_batch(tmp_path):
+    from src.features.online import VECTOR_COLUMNS, OnlineFeatureStore
+    df = _tx_frame(n=1500, cards=30, seed=8)
+    df.loc[df.index[::13], "lat"] = np.nan
+    ref = compute_features(df).set_index("tx_id")
+
+    # Score the first half, restart from a snapshot, then score the rest
+    ordered = df.sort_values(["ts", "tx_id"])
+    first, rest = ordered.iloc[:700], ordered.iloc[700:]
+    store = OnlineFeatureStore()
+    part1 = store.replay(first)
+    store.snapshot(str(tmp_path / "store.npz"))
+    with np.load(tmp_path / "store.npz", allow_pickle=False) as z:
+        assert all(z[k].dtype != object for k in z.files) and z["cards"].dtype.kind == "U"
+    part2 = OnlineFeatureStore.restore(str(tmp_path / "store.npz")).replay(rest)
+    out = pd.concat([part1, part2]).set_index("tx_id")
+    ref = ref.loc[out.index, VECTOR_COLUMNS]
+
+    # Trig in math vs numpy may differ in the last bits; everything else is exact
+    np.testing.assert_allclose(out["geo_velocity_kmph_prev"], ref["geo_velocity_kmph_prev"], rtol=1e-12)
+    exact = [c for c in VECTOR_COLUMNS if c != "geo_velocity_kmph_prev"]
+    pd.testing.assert_frame_equal(out[exact], ref[exact], check_exact=True, check_dtype=False)
+
+
+def test_sql_engine_window_bounds_exclude_left_edge():
+    from datetime import timedelta
+    from src.features.sql import _preceding, features_sql
+    assert _preceding(timedelta(hours=1)) == "INTERVAL '3599999999 microseconds' PRECEDING"
+    q = features_sql("SELECT 1")
+    assert "ON CONFLICT (tx_id) DO UPDATE" in q and "pending_from" not in q
+
+
+def test_sql_engine_matches_pandas_at_edge_coordinates(pg):
+    import uuid
+    from sqlalchemy import text
+    from src.features.sql import features_sql
+    from src.utils import copy_df
+
+    # Antipodes, a repeated point, the poles, across the dateline, then a burst of antipodal hops
+    points = [(0.0, 0.0), (0.0, 180.0), (0.0, 180.0), (89.9999, 10.0), (-89.9999, -170.0),
+              (0.0, -179.9999), (0.0, 179.9999), (40.7128, -74.006), (-40.7128, 105.994)]
+    rng = np.random.default_rng(2)
+    for lat, lon in zip(np.round(rng.uniform(-90, 90, 40), 4), np.round(rng.uniform(-180, 0, 40), 4)):
+        points += [(lat, lon), (-lat, lon + 180.0)]
+    n = len(points)
+    df = pd.DataFrame({
+        "tx_id": [str(uuid.uuid4()) for _ in range(n)],
+        "card_id": "edge-card",
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(n) * 7, unit="min"),
+        "amount": 10.0,
+        "lat": [p[0] for p in points],
+        "lon": [p[1] for p in points],
+        "channel": "POS", "device_id": "dev", "label_fraud": False, "brand": "VISA", "merchant_risk_tier": 1,
+    })
+    pg.exec_driver_sql(
+        "CREATE TEMP TABLE edge_tx (tx_id UUID, card_id TEXT, ts TIMESTAMP, amount FLOAT8, lat FLOAT8, lon FLOAT8, "
+        "channel TEXT, device_id TEXT, label_fraud BOOLEAN, brand TEXT, merchant_risk_tier INT)"
+    )
+    copy_df(df, "edge_tx", con=pg)
+    pg.execute(text(features_sql("SELECT * FROM edge_tx")))
+    got = pd.read_sql(text("SELECT tx_id::text AS tx_id, geo_velocity_kmph_prev FROM model_features WHERE tx_id IN (SELECT tx_id FROM edge_tx)"), pg)
+    ref = compute_features(df).set_index("tx_id")["geo_velocity_kmph_prev"]
+    got = got.set_index("tx_id")["geo_velocity_kmph_prev"].reindex(ref.index)
+    np.testing.assert_allclose(got, ref, rtol=1e-9)
+    # Half the earth's circumference in 7 minutes
+    assert ref.max() == pytest.approx(np.pi * 6371.0 * 60 / 7, rel=1e-9)
+
+
+def test_incremental_query_picks_up_back_dated_rows(pg):
+    from sqlalchemy import text
+    from src.features.build_features import _incremental_query
+    from src.features.sql import features_sql
+    from src.utils import copy_df
+    card = pg.execute(text(
+        "INSERT INTO cards (pan_last4, brand, exp_date, status) VALUES ('0000', 'VISA', '2030-01-01', 'ACTIVE') RETURNING card_id"
+    )).scalar()
+    merchant = pg.execute(text(
+        "INSERT INTO merchants (name, mcc, country, risk_tier) VALUES ('m', 5411, 'US', 1) RETURNING merchant_id"
+    )).scalar()
+    df = _tx_frame(n=60, cards=1, seed=5)
+    df["tx_id"] = [f"{i:08x}-1111-4111-8111-111111111111" for i in range(len(df))]
+    df["card_id"] = str(card)
+    df["merchant_id"] = str(merchant)
+    df["currency"] = "USD"
+    tx_cols = ["tx_id", "card_id", "merchant_id", "ts", "amount", "currency", "lat", "lon", "channel", "device_id", "label_fraud"]
+
+    def run():
+        high = pg.execute(text("SELECT MAX(ts) FROM transactions")).scalar()
+        source, params = _incremental_query(high)
+        pg.execute(text(features_sql(source, incremental=True)), params)
+
+    late = df["ts"] > df["ts"].quantile(0.2)
+    copy_df(df.loc[late, tx_cols], "transactions", con=pg)
+    run()
+    # A backfill lands rows older than everything already built
+    copy_df(df.loc[~late, tx_cols], "transactions", con=pg)
+    run()
+    got = pd.read_sql(text(
+        "SELECT f.* FROM model_features f JOIN transactions t USING (tx_id) WHERE t.card_id = :card"
+    ), pg, params={"card": card})
+    ref = compute_features(df.assign(brand="VISA", merchant_risk_tier=1))
+    cols = ["tx_count_1h", "tx_count_24h", "last_tx_delta_minutes"]
+    got = got.assign(tx_id=got["tx_id"].astype(str)).set_index("tx_id")[cols].reindex(ref["tx_id"])
+    assert len(got.dropna()) == len(df)
+    np.testing.assert_allclose(got.to_numpy(dtype=float), ref[cols].to_numpy(dtype=float), rtol=1e-9)
+
+
+def test_snapshots_prune_dates_and_columns(tmp_path):
+    import pytest
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.dataset as pds
+    from src.features.snapshots import _write_partition, read_snapshots, snapshot_partitions
+    feats = compute_features(_tx_frame())
+    for ds, part in feats.groupby(feats["ts"].dt.date):
+        _write_partition(pa, pds, part, str(tmp_path / f"ds={ds.isoformat()}"), "parquet")
+    assert [d.isoformat() for d in snapshot_partitions(str(tmp_path))] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+
+    out = read_snapshots(snapshot_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(
+        out.sort_values("tx_id").reset_index(drop=True),
+        feats.sort_values("tx_id").reset_index(drop=True),
+        check_dtype=False,
+    )
+    start, end = pd.Timestamp("2024-01-01 18:00"), pd.Timestamp("2024-01-02 06:00")
+    out = read_snapshots(["tx_id", "ts"], start.to_pydatetime(), end.to_pydatetime(), snapshot_dir=str(tmp_path))
+    assert list(out.columns) == ["tx_id", "ts"]
+    assert len(out) == ((feats["ts"] >= start) & (feats["ts"] < end)).sum()
+
+
+def test_feature_engines_agree_on_edge_cases():
+    from benchmarks.features_equivalence import compare, run_case, synthetic_transactions
+    results = run_case(2_000, ["groupby", "vectorized", "online"], isolate=False)
+    assert [r["engine"] for r in results] == ["groupby", "vectorized", "online"]
+    assert all(not r["mismatches"] for r in results)
+
+    ref = compute_features(synthetic_transactions(500))
+    bad = ref.copy()
+    bad.loc[bad.index[:3], "amount_mean_24h"] *= 1 + 1e-6
+    mismatches = compare(bad, ref)
+    assert mismatches.pop("amount_mean_24h") == 3
+    assert not any(mismatches.values())
+
+
+def test_sliding_hll_error_and_expiry():
+    from datetime import timedelta
+    from src.features.entity import SlidingHLL, hll_hash
+    hll = SlidingHLL(timedelta(hours=1), precision=10)
+    values = [f"card{i}" for i in range(5_000)]
+    register, rank = hll_hash(values, hll.precision)
+    for i in range(len(values)):
+        # Repeats must not count twice
+        for _ in range(2):
+            hll.add("dev", i * 10**6, int(register[i]), int(rank[i]))
+    t_end = (len(values) - 1) * 10**6
+    assert abs(hll.estimate("dev", t_end) - 5_000) / 5_000 < 3 * 1.04 / 32
+    assert hll.estimate("dev", t_end + 3_600 * 10**9) == 0.0
+    hll.prune(t_end + 3_600 * 10**9)
+    assert len(hll) == 0
+
+
+def test_entity_features_bounded_error_and_incremental_parity():
+    from src.features.entity import DEVICE_WINDOW, EntityFeatures
+    rng = np.random.default_rng(3)
+    n = 3_000
+    df = pd.DataFrame({
+        "tx_id": [f"{i:08x}-0000-0000-0000-000000000000" for i in range(n)],
+        "card_id": rng.choice([f"card{i}" for i in range(400)], size=n),
+        "merchant_id": rng.choice(["m1", "m2", "m3"], size=n),
+        "device_id": rng.choice([f"dev{i}" for i in range(40)], size=n),
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 2 * 86_400, size=n)), unit="s"),
+    })
+    out = EntityFeatures().update(df)
+
+    # Counts never exceed the exact ones and miss at most the oldest 5-minute slot
+    for i, row in enumerate(df.itertuples()):
+        recent = df.iloc[:i]
+        mine = recent["ts"][recent["merchant_id"] == row.merchant_id]
+        exact = (mine > row.ts - pd.Timedelta(hours=1)).sum()
+        edge = ((mine > row.ts - pd.Timedelta(hours=1)) & (mine <= row.ts - pd.Timedelta(minutes=55))).sum()
+        assert exact - edge <= out["merchant_tx_count_1h"].iloc[i] <= exact
+
+    # Sketches warmed with one device window of history reproduce the full pass
+    wm = df["ts"].iloc[n // 2]
+    part = df[df["ts"] > wm - DEVICE_WINDOW]
+    state = EntityFeatures()
+    inc = pd.concat([state.update(c) for c in (part.iloc[:500], part.iloc[500:])])
+    inc = inc[(part["ts"] > wm).to_numpy()].reset_index(drop=True)
+    pd.testing.assert_frame_equal(inc, out[(df["ts"] > wm).to_numpy()].reset_index(drop=True))
+
+
+def test_card_ranges_partition_cards(pg):
+    from sqlalchemy import text
+    from src.features.build_features import _card_range_sql, card_ranges, ranges_from_bounds
+
+    assert ranges_from_bounds([]) == [(None, None)]
+    assert ranges_from_bounds(["b", "a", "b"]) == [(None, "a"), ("a", "b"), ("b", None)]
+    assert _card_range_sql("t", (None, None)) == "TRUE"
+    assert _card_range_sql("t", ("a", None)) == "t.card_id >= CAST(:card_lo AS uuid)"
+
+    ranges = card_ranges(4)
+    assert len(ranges) == 4 and ranges[0][0] is None and ranges[-1][1] is None
+    assert all(hi == lo for (_, hi), (lo, _) in zip(ranges, ranges[1:]))
+    everything = {r[0] for r in pg.execute(text("SELECT DISTINCT card_id FROM transactions WHERE card_id IS NOT NULL"))}
+    seen = []
+    for lo, hi in ranges:
+        q = f"SELECT DISTINCT card_id FROM transactions t WHERE {_card_range_sql('t', (lo, hi))}"
+        seen.append({r[0] for r in pg.execute(text(q), {"card_lo": lo, "card_hi": hi})})
+    # Disjoint and together every card with transactions
+    assert sum(len(s) for s in seen) == len(set().union(*seen)) == len(everything)
+    assert set().union(*seen) == everything
+
+
+def test_entity_features_refuse_sql_engine(monkeypatch):
+    from src.features import build_features as bf
+    monkeypatch.setattr(bf, "get_settings", lambda: {"features": {"engine": "sql", "entity": {"enabled": True}}})
+    with pytest.raises(ValueError, match="pandas engine"):
+        bf.build_features()
@@ -22,3 +22,310 @@ def test_pipeline_fit_predict():
     proba = pipe.predict_proba(X)[:, 1]
     assert len(proba) == len(X)
 
+
+
+def test_score_frame_builds_model_scores_rows():
+    from src.ml.predict import score_frame
+    X = pd.DataFrame({"a": [0.1, 1.2, 0.5, 3.0], "b": ["x", "y", "x", "z"]})
+    pipe = build_pipeline(numeric=["a"], categorical=["b"], algo="lr").fit(X, pd.Series([0, 1, 0, 1]))
+    df = X.assign(tx_id=["t1", "t2", "t3", "t4"], label_fraud=None, ts=pd.Timestamp("2024-01-01"))
+    out = score_frame(pipe, df, "m.joblib", threshold=0.5)
+    assert list(out.columns) == ["tx_id", "model_name", "proba", "predicted_label"]
+    assert out["tx_id"].tolist() == ["t1", "t2", "t3", "t4"]
+    assert (out["predicted_label"] == (out["proba"] >= 0.5)).all()
+
+
+def test_latest_model_by_training_time_not_name(tmp_path):
+    from src.ml.predict import _latest_model
+    for name in ("rf_20261018010000.joblib", "sgd_20261017000000.joblib", "lr_20261016000000.joblib"):
+        (tmp_path / name).write_bytes(b"")
+    assert _latest_model(str(tmp_path)).endswith("rf_20261018010000.joblib")
+    (tmp_path / "sgd_20261018020000.joblib").write_bytes(b"")
+    assert _latest_model(str(tmp_path)).endswith("sgd_20261018020000.joblib")
+
+
+def test_scoring_service_batches_and_reloads(tmp_path):
+    import http.client
+    import json
+    import os
+    import threading
+    import joblib
+    import pytest
+    from src.ml.serve import MicroBatcher, ModelHolder, ModelUnavailable, make_server
+
+    X = pd.DataFrame({"a": [0.1, 1.2, 0.5, 3.0], "b": ["x", "y", "x", "z"]})
+    pipe = build_pipeline(numeric=["a"], categorical=["b"], algo="lr").fit(X, pd.Series([0, 1, 0, 1]))
+    joblib.dump({"pipeline": pipe}, tmp_path / "lr_1.joblib")
+    holder = ModelHolder(str(tmp_path))
+    batcher = MicroBatcher(holder, max_batch=64, max_wait_ms=50)
+
+    results = [None] * 8
+    def call(i):
+        results[i] = batcher.submit([{"a": float(i), "b": "x"}])
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = batcher.stats()
+    assert stats["requests"] == 8 and stats["batches"] < 8
+    expected = pipe.predict_proba(pd.DataFrame({"a": [float(i) for i in range(8)], "b": "x"}))[:, 1]
+    assert [float(r[1][0]) for r in results] == expected.tolist()
+
+    server = make_server(batcher, "127.0.0.1", 0, threshold=0.5)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    con = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    con.request("POST", "/score", json.dumps({"rows": [{"a": 3.0, "b": "z"}, {"a": 0.1, "b": "x"}]}))
+    body = json.loads(con.getresponse().read())
+    assert body["model"] == "lr_1.joblib" and len(body["scores"]) == 2
+    for bad in ({"b": "x"}, {"rows": 5}, {"rows": None}, {"rows": []}, [1, 2]):
+        con.request("POST", "/score", json.dumps(bad))
+        resp = con.getresponse()
+        resp.read()
+        assert resp.status == 400
+    con.request("POST", "/score", json.dumps({"a": 0.5, "b": "x"}))
+    resp = con.getresponse()
+    assert resp.status == 200 and len(json.loads(resp.read())["scores"]) == 1
+    con.close()
+
+    # A malformed batch that gets past the front end fails alone; the batcher keeps running
+    try:
+        batcher.submit(5, timeout=5)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("expected TypeError")
+    assert batcher._thread.is_alive()
+    assert len(batcher.submit([{"a": 1.0, "b": "y"}], timeout=5)[1]) == 1
+
+    # A newer artifact is picked up whole
+    joblib.dump({"pipeline": pipe}, tmp_path / "lr_2.joblib")
+    assert holder.check() and holder.current[0] == "lr_2.joblib"
+    assert not holder.check()
+
+    # Without a model every endpoint answers 503 instead of failing
+    holder.current = None
+    con = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    for method, path, body in (("GET", "/health", None), ("GET", "/stats", None), ("POST", "/score", json.dumps({"a": 0.5, "b": "x"}))):
+        con.request(method, path, body)
+        resp = con.getresponse()
+        resp.read()
+        assert resp.status == 503
+    con.close()
+    server.shutdown()
+    server.server_close()
+    batcher.close()
+
+    # A newest artifact that does not load falls back to the one before it
+    (tmp_path / "lr_3.joblib").write_bytes(b"not a model")
+    assert ModelHolder(str(tmp_path)).current[0] == "lr_2.joblib"
+    broken = tmp_path / "broken"
+    broken.mkdir()
+    (broken / "lr_1.joblib").write_bytes(b"not a model")
+    with pytest.raises(ModelUnavailable):
+        ModelHolder(str(broken))
+
+
+def test_compiled_forest_matches_pipeline(tmp_path):
+    import numpy as np
+    from src.ml.compiled import CompiledEnsemble, compile_pipeline
+
+    rng = np.random.default_rng(0)
+    n = 1_500
+    X = pd.DataFrame({
+        "a": rng.normal(size=n),
+        "c": np.where(rng.random(n) < 0.1, np.nan, rng.exponential(size=n)),
+        "b": rng.choice(["x", "y", "z"], size=n),
+    })
+    y = ((X["a"] > 0.5) | (X["b"] == "z") | X["c"].isna()).astype(int)
+    pipe = build_pipeline(numeric=["a", "c"], categorical=["b"], algo="rf").fit(X, y)
+    model = compile_pipeline(pipe)
+
+    X.loc[::50, "b"] = "unseen"
+    expected = pipe.predict_proba(X)
+    # Large batches go tree by tree, small ones walk all trees at once
+    assert np.allclose(model.predict_proba(X), expected, rtol=1e-9, atol=1e-12)
+    assert np.allclose(model.predict_proba(X.iloc[:20]), expected[:20], rtol=1e-9, atol=1e-12)
+    one = [model.predict_one(row) for row in X.iloc[:20].to_dict("records")]
+    assert np.allclose(one, expected[:20, 1], rtol=1e-9, atol=1e-12)
+
+    model.save(str(tmp_path / "rf.npz"))
+    loaded = CompiledEnsemble.load(str(tmp_path / "rf.npz"))
+    assert np.array_equal(loaded.predict_proba(X), model.predict_proba(X))
+
+
+def test_categorical_encoders_per_column():
+    import numpy as np
+    import pytest
+    from src.ml.compiled import compile_pipeline
+    from src.ml.encoders import FrequencyEncoder
+
+    enc = FrequencyEncoder().fit(pd.DataFrame({"d": ["a", "a", "b", None]}))
+    assert enc.transform(pd.DataFrame({"d": ["a", "b", "zz", None]}))[:, 0].tolist() == [0.5, 0.25, 0.0, 0.25]
+
+    rng = np.random.default_rng(1)
+    X = pd.DataFrame({"a": rng.normal(size=600), "d": rng.choice([f"d{i}" for i in range(40)], size=600)})
+    y = X["d"].isin(["d1", "d2", "d3"]).astype(int)
+    widths = {}
+    for spec in ({"type": "hashing", "n_features": 16}, {"type": "frequency"}, {"type": "target", "cv": 3}):
+        pipe = build_pipeline(numeric=["a"], categorical=["d"], algo="rf", encoders={"d": spec}).fit(X, y)
+        widths[spec["type"]] = pipe.named_steps["pre"].transform(X.iloc[:5]).shape[1]
+        assert pipe.predict_proba(X.assign(d="unseen")).shape == (600, 2)
+        if spec["type"] != "hashing":
+            assert np.allclose(compile_pipeline(pipe).predict_proba(X), pipe.predict_proba(X), rtol=1e-9, atol=1e-12)
+    assert widths == {"hashing": 17, "frequency": 2, "target": 2}
+    with pytest.raises(ValueError):
+        build_pipeline(numeric=["a"], categorical=["d"], encoders={"d": {"type": "embedding"}})
+
+
+def test_streaming_fit_matches_full_preprocessing_and_warm_starts():
+    import numpy as np
+    from sklearn.metrics import average_precision_score
+    from sklearn.preprocessing import StandardScaler
+    from src.ml.encoders import FrequencyEncoder
+    from src.ml.incremental import fit_streaming, score_streaming, streaming_pipeline
+
+    rng = np.random.default_rng(3)
+    n = 4_000
+    df = pd.DataFrame({
+        "tx_id": [f"t{i}" for i in range(n)],
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(n), unit="min"),
+        "a": rng.normal(size=n),
+        "d": rng.choice([f"d{i}" for i in range(50)], size=n),
+        "c": rng.choice(["POS", "ECOM"], size=n),
+    })
+    df["label_fraud"] = np.where(rng.random(n) < 0.1, None, (df["a"] > 1.2) | df["d"].isin(["d1", "d2"]))
+    chunks = lambda: (df.iloc[i:i + 500] for i in range(0, 3_000, 500))
+
+    pipe = streaming_pipeline(["a"], ["d", "c"], {"d": {"type": "frequency"}}, hash_features=32)
+    counts, rows = fit_streaming(pipe, chunks, "label_fraud", epochs=3)
+    assert rows == 3_000 and counts.sum() == 3_000
+    pre = pipe.named_steps["pre"]
+    assert np.allclose(pre.named_transformers_["num"].scale_, StandardScaler(with_mean=False).fit(df.iloc[:3_000][["a"]]).scale_)
+    full = FrequencyEncoder().fit(df.iloc[:3_000][["d"]])
+    assert np.allclose(pre.named_transformers_["frequency_d"].transform(df[["d"]]), full.transform(df[["d"]]))
+
+    y, proba = score_streaming(pipe, [df.iloc[3_000:]], "label_fraud")
+    assert len(y) == 1_000 and average_precision_score(y, proba) > 0.5
+
+    # Warm start: later rows only, continuing the same learner
+    steps = pipe.named_steps["clf"].t_
+    counts2, rows2 = fit_streaming(pipe, lambda: [df.iloc[3_000:3_500]], "label_fraud", class_counts=counts)
+    assert rows2 == 500 and counts2.sum() == 3_500
+    assert pipe.named_steps["clf"].t_ > steps
+    assert pre.named_transformers_["num"].n_samples_seen_ == 3_500
+
+
+def test_rolling_folds_and_halving_search():
+    import numpy as np
+    from src.ml.preprocessing import rolling_time_folds
+    from src.ml.tune import candidates, search
+
+    rng = np.random.default_rng(5)
+    n = 2_400
+    df = pd.DataFrame({
+        "tx_id": [f"t{i}" for i in range(n)],
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(n) * 5, unit="min"),
+        "a": rng.normal(size=n),
+        "b": rng.choice(["x", "y", "z"], size=n),
+    })
+    df["label_fraud"] = (df["a"] + rng.normal(scale=0.5, size=n) > 1.5) | (df["b"] == "z") & (rng.random(n) < 0.2)
+
+    folds = rolling_time_folds(df, "label_fraud", folds=3, val_days=1)
+    assert len(folds) == 3
+    # Expanding windows: each fold trains on more history and validates right after it
+    assert [len(f.X_train) for f in folds] == sorted(len(f.X_train) for f in folds)
+    assert sum(len(f.X_val) for f in folds) == n - len(folds[0].X_train)
+
+    cands = [("lr", p) for p in candidates({"max_iter": 200}, {"C": [0.001, 1.0], "class_weight": [None, "balanced"]})]
+    cands.append(("lr", {"C": -1.0}))
+    assert len(cands) == 5 and all(p["max_iter"] == 200 for _, p in cands[:4])
+    board = search(df, "label_fraud", ["a"], ["b"], None, cands, folds=3, val_days=1, halving=2)
+    assert list(board["rank"]) == [1, 2, 3, 4, 5]
+    # 5 -> 3 -> 2 candidates over the folds; the broken one fails the first
+    assert list(board["folds"]) == [3, 3, 2, 1, 1]
+    assert board["pr_auc"].iloc[0] >= board["pr_auc"].iloc[1]
+    assert board["error"].notna().sum() == 1 and board["pr_auc"].isna().sum() == 1
+    assert (board["fit_seconds"].iloc[:4] > 0).all()
+    assert board["pr_auc_fold3"].notna().sum() == 2
+
+
+def test_tuning_fold_cache_maps_sparse_matrices(tmp_path):
+    import joblib
+    import numpy as np
+    import scipy.sparse as sp
+    from src.ml.tune import _flat, _unflat
+
+    X = sp.random(200, 50, density=0.05, format="csr", random_state=0)
+    joblib.dump({"X": _flat(X), "D": _flat(X.toarray())}, tmp_path / "fold.joblib")
+    parts = joblib.load(tmp_path / "fold.joblib", mmap_mode="r")
+    assert all(isinstance(v, np.memmap) for v in parts["X"].values())
+    Y = _unflat(parts["X"])
+    # The matrix wraps the mapped arrays, so workers share one copy of the fold
+    assert np.shares_memory(Y.data, parts["X"]["data"]) and (Y != X).nnz == 0
+    assert isinstance(parts["D"]["dense"], np.memmap)
+
+
+def test_train_streaming_warm_start_bookkeeping(tmp_path, monkeypatch):
+    import joblib
+    import numpy as np
+    import pytest
+    from src.ml import incremental
+
+    rng = np.random.default_rng(4)
+    n = 4 * 24 * 20
+    df = pd.DataFrame({
+        "tx_id": [f"t{i}" for i in range(n)],
+        "ts": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(n) * 3, unit="min"),
+        "a": rng.normal(size=n),
+        "d": rng.choice([f"d{i}" for i in range(20)], size=n),
+    })
+    df["label_fraud"] = (df["a"] > 1.0) | (rng.random(n) < 0.02)
+    db = {"rows": df.iloc[:3 * 24 * 20], "labels_through": None}
+    relabel_calls = []
+
+    def features(columns, start=None, end=None, source=None, chunksize=100_000):
+        rows = db["rows"]
+        if start is not None:
+            rows = rows[rows["ts"] >= start]
+        if end is not None:
+            rows = rows[rows["ts"] < end]
+        for i in range(0, len(rows), 500):
+            yield rows.iloc[i:i + 500][list(columns)]
+
+    def relabeled(columns, since, until, chunksize):
+        relabel_calls.append((since, until))
+        return iter([df.iloc[:10][columns].assign(label_fraud=True)])
+
+    monkeypatch.setattr(incremental, "load_model_spec", lambda: {
+        "target": "label_fraud",
+        "features": {"numeric": ["a"], "categorical": ["d"], "encoders": {"d": {"type": "frequency"}}},
+        "split": {"val_days": 1},
+        "model": {"sgd": {"loss": "log_loss", "alpha": 1e-4}},
+    })
+    monkeypatch.setattr(incremental, "iter_feature_table", features)
+    monkeypatch.setattr(incremental, "latest_feature_ts", lambda source=None: db["rows"]["ts"].max())
+    monkeypatch.setattr(incremental, "read_sql", lambda sql, params=None: pd.DataFrame({"t": [db["labels_through"]]}))
+    monkeypatch.setattr(incremental, "_relabeled_chunks", relabeled)
+
+    with pytest.raises(ValueError):
+        incremental.train_streaming(str(tmp_path), source="snapshot", warm_start=True)
+
+    first, _ = incremental.train_streaming(str(tmp_path), source="db", warm_start=True)
+    state = joblib.load(first)["streaming"]
+    assert state["cutoff"] == db["rows"]["ts"].max() - pd.Timedelta(days=1)
+    assert state["rows"] == (db["rows"]["ts"] < state["cutoff"]).sum() and not relabel_calls
+
+    # Nothing new: the previous model is kept
+    assert incremental.train_streaming(str(tmp_path), source="db", warm_start=True)[0] == first
+
+    # A new day and a new label: only rows in [old cutoff, new cutoff) plus relabeled rows are fed
+    db["rows"], db["labels_through"] = df, pd.Timestamp("2024-01-04 12:00")
+    second, _ = incremental.train_streaming(str(tmp_path), source="db", warm_start=True)
+    bundle = joblib.load(second)
+    new_rows = ((df["ts"] >= state["cutoff"]) & (df["ts"] < bundle["streaming"]["cutoff"])).sum()
+    assert bundle["streaming"]["cutoff"] == state["cutoff"] + pd.Timedelta(days=1)
+    assert bundle["streaming"]["rows"] == state["rows"] + new_rows
+    assert bundle["streaming"]["labels_through"] == db["labels_through"]
+    assert relabel_calls == [(None, state["cutoff"])]
+    assert bundle["numeric"] == ["a"] and bundle["encoders"] == {"d": {"type": "frequency"}}
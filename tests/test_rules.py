@@ -30,8 +30,9 @@ def test_high_value():
 
 def test_rapid_fire():
     df = sample_df()
-    mask = rapid_fire(df, tx_per_min_threshold=2, window_minutes=2)
-    assert mask.any()
+    mask = rapid_fire(df, tx_per_min_threshold=1, window_minutes=2)
+    assert mask.tolist() == [False, True, False, False]
+    assert not rapid_fire(df, tx_per_min_threshold=2, window_minutes=2).any()
 
 
 def test_geo_velocity():
@@ -51,3 +52,222 @@ def test_night_owl_cnp():
     mask = night_owl_cnp(df, ["ECOM"], 0, 5)
     assert mask.sum() >= 1
 
+
+
+def test_rule_lookback_uses_rapid_fire_window():
+    from datetime import timedelta
+    from src.rules.engine import rule_lookback
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 1000}},
+        {"name": "rapid_fire", "params": {"tx_per_min_threshold": 5, "window_minutes": 2}},
+        {"name": "geo_velocity", "params": {"geo_velocity_kmph": 1000}},
+    ]
+    assert rule_lookback(rules) == timedelta(minutes=2)
+    assert rule_lookback(rules[:1]) == timedelta(0)
+
+
+def test_evaluate_rules_columnar_alerts():
+    import numpy as np
+    from src.rules.engine import evaluate_rules
+    df = sample_df()
+    df["tx_id"] = ["t1", "t2", "t3", "t4"]
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 1000}},
+        {"name": "high_risk_mcc", "params": {"high_risk_mcc": [7995, 5967]}},
+    ]
+    alerts = evaluate_rules(df, rules)
+    assert list(alerts.columns) == ["tx_id", "rule_name", "score"]
+    assert sorted(zip(alerts["tx_id"], alerts["rule_name"])) == [
+        ("t2", "high_risk_mcc"), ("t2", "high_value"), ("t3", "high_risk_mcc"),
+    ]
+    only_last = evaluate_rules(df, rules, is_new=np.array([False, False, True, True]))
+    assert only_last["tx_id"].tolist() == ["t3"]
+
+
+def _random_cards_df(n=2000, seed=7):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 6 * 3600, size=n), unit="s")
+    return pd.DataFrame({
+        "card_id": rng.choice([f"c{i}" for i in range(40)], size=n),
+        "ts": ts,
+        "lat": rng.uniform(25, 49, size=n),
+        "lon": rng.uniform(-124, -67, size=n),
+    })
+
+
+def test_card_context_window_counts_match_rolling():
+    import numpy as np
+    from src.utils.cards import CardContext
+    df = _random_cards_df()
+    ctx = CardContext.build(df)
+    got = ctx.to_frame_order(ctx.window_counts(pd.Timedelta(minutes=5)))
+    s = df.sort_values(["card_id", "ts"], kind="stable")
+    ref = (
+        s.assign(one=1.0).set_index("ts").groupby("card_id")["one"]
+        .rolling("5min").count().to_numpy()
+    )
+    expected = pd.Series(ref, index=s.index).reindex(df.index).to_numpy()
+    np.testing.assert_array_equal(got, expected)
+
+
+def test_card_context_prev_speed_matches_shift():
+    import numpy as np
+    from src.utils.cards import CardContext, haversine_rad_km
+    df = _random_cards_df()
+    ctx = CardContext.build(df)
+    s = df.sort_values(["card_id", "ts"], kind="stable")
+    g = s.groupby("card_id")
+    dist = haversine_rad_km(*(np.radians(x.to_numpy(float)) for x in (g["lat"].shift(), g["lon"].shift(), s["lat"], s["lon"])))
+    hours = g["ts"].diff().dt.total_seconds().div(3600).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ref = np.nan_to_num(np.where(hours > 0, np.nan_to_num(dist) / hours, 0.0))
+    expected = pd.Series(ref, index=s.index).reindex(df.index).to_numpy()
+    np.testing.assert_allclose(ctx.to_frame_order(ctx.prev_speed_kmph()), expected)
+
+
+def test_parallel_rules_match_serial():
+    import numpy as np
+    from src.rules.engine import evaluate_rules
+    from src.rules.parallel import evaluate_rules_parallel
+    df = _random_cards_df(n=3000)
+    rng = np.random.default_rng(3)
+    df["tx_id"] = [f"t{i}" for i in range(len(df))]
+    df["amount"] = rng.lognormal(3.5, 1.5, size=len(df))
+    df["channel"] = rng.choice(["POS", "ECOM"], size=len(df))
+    df["mcc"] = rng.choice([5411, 7995], size=len(df))
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 500}},
+        {"name": "rapid_fire", "params": {"tx_per_min_threshold": 1, "window_minutes": 10}},
+        {"name": "geo_velocity", "params": {"geo_velocity_kmph": 1000}},
+        {"name": "night_owl_cnp", "params": {"cnp_channels": ["ECOM"], "start_hour": 0, "end_hour": 5}},
+    ]
+    is_new = rng.random(len(df)) < 0.5
+    pd.testing.assert_frame_equal(evaluate_rules(df, rules), evaluate_rules_parallel(df, rules, workers=2))
+    pd.testing.assert_frame_equal(
+        evaluate_rules(df, rules, is_new=is_new),
+        evaluate_rules_parallel(df, rules, workers=3, is_new=is_new),
+    )
+
+
+def test_rule_stats_recorded_per_rule():
+    import tracemalloc
+    import numpy as np
+    from src.rules.engine import rule_flags
+    from src.rules.instrument import stats_frame
+    from src.rules.parallel import evaluate_rules_parallel
+    df = _random_cards_df(n=2000)
+    df["tx_id"] = [f"t{i}" for i in range(len(df))]
+    df["amount"] = np.random.default_rng(5).lognormal(3.5, 1.5, size=len(df))
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 500}},
+        {"name": "rapid_fire", "params": {"tx_per_min_threshold": 1, "window_minutes": 10}},
+    ]
+    stats = []
+    tracemalloc.start()
+    try:
+        flags = rule_flags(df, rules, stats)
+    finally:
+        tracemalloc.stop()
+    assert [s["rule_name"] for s in stats] == ["high_value", "rapid_fire"]
+    assert [s["rows_flagged"] for s in stats] == flags.sum(axis=1).tolist()
+    assert all(s["rows_in"] == len(df) and s["wall_ms"] >= 0 and s["peak_mem_bytes"] > 0 for s in stats)
+
+    par = []
+    evaluate_rules_parallel(df, rules, workers=2, stats=par)
+    assert [(s["rule_name"], s["rows_in"], s["rows_flagged"], s["workers"]) for s in par] == [
+        (s["rule_name"], s["rows_in"], s["rows_flagged"], 2) for s in stats
+    ]
+    out = stats_frame(par, "00000000-0000-0000-0000-000000000000")
+    assert out["params"].iloc[0] == '{"amount_threshold": 500}'
+    assert out["peak_mem_bytes"].isna().all()
+
+
+def test_online_scorer_matches_batch():
+    import numpy as np
+    from src.rules.engine import evaluate_rules
+    from src.rules.online import OnlineRuleScorer
+    df = _random_cards_df(n=3000)
+    rng = np.random.default_rng(5)
+    df["tx_id"] = [f"t{i}" for i in range(len(df))]
+    df["amount"] = rng.lognormal(3.5, 1.5, size=len(df))
+    df["channel"] = rng.choice(["POS", "ECOM"], size=len(df))
+    df["mcc"] = rng.choice([5411, 7995], size=len(df))
+    df.loc[df.index[::50], "ts"] = df["ts"].iloc[1]  # identical timestamps
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 500}},
+        {"name": "rapid_fire", "params": {"tx_per_min_threshold": 2, "window_minutes": 10}},
+        {"name": "geo_velocity", "params": {"geo_velocity_kmph": 1000}},
+        {"name": "high_risk_mcc", "params": {"high_risk_mcc": [7995]}},
+        {"name": "night_owl_cnp", "params": {"cnp_channels": ["ECOM"], "start_hour": 0, "end_hour": 5}},
+    ]
+    batch = evaluate_rules(df, rules)
+    online = OnlineRuleScorer(rules).replay(df)
+    assert (batch["rule_name"] == "rapid_fire").any()
+    assert set(zip(batch["tx_id"], batch["rule_name"])) == set(zip(online["tx_id"], online["rule_name"]))
+
+
+def test_compile_stateless_rules_to_sql():
+    import pytest
+    from src.rules.sql import can_push_down, compile_rule
+    sql, params = compile_rule({"name": "high_risk_mcc", "params": {"high_risk_mcc": ["7995", 5967]}}, prefix="r1_")
+    assert sql == "m.mcc = ANY(:r1_mccs)" and params == {"r1_mccs": [7995, 5967]}
+    sql, params = compile_rule({"name": "night_owl_cnp", "params": {"cnp_channels": ["ECOM"], "start_hour": 0, "end_hour": 5}})
+    assert "EXTRACT(HOUR FROM t.ts)" in sql and params["channels"] == ["ECOM"]
+    assert not can_push_down({"name": "rapid_fire"})
+    with pytest.raises(ValueError):
+        compile_rule({"name": "geo_velocity", "params": {"geo_velocity_kmph": 1000}})
+
+
+def test_rules_scale_benchmark_flags_regression():
+    from benchmarks.rules_scale import check_against_baseline, parse_count, run_case
+    rules = [
+        {"name": "high_value", "params": {"amount_threshold": 1000}},
+        {"name": "rapid_fire", "params": {"tx_per_min_threshold": 5, "window_minutes": 2}},
+    ]
+    results = run_case(parse_count("2k"), cards=100, skew=1.1, rules=rules, repeat=1)
+    assert {r["stage"] for r in results} == {"context", "high_value", "rapid_fire", "evaluate_rules"}
+    for r in results:
+        r["seconds"] = 1.0
+        r["rows_per_sec"] = 1000.0
+    baseline = {f"2000:100:1.1:{r['stage']}": 2000.0 for r in results}
+    assert len(check_against_baseline(results, baseline, tolerance=0.2)) == len(results)
+    assert not check_against_baseline(results, baseline, tolerance=0.6)
+    # No baseline is a failure, not a pass
+    assert len(check_against_baseline(results, {}, tolerance=0.6)) == len(results)
+
+
+def test_incremental_scoring_alerts_back_dated_rows(pg, monkeypatch):
+    from datetime import timedelta
+    from sqlalchemy import text
+    from src.rules import engine
+    from src.utils import copy_df
+    monkeypatch.setattr(engine, "read_sql", lambda q, params=None: pd.read_sql(text(q), pg, params=params))
+    card = pg.execute(text(
+        "INSERT INTO cards (pan_last4, brand, exp_date, status) VALUES ('0000', 'VISA', '2030-01-01', 'ACTIVE') RETURNING card_id"
+    )).scalar()
+    merchant = pg.execute(text(
+        "INSERT INTO merchants (name, mcc, country, risk_tier) VALUES ('m', 5411, 'US', 1) RETURNING merchant_id"
+    )).scalar()
+    loaded = pg.execute(text("SELECT MAX(ingested_at) FROM transactions")).scalar()
+    t0 = pd.Timestamp("2024-01-01 12:00")
+
+    def rows(prefix, offsets, ingested_at):
+        return pd.DataFrame({
+            "tx_id": [f"{prefix}{i:07x}-2222-4222-8222-222222222222" for i in range(len(offsets))],
+            "card_id": str(card), "merchant_id": str(merchant),
+            "ts": [t0 + pd.Timedelta(seconds=s) for s in offsets],
+            "amount": 10.0, "currency": "USD", "lat": 40.0, "lon": -74.0, "channel": "POS",
+            "ingested_at": ingested_at,
+        })
+
+    # Scored long ago, then a back-dated burst lands ahead of one of them
+    old = rows("a", [60, 600, 1200], loaded - timedelta(days=1))
+    burst = rows("b", [0, 10, 20, 30, 40, 50], loaded + timedelta(hours=1))
+    copy_df(old, "transactions", con=pg)
+    copy_df(burst, "transactions", con=pg)
+
+    rule = {"name": "rapid_fire", "params": {"tx_per_min_threshold": 5, "window_minutes": 2}}
+    high = engine._run_high(loaded, None, "ingested_at")
+    alerts = engine._score_window([rule], loaded, high, None, "ingested_at", 1, False, [])
+    assert sorted(alerts["tx_id"].astype(str)) == sorted([burst["tx_id"].iloc[-1], old["tx_id"].iloc[0]])
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from src.utils.db import merge_df, merge_sql, update_df, update_sql
+from src.utils.frames import TX_SCHEMA, decode_uuid, encode_frames, encode_uuid
+
+
+def test_uuid_roundtrip():
+    ids = [str(uuid.uuid4()) for _ in range(50)] + ["00000000-0000-0000-0000-0000000000ff"]
+    enc = encode_uuid(ids)
+    assert enc.dtype == np.dtype("S16")
+    assert decode_uuid(enc).tolist() == ids
+    assert encode_uuid([uuid.UUID(ids[0])])[0] == enc[0]
+    assert decode_uuid(encode_uuid([ids[1].upper()]))[0] == ids[1]
+
+
+def test_encode_frames_across_chunks():
+    cards = [str(uuid.uuid4()) for _ in range(3)]
+    df = pd.DataFrame({
+        "tx_id": [str(uuid.uuid4()) for _ in range(6)],
+        "card_id": [cards[0], cards[1], None, cards[2], cards[0], cards[2]],
+        "ts": pd.date_range("2024-01-01", periods=6, freq="h"),
+        "amount": [1.25, 2.5, 3.75, 5.0, 6.25, 7.5],
+        "lat": [40.5, np.nan, 41.25, 42.0, 43.0, 44.0],
+        "channel": ["POS", "POS", "ECOM", "ATM", "ECOM", "POS"],
+    })
+    typed = encode_frames([df.iloc[:3], df.iloc[3:]], TX_SCHEMA)
+
+    assert "tx_id" not in typed.frame and typed.uuids["tx_id"].dtype == np.dtype("S16")
+    assert typed.frame["card_id"].dtype == np.int32
+    # Codes are consistent across chunks and nulls keep code -1
+    assert typed.frame["card_id"].tolist() == [0, 1, -1, 2, 0, 2]
+    assert isinstance(typed.frame["channel"].dtype, pd.CategoricalDtype)
+    assert typed.frame["lat"].dtype == np.float32
+    assert typed.frame["amount"].dtype == np.float64
+
+    out = typed.decode()
+    assert list(out.columns) == list(df.columns)
+    assert out["tx_id"].tolist() == df["tx_id"].tolist()
+    assert out["card_id"].tolist() == df["card_id"].tolist()
+    assert out["channel"].tolist() == df["channel"].tolist()
+    np.testing.assert_allclose(out["lat"].astype(float), df["lat"], equal_nan=True)
+    assert typed.decode(["tx_id"], rows=np.array([4]))["tx_id"].iloc[0] == df["tx_id"].iloc[4]
+
+
+def test_encode_frames_all_null_code_chunk():
+    df = pd.DataFrame({"device_id": [None, None, "d1", None, "d2", "d1"], "amount": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+    # The first chunk has no non-null device at all, so its dictionary starts empty
+    typed = encode_frames([df.iloc[:2], df.iloc[2:4], df.iloc[4:]], TX_SCHEMA)
+    assert typed.frame["device_id"].tolist() == [-1, -1, 0, -1, 1, 0]
+    assert typed.decode()["device_id"].tolist() == df["device_id"].tolist()
+
+    only_null = encode_frames([df.iloc[:2]], TX_SCHEMA)
+    assert only_null.frame["device_id"].tolist() == [-1, -1]
+    assert only_null.decode()["device_id"].tolist() == [None, None]
+
+
+def test_merge_sql_shape():
+    sql = merge_sql("alerts", "pg_temp._stage_alerts", ["tx_id", "rule_name", "score"], ["tx_id", "rule_name"])
+    assert sql == (
+        "INSERT INTO alerts (tx_id, rule_name, score) SELECT tx_id, rule_name, score FROM pg_temp._stage_alerts "
+        "ON CONFLICT (tx_id, rule_name) DO NOTHING"
+    )
+    sql = merge_sql("model_features", "s", ["tx_id", "a", "b"], ["tx_id"], update_cols=["a"])
+    assert "SELECT DISTINCT ON (tx_id) tx_id, a, b FROM s" in sql
+    assert sql.endswith("ON CONFLICT (tx_id) DO UPDATE SET a = EXCLUDED.a")
+
+
+def test_merge_df_is_idempotent_and_spares_permanent_tables(pg):
+    pg.exec_driver_sql("CREATE TEMP TABLE merge_target (k TEXT PRIMARY KEY, v INT)")
+    # A permanent table with the staging name must survive the staging drop
+    pg.exec_driver_sql("CREATE TABLE _stage_merge_target (keep INT)")
+    df = pd.DataFrame({"k": ["a", "b", "c"], "v": [1, 2, 3]})
+    assert merge_df(df, "merge_target", ["k"], con=pg) == 3
+    assert merge_df(df, "merge_target", ["k"], con=pg) == 0
+    assert merge_df(df.assign(v=[10, 20, 30]).iloc[:2], "merge_target", ["k"], con=pg, update_cols=["v"]) == 2
+    rows = pg.exec_driver_sql("SELECT k, v FROM merge_target ORDER BY k").fetchall()
+    assert [tuple(r) for r in rows] == [("a", 10), ("b", 20), ("c", 3)]
+    assert pg.exec_driver_sql("SELECT to_regclass('public._stage_merge_target')").scalar() is not None
+
+
+def test_update_df_only_touches_existing_rows(pg):
+    assert update_sql("model_features", "s", ["tx_id"], ["a", "b"]) == (
+        "UPDATE model_features t SET a = s.a, b = s.b FROM s s WHERE t.tx_id = s.tx_id"
+    )
+    pg.exec_driver_sql("CREATE TEMP TABLE update_target (k TEXT PRIMARY KEY, v INT, w INT)")
+    pg.exec_driver_sql("INSERT INTO update_target VALUES ('a', 1, 7), ('b', 2, 8)")
+    df = pd.DataFrame({"k": ["a", "b", "orphan"], "v": [10, 20, 30]})
+    assert update_df(df, "update_target", ["k"], ["v"], con=pg) == 2
+    rows = pg.exec_driver_sql("SELECT k, v, w FROM update_target ORDER BY k").fetchall()
+    assert [tuple(r) for r in rows] == [("a", 10, 7), ("b", 20, 8)]
+
+
+def test_rule_score_run_ledger(pg):
+    from sqlalchemy import text
+    from src.rules.engine import _finish_run, _start_run
+    from src.utils import get_engine
+    high = pd.Timestamp("2024-01-02").to_pydatetime()
+    run_id = _start_run(False, None, high, 2)
+    try:
+        with get_engine().begin() as con:
+            row = con.execute(text("SELECT mode, status, window_end FROM rule_score_runs WHERE run_id = :r"), {"r": run_id}).one()
+            assert (row.mode, row.status, row.window_end) == ("window", "RUNNING", high)
+            _finish_run(con, run_id, "SUCCEEDED", alerts_generated=5, alerts_inserted=3)
+        with get_engine().begin() as con:
+            row = con.execute(text("SELECT status, alerts_generated, alerts_inserted, finished_at FROM rule_score_runs WHERE run_id = :r"), {"r": run_id}).one()
+        assert (row.status, row.alerts_generated, row.alerts_inserted) == ("SUCCEEDED", 5, 3) and row.finished_at is not None
+    finally:
+        with get_engine().begin() as con:
+            con.execute(text("DELETE FROM rule_score_runs WHERE run_id = :r"), {"r": run_id})